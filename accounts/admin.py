@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Subscription, UserEducationProfile
+from .models import UserProfile, Subscription, UserEducationProfile, UserSummary
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -64,3 +64,10 @@ class UserEducationProfileAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         })
     )
+
+@admin.register(UserSummary)
+class UserSummaryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'progress_count', 'completed_count', 'current_streak', 'last_activity', 'is_premium', 'updated_at']
+    list_filter = ['is_premium', 'onboarding_completed']
+    search_fields = ['user__username', 'user__email']
+    readonly_fields = [field.name for field in UserSummary._meta.fields]
@@ -0,0 +1,47 @@
+"""
+Authentication backends for SUA PA AI.
+"""
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from .hashing import verify_password, averify_password, make_dummy_hash, amake_dummy_hash
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that verifies passwords on the hashing worker pool and upgrades
+    outdated hashes in the background instead of during the request.
+
+    The pool bounds how many hashes run at once, but the request thread still
+    blocks on check_password_pooled(...).result() for the full hash.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # Run the hasher once to reduce the timing difference between an
+            # existing and a nonexistent user
+            make_dummy_hash(password)
+            return None
+        if verify_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            await amake_dummy_hash(password)
+            return None
+        if await averify_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
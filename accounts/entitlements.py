@@ -0,0 +1,118 @@
+"""
+Entitlement service for SUA PA AI.
+
+Combines UserProfile.is_premium/premium_expiry and the user's active
+Subscriptions into one effective plan. Results are cached in process until
+the earliest expiry that could change the answer, capped at
+ENTITLEMENT_CACHE_TTL seconds so changes made by other processes are picked
+up. Saving a profile or subscription drops the cached plan in the saving
+process at once.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import UserProfile, Subscription
+
+# Plans in increasing order of access
+PLAN_RANKS = {
+    'free': 0,
+    'basic': 1,
+    'premium': 2,
+    'enterprise': 3,
+}
+PREMIUM_PLANS = ['premium', 'enterprise']
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_MAX_ENTRIES = 10000
+
+
+class Entitlement:
+    """
+    A user's effective plan and when it may next change on its own.
+    """
+
+    def __init__(self, plan, expires_at=None):
+        self.plan = plan
+        self.expires_at = expires_at
+
+    @property
+    def is_premium(self):
+        return self.plan in PREMIUM_PLANS
+
+    def __repr__(self):
+        return f"Entitlement({self.plan!r}, expires_at={self.expires_at!r})"
+
+
+def compute_entitlement(user_id):
+    """
+    Work out a user's effective plan from their profile and active subscriptions.
+    """
+    now = timezone.now()
+    plan = 'free'
+    expiries = []
+
+    profile = UserProfile.objects.filter(user_id=user_id).values('is_premium', 'premium_expiry').first()
+    if profile and profile['is_premium'] and (profile['premium_expiry'] is None or profile['premium_expiry'] > now):
+        plan = 'premium'
+        if profile['premium_expiry']:
+            expiries.append(profile['premium_expiry'])
+
+    subscriptions = Subscription.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=now),
+        user_id=user_id,
+        status='active'
+    ).values_list('plan', 'end_date')
+    for subscription_plan, end_date in subscriptions:
+        if PLAN_RANKS.get(subscription_plan, 0) > PLAN_RANKS[plan]:
+            plan = subscription_plan
+        if end_date:
+            expiries.append(end_date)
+
+    return Entitlement(plan, min(expiries) if expiries else None)
+
+
+def _cache_until(entitlement):
+    ttl = getattr(settings, 'ENTITLEMENT_CACHE_TTL', 300)
+    cache_until = timezone.now() + timedelta(seconds=ttl)
+    if entitlement.expires_at and entitlement.expires_at < cache_until:
+        cache_until = entitlement.expires_at
+    return cache_until
+
+
+def get_entitlement(user):
+    """
+    Return the user's Entitlement, using the process cache when still valid.
+    """
+    if not user.is_authenticated:
+        return Entitlement('free')
+
+    now = timezone.now()
+    with _cache_lock:
+        cached = _cache.get(user.pk)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    entitlement = compute_entitlement(user.pk)
+    _store(user.pk, entitlement, _cache_until(entitlement))
+    return entitlement
+
+
+def _store(user_id, entitlement, cache_until):
+    with _cache_lock:
+        _cache[user_id] = (entitlement, cache_until)
+        _cache.move_to_end(user_id)
+        while len(_cache) > _CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def invalidate_entitlement(user_id):
+    """
+    Drop the cached entitlement of a user, e.g. after their subscription changes.
+    """
+    with _cache_lock:
+        _cache.pop(user_id, None)
@@ -0,0 +1,20 @@
+"""
+Password hashers for SUA PA AI.
+"""
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the work factor taken from settings.PASSWORD_HASH_ITERATIONS.
+
+    Hashes are stored in the standard pbkdf2_sha256 format, so changing the cost
+    re-hashes existing passwords on their next login. Values below Django's
+    default are ignored: they would weaken existing hashes.
+    """
+    iterations = max(
+        getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or PBKDF2PasswordHasher.iterations,
+        PBKDF2PasswordHasher.iterations
+    )
@@ -0,0 +1,139 @@
+"""
+Password verification worker pool for SUA PA AI.
+
+PBKDF2 releases the GIL while hashing, so verifications run on a small thread
+pool sized to the available cores. A bounded number of verifications may be in
+flight at once; beyond that, callers get HashingBusy instead of piling more CPU
+work onto an already saturated machine. Hashes created with an outdated hasher
+or work factor are re-hashed in the background after a successful login.
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    """
+    Raised when the verification queue is full.
+    """
+    pass
+
+
+def _get_pool():
+    global _executor, _slots
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                workers = getattr(settings, 'PASSWORD_HASH_WORKERS', None) or os.cpu_count() or 1
+                queue_size = getattr(settings, 'PASSWORD_HASH_QUEUE_SIZE', workers * 8)
+                _slots = threading.BoundedSemaphore(workers + queue_size)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    return _executor, _slots
+
+
+def _submit(fn, *args, wait=True):
+    executor, slots = _get_pool()
+    timeout = getattr(settings, 'PASSWORD_HASH_QUEUE_TIMEOUT', 5) if wait else None
+    if not slots.acquire(blocking=wait, timeout=timeout):
+        raise HashingBusy('Password verification queue is full.')
+    future = executor.submit(fn, *args)
+    future.add_done_callback(lambda f: slots.release())
+    return future
+
+
+def needs_rehash(encoded):
+    """
+    Whether a stored hash was made with a hasher or work factor other than the preferred one.
+    """
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    preferred = get_hasher('default')
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def _rehash(user_id, raw_password, old_encoded):
+    try:
+        # Only replace the hash we verified against, so a concurrent password
+        # change is never overwritten
+        User.objects.filter(pk=user_id, password=old_encoded).update(password=make_password(raw_password))
+    finally:
+        close_old_connections()
+
+
+def schedule_rehash(user, raw_password):
+    """
+    Upgrade a user's password hash in the background. Skipped if the pool is busy;
+    the upgrade is then retried on the next login.
+    """
+    try:
+        _submit(_rehash, user.pk, raw_password, user.password, wait=False)
+    except HashingBusy:
+        pass
+
+
+def verify_password(user, raw_password):
+    """
+    Check a raw password against the user's stored hash on the worker pool.
+    Raises HashingBusy if too many verifications are already queued.
+    """
+    encoded = user.password
+    if not check_password_pooled(raw_password, encoded):
+        return False
+    if needs_rehash(encoded):
+        schedule_rehash(user, raw_password)
+    return True
+
+
+def check_password_pooled(raw_password, encoded):
+    """
+    Run django.contrib.auth.hashers.check_password on the worker pool and wait for it.
+    """
+    return _submit(check_password, raw_password, encoded).result()
+
+
+def make_password_pooled(raw_password):
+    """
+    Run django.contrib.auth.hashers.make_password on the worker pool and wait for it.
+    """
+    return _submit(make_password, raw_password).result()
+
+
+async def averify_password(user, raw_password):
+    """
+    Async variant of verify_password that awaits the pool instead of blocking.
+    Raises HashingBusy right away when the queue is full rather than stalling the event loop.
+    """
+    encoded = user.password
+    future = _submit(check_password, raw_password, encoded, wait=False)
+    if not await asyncio.wrap_future(future):
+        return False
+    if needs_rehash(encoded):
+        schedule_rehash(user, raw_password)
+    return True
+
+
+def make_dummy_hash(raw_password):
+    """
+    Hash a password on the pool and discard the result, to keep the timing of
+    unknown usernames close to that of known ones.
+    """
+    _submit(make_password, raw_password).result()
+
+
+async def amake_dummy_hash(raw_password):
+    """
+    Async variant of make_dummy_hash.
+    """
+    await asyncio.wrap_future(_submit(make_password, raw_password, wait=False))
@@ -0,0 +1,40 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, get_hasher
+from django.core.management.base import BaseCommand
+from accounts.hashing import check_password_pooled
+
+class Command(BaseCommand):
+    help = 'Benchmark password verification throughput (logins/sec per core and through the hashing pool)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=40, help='Number of verifications per measurement')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Simulated concurrent request threads for the pooled measurement')
+
+    def handle(self, *args, **options):
+        logins = options['logins']
+        password = 'correct horse battery staple'
+        configured = get_hasher('default')
+
+        self.stdout.write(f'Cores available: {os.cpu_count()}')
+        for label, hasher in [
+            (f'Django default PBKDF2 ({PBKDF2PasswordHasher.iterations} iterations)', PBKDF2PasswordHasher()),
+            (f'Configured {configured.algorithm} ({getattr(configured, "iterations", "n/a")} iterations)', configured),
+        ]:
+            encoded = hasher.encode(password, hasher.salt())
+            started = time.perf_counter()
+            for _ in range(logins):
+                check_password(password, encoded)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{label}: {logins / elapsed:.1f} logins/sec per core')
+
+        encoded = configured.encode(password, configured.salt())
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as requests:
+            list(requests.map(lambda _: check_password_pooled(password, encoded), range(logins)))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f'Pooled verification with {options["concurrency"]} request threads: {logins / elapsed:.1f} logins/sec')
+        )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Q
+from accounts.entitlements import PREMIUM_PLANS, invalidate_entitlement
+from accounts.models import Subscription, UserProfile, UserSummary
+
+class Command(BaseCommand):
+    help = 'Mark lapsed subscriptions as expired and clear lapsed premium flags in bulk'
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # Both queries are range scans on the (status, end_date) and
+        # (is_premium, premium_expiry) indexes
+        lapsed_subscriptions = Subscription.objects.filter(status='active', end_date__lte=now)
+        lapsed_profiles = UserProfile.objects.filter(is_premium=True, premium_expiry__lte=now)
+
+        with transaction.atomic():
+            user_ids = set(lapsed_subscriptions.values_list('user_id', flat=True))
+            user_ids.update(lapsed_profiles.values_list('user_id', flat=True))
+            expired = lapsed_subscriptions.update(status='expired', updated_at=now)
+            downgraded = lapsed_profiles.update(is_premium=False, updated_at=now)
+
+            # Queryset updates skip signals, so refresh the dependent caches here
+            still_premium = set(Subscription.objects.filter(
+                Q(end_date__isnull=True) | Q(end_date__gt=now),
+                user_id__in=user_ids,
+                status='active',
+                plan__in=PREMIUM_PLANS
+            ).values_list('user_id', flat=True))
+            still_premium.update(UserProfile.objects.filter(
+                Q(premium_expiry__isnull=True) | Q(premium_expiry__gt=now),
+                user_id__in=user_ids,
+                is_premium=True
+            ).values_list('user_id', flat=True))
+            UserSummary.objects.filter(pk__in=user_ids - still_premium).update(is_premium=False)
+
+        for user_id in user_ids:
+            invalidate_entitlement(user_id)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Expired {expired} subscriptions and {downgraded} premium profiles for {len(user_ids)} users')
+        )
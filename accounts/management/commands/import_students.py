@@ -0,0 +1,52 @@
+import csv
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from accounts.registration import bulk_register
+
+class Command(BaseCommand):
+    help = 'Bulk-register students from a school roster CSV (username, email, first_name, last_name, [password, phone_number, date_of_birth])'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path to the roster CSV file')
+        parser.add_argument('--default-password', default=None,
+                            help='Password for rows without one (otherwise those accounts get an unusable password)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of students written per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            roster = open(options['csv_file'], newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Could not open roster: {e}')
+
+        self.stdout.write('Importing students...')
+        started = time.perf_counter()
+        with roster:
+            reader = csv.DictReader(roster)
+            missing = {'username', 'email'} - set(reader.fieldnames or [])
+            if missing:
+                raise CommandError(f'Roster is missing required columns: {", ".join(sorted(missing))}')
+
+            created, skipped = bulk_register(
+                (self._clean_row(row) for row in reader),
+                default_password=options['default_password'],
+                batch_size=options['batch_size']
+            )
+        elapsed = time.perf_counter() - started
+
+        rate = created / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(f'Created {created} students, skipped {skipped} in {elapsed:.2f}s ({rate:.0f} students/sec)')
+        )
+
+    def _clean_row(self, row):
+        row = {key: (value or '').strip() for key, value in row.items() if key}
+        date_of_birth = None
+        if row.get('date_of_birth'):
+            try:
+                date_of_birth = datetime.strptime(row['date_of_birth'], '%Y-%m-%d').date()
+            except ValueError:
+                pass  # Keep as None if invalid
+        row['date_of_birth'] = date_of_birth
+        return row
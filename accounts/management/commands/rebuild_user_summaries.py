@@ -0,0 +1,15 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from accounts.models import UserSummary
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized dashboard summary for every user'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding user summaries...')
+        count = 0
+        for user in User.objects.iterator(chunk_size=500):
+            UserSummary.objects.filter(pk=user.pk).delete()
+            UserSummary.rebuild(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} user summaries'))
@@ -2,24 +2,18 @@
 Authentication middleware for SUA PA AI
 """
 
+from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib import messages
 from django.utils.deprecation import MiddlewareMixin
+from .hashing import HashingBusy
 
 class AuthenticationMiddleware(MiddlewareMixin):
     """
     Custom authentication middleware to handle redirects and user flow
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-        super().__init__(get_response)
-
-    def __call__(self, request):
-        response = self.get_response(request)
-        return response
-
     def process_request(self, request):
         """
         Process requests before they reach the view
@@ -46,14 +40,6 @@ class ProfileCompletionMiddleware(MiddlewareMixin):
     Middleware to ensure user profiles are completed
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-        super().__init__(get_response)
-
-    def __call__(self, request):
-        response = self.get_response(request)
-        return response
-
     def process_request(self, request):
         """
         Check if authenticated users have completed their profiles
@@ -95,13 +81,7 @@ class SecurityHeadersMiddleware(MiddlewareMixin):
     Add security headers to responses
     """
 
-    def __init__(self, get_response):
-        self.get_response = get_response
-        super().__init__(get_response)
-
-    def __call__(self, request):
-        response = self.get_response(request)
-
+    def process_response(self, request, response):
         # Add security headers
         if not response.get('X-Content-Type-Options'):
             response['X-Content-Type-Options'] = 'nosniff'
@@ -112,4 +92,18 @@ class SecurityHeadersMiddleware(MiddlewareMixin):
         if not response.get('X-XSS-Protection'):
             response['X-XSS-Protection'] = '1; mode=block'
 
-        return response
\ No newline at end of file
+        return response
+
+
+class HashingBusyMiddleware(MiddlewareMixin):
+    """
+    Answer 503 when password hashing is saturated, for authenticate()
+    callers that don't handle HashingBusy themselves (e.g. admin login)
+    """
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, HashingBusy):
+            return None
+        response = HttpResponse('Too many sign-in attempts right now. Please try again shortly.', status=503)
+        response['Retry-After'] = '5'
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_userprofile_difficulty_preference_and_more'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('has_profile', models.BooleanField(default=False)),
+                ('onboarding_completed', models.BooleanField(default=False)),
+                ('has_education_profile', models.BooleanField(default=False)),
+                ('favorite_subjects_count', models.IntegerField(default=0)),
+                ('progress_count', models.IntegerField(default=0)),
+                ('in_progress_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('top_subjects', models.JSONField(blank=True, default=list, help_text="Names of the user's strongest subjects")),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('current_streak', models.IntegerField(default=0, help_text='Consecutive days with learning activity')),
+                ('streak_updated_on', models.DateField(blank=True, null=True)),
+                ('is_premium', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Summary',
+                'verbose_name_plural': 'User Summaries',
+            },
+        ),
+    ]
@@ -2,8 +2,9 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
+from .tracking import DirtyFieldsMixin
 
-class UserProfile(models.Model):
+class UserProfile(DirtyFieldsMixin, models.Model):
     LEARNING_STYLE_CHOICES = [
         ('visual', 'Visual Learner'),
         ('auditory', 'Auditory Learner'),
@@ -101,6 +102,9 @@ class UserProfile(models.Model):
     class Meta:
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
+        indexes = [
+            models.Index(fields=['is_premium', 'premium_expiry']),
+        ]
 
 class Subscription(models.Model):
     PLAN_CHOICES = [
@@ -131,8 +135,11 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = "Subscription"
         verbose_name_plural = "Subscriptions"
+        indexes = [
+            models.Index(fields=['status', 'end_date']),
+        ]
 
-class UserEducationProfile(models.Model):
+class UserEducationProfile(DirtyFieldsMixin, models.Model):
     user_profile = models.OneToOneField(UserProfile, on_delete=models.CASCADE, related_name='education_profile')
 
     # Subject preferences and strengths
@@ -205,8 +212,131 @@ class UserEducationProfile(models.Model):
             )
 
             self.overall_performance = (avg_progress['avg_score'] or 0 + avg_progress['avg_progress'] or 0) / 2
-            self.save()
+            self.save_changes()
 
     class Meta:
         verbose_name = "User Education Profile"
         verbose_name_plural = "User Education Profiles"
+
+class UserSummary(models.Model):
+    """
+    Denormalized dashboard data for a user, kept up to date by the signal
+    handlers in accounts/signals.py so the dashboard needs a single lookup.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+
+    # Profile state
+    has_profile = models.BooleanField(default=False)
+    onboarding_completed = models.BooleanField(default=False)
+    has_education_profile = models.BooleanField(default=False)
+    favorite_subjects_count = models.IntegerField(default=0)
+
+    # Learning activity
+    progress_count = models.IntegerField(default=0)
+    in_progress_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    top_subjects = models.JSONField(default=list, blank=True, help_text="Names of the user's strongest subjects")
+    last_activity = models.DateTimeField(null=True, blank=True)
+    current_streak = models.IntegerField(default=0, help_text="Consecutive days with learning activity")
+    streak_updated_on = models.DateField(null=True, blank=True)
+
+    is_premium = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    TOP_SUBJECTS_LIMIT = 3
+
+    def __str__(self):
+        return f"Summary - {self.user.username}"
+
+    @classmethod
+    def for_user(cls, user):
+        """
+        Fetch the summary by primary key, building it from scratch if it does not exist yet.
+        """
+        try:
+            return cls.objects.get(pk=user.pk)
+        except cls.DoesNotExist:
+            return cls.rebuild(user)
+
+    @classmethod
+    def rebuild(cls, user):
+        summary = cls(user=user)
+        summary.refresh_profile(save=False)
+        summary.refresh_progress(save=False)
+        summary.refresh_premium(save=False)
+        summary.save()
+        return summary
+
+    def refresh_profile(self, save=True):
+        try:
+            profile = UserProfile.objects.get(user_id=self.user_id)
+        except UserProfile.DoesNotExist:
+            self.has_profile = False
+            self.onboarding_completed = False
+            self.has_education_profile = False
+            self.favorite_subjects_count = 0
+        else:
+            self.has_profile = True
+            self.onboarding_completed = profile.onboarding_completed
+            education_profile = UserEducationProfile.objects.filter(user_profile=profile).first()
+            self.has_education_profile = education_profile is not None
+            self.favorite_subjects_count = education_profile.favorite_subjects.count() if education_profile else 0
+        if save:
+            self.save()
+
+    def refresh_progress(self, save=True):
+        from companion.models import UserLearningProgress
+        progress = UserLearningProgress.objects.filter(user_id=self.user_id)
+        counts = progress.aggregate(
+            total=models.Count('id'),
+            in_progress=models.Count('id', filter=models.Q(status='in_progress')),
+            completed=models.Count('id', filter=models.Q(status__in=['completed', 'mastered'])),
+            last_activity=models.Max('updated_at'),
+        )
+        self.progress_count = counts['total']
+        self.in_progress_count = counts['in_progress']
+        self.completed_count = counts['completed']
+        self.top_subjects = list(
+            progress.values('knowledge_area__name')
+            .annotate(score=models.Max('progress_percentage'))
+            .order_by('-score', 'knowledge_area__name')
+            .values_list('knowledge_area__name', flat=True)[:self.TOP_SUBJECTS_LIMIT]
+        )
+        if counts['last_activity'] and (not self.last_activity or counts['last_activity'] > self.last_activity):
+            self.record_activity(counts['last_activity'], save=False)
+        if save:
+            self.save()
+
+    def refresh_premium(self, save=True):
+        from .entitlements import compute_entitlement
+        self.is_premium = compute_entitlement(self.user_id).is_premium
+        if save:
+            self.save()
+
+    def get_active_streak(self):
+        """
+        The streak as of today; it lapses once a full day passes without activity.
+        """
+        if self.streak_updated_on and (timezone.localdate() - self.streak_updated_on).days <= 1:
+            return self.current_streak
+        return 0
+
+    def record_activity(self, when, save=True):
+        """
+        Update last activity and the daily streak for activity at `when`.
+        """
+        day = timezone.localdate(when)
+        if self.streak_updated_on is None or (day - self.streak_updated_on).days > 1:
+            self.current_streak = 1
+        elif (day - self.streak_updated_on).days == 1:
+            self.current_streak += 1
+        if self.streak_updated_on is None or day > self.streak_updated_on:
+            self.streak_updated_on = day
+        if not self.last_activity or when > self.last_activity:
+            self.last_activity = when
+        if save:
+            self.save()
+
+    class Meta:
+        verbose_name = "User Summary"
+        verbose_name_plural = "User Summaries"
@@ -0,0 +1,161 @@
+"""
+Registration service for SUA PA AI.
+
+Creates a User together with its UserProfile and UserEducationProfile in a
+single transaction, and provides a batched path for importing school rosters.
+"""
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from .hashing import make_password_pooled
+from .models import UserProfile, UserEducationProfile
+
+
+class RegistrationError(Exception):
+    """
+    Raised when a registration cannot be completed, with a user-facing message.
+    """
+    pass
+
+
+def find_conflicts(username, email):
+    """
+    Check username and email availability with a single query.
+    Returns a set containing 'username' and/or 'email' for the values already taken.
+    """
+    conflicts = set()
+    taken = User.objects.filter(Q(username=username) | Q(email=email)).values_list('username', 'email')
+    for existing_username, existing_email in taken:
+        if existing_username == username:
+            conflicts.add('username')
+        if existing_email == email:
+            conflicts.add('email')
+    return conflicts
+
+
+def register_user(username, email, password, first_name='', last_name='', phone_number='', date_of_birth=None):
+    """
+    Create a User, its UserProfile and its UserEducationProfile together.
+    Raises RegistrationError if the username or email is already in use.
+    """
+    # Hash before opening the transaction so the write lock is not held
+    # while the password hasher runs
+    password_hash = make_password_pooled(password)
+    email = User.objects.normalize_email(email)
+
+    with transaction.atomic():
+        conflicts = find_conflicts(username, email)
+        if 'username' in conflicts:
+            raise RegistrationError('Username already exists.')
+        if 'email' in conflicts:
+            raise RegistrationError('Email already exists.')
+
+        user = User.objects.create(
+            username=username,
+            email=email,
+            password=password_hash,
+            first_name=first_name,
+            last_name=last_name
+        )
+        user_profile = UserProfile.objects.create(
+            user=user,
+            phone_number=phone_number,
+            date_of_birth=date_of_birth,
+            profile_completed=False,  # Will be completed in profile settings
+            onboarding_completed=False
+        )
+        UserEducationProfile.objects.create(user_profile=user_profile)
+
+    return user
+
+
+def bulk_register(rows, default_password=None, batch_size=500):
+    """
+    Import many students at once, e.g. from a school roster.
+
+    `rows` is an iterable of dicts with username, email, first_name, last_name
+    and optionally password, phone_number and date_of_birth. Rows whose username
+    or email is already taken (in the database or earlier in the input) are skipped.
+    Each distinct password is hashed only once, so rosters sharing a default
+    password are not bound by the cost of the password hasher.
+
+    Returns a (created, skipped) tuple.
+    """
+    created = 0
+    skipped = 0
+    seen_usernames = set()
+    seen_emails = set()
+    password_hashes = {}
+
+    def hash_password(raw_password):
+        if not raw_password:
+            return make_password(None)
+        if raw_password not in password_hashes:
+            password_hashes[raw_password] = make_password(raw_password)
+        return password_hashes[raw_password]
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            batch_created, batch_skipped = _register_batch(batch, default_password, hash_password, seen_usernames, seen_emails)
+            created += batch_created
+            skipped += batch_skipped
+            batch = []
+
+    if batch:
+        batch_created, batch_skipped = _register_batch(batch, default_password, hash_password, seen_usernames, seen_emails)
+        created += batch_created
+        skipped += batch_skipped
+
+    return created, skipped
+
+
+def _register_batch(batch, default_password, hash_password, seen_usernames, seen_emails):
+    # Stored emails are normalized, so look them up and compare them that way
+    batch = [{**row, 'email': User.objects.normalize_email(row['email'])} for row in batch]
+    usernames = [row['username'] for row in batch]
+    emails = [row['email'] for row in batch if row['email']]
+    taken = User.objects.filter(Q(username__in=usernames) | Q(email__in=emails)).values_list('username', 'email')
+    for existing_username, existing_email in taken:
+        seen_usernames.add(existing_username)
+        seen_emails.add(existing_email)
+
+    users = []
+    profile_data = []
+    skipped = 0
+    for row in batch:
+        username = row['username']
+        email = row['email']
+        if not username or username in seen_usernames or (email and email in seen_emails):
+            skipped += 1
+            continue
+        seen_usernames.add(username)
+        if email:
+            seen_emails.add(email)
+
+        users.append(User(
+            username=username,
+            email=email,
+            password=hash_password(row.get('password') or default_password),
+            first_name=row.get('first_name', ''),
+            last_name=row.get('last_name', '')
+        ))
+        profile_data.append((row.get('phone_number', ''), row.get('date_of_birth')))
+
+    if not users:
+        return 0, skipped
+
+    with transaction.atomic():
+        users = User.objects.bulk_create(users)
+        profiles = UserProfile.objects.bulk_create([
+            UserProfile(user=user, phone_number=phone_number, date_of_birth=date_of_birth)
+            for user, (phone_number, date_of_birth) in zip(users, profile_data)
+        ])
+        UserEducationProfile.objects.bulk_create([
+            UserEducationProfile(user_profile=profile) for profile in profiles
+        ])
+
+    return len(users), skipped
@@ -0,0 +1,78 @@
+"""
+Signal handlers keeping UserSummary in step with the rows it summarizes.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from companion.models import UserLearningProgress
+from .entitlements import invalidate_entitlement
+from .models import UserProfile, UserEducationProfile, Subscription, UserSummary
+
+
+def _update_summary(user_id, *refreshers):
+    with transaction.atomic():
+        summary, created = UserSummary.objects.select_for_update().get_or_create(user_id=user_id)
+        if created:
+            summary.refresh_profile(save=False)
+            summary.refresh_progress(save=False)
+            summary.refresh_premium(save=False)
+        else:
+            for refresh in refreshers:
+                refresh(summary)
+        summary.save()
+
+
+@receiver(post_save, sender=UserLearningProgress)
+def learning_progress_saved(sender, instance, **kwargs):
+    def refresh(summary):
+        summary.refresh_progress(save=False)
+        summary.record_activity(instance.updated_at, save=False)
+    _update_summary(instance.user_id, refresh)
+
+
+@receiver(post_delete, sender=UserLearningProgress)
+def learning_progress_deleted(sender, instance, **kwargs):
+    _update_summary(instance.user_id, lambda summary: summary.refresh_progress(save=False))
+
+
+@receiver([post_save, post_delete], sender=Subscription)
+def subscription_changed(sender, instance, **kwargs):
+    invalidate_entitlement(instance.user_id)
+    _update_summary(instance.user_id, lambda summary: summary.refresh_premium(save=False))
+
+
+# UserProfile fields that the summary and entitlements depend on
+SUMMARY_PROFILE_FIELDS = {'onboarding_completed', 'is_premium', 'premium_expiry'}
+
+
+@receiver(post_save, sender=UserProfile)
+def user_profile_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SUMMARY_PROFILE_FIELDS.intersection(update_fields):
+        return
+    invalidate_entitlement(instance.user_id)
+    def refresh(summary):
+        summary.refresh_profile(save=False)
+        summary.refresh_premium(save=False)
+    _update_summary(instance.user_id, refresh)
+
+
+@receiver(post_save, sender=UserEducationProfile)
+def education_profile_saved(sender, instance, created, **kwargs):
+    if created:
+        _update_summary(instance.user_profile.user_id, lambda summary: summary.refresh_profile(save=False))
+
+
+@receiver(m2m_changed, sender=UserEducationProfile.favorite_subjects.through)
+def favorite_subjects_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Changed from the KnowledgeArea side; pk_set holds education profile ids
+        if not pk_set:
+            return
+        user_ids = UserEducationProfile.objects.filter(pk__in=pk_set).values_list('user_profile__user_id', flat=True)
+    else:
+        user_ids = [instance.user_profile.user_id]
+    for user_id in user_ids:
+        _update_summary(user_id, lambda summary: summary.refresh_profile(save=False))
@@ -1,3 +1,253 @@
-from django.test import TestCase
+import importlib
+import os
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from companion.models import KnowledgeArea, UserLearningProgress
+from . import hashers, registration
+from .entitlements import get_entitlement, invalidate_entitlement
+from .hashing import HashingBusy
+from .middleware import HashingBusyMiddleware
+from .models import Subscription, UserEducationProfile, UserProfile, UserSummary
+from .tracking import sync_m2m
 
-# Create your tests here.
+urlpatterns = [path('accounts/', include('accounts.urls'))]
+
+
+def hasher_iterations():
+    # The work factor is read from settings when the module is imported
+    return importlib.reload(hashers).ConfigurablePBKDF2PasswordHasher.iterations
+
+
+class EntitlementTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('entitled', password='pw')
+        self.addCleanup(invalidate_entitlement, self.user.pk)
+
+    def test_cached_until_the_subscription_changes(self):
+        subscription = Subscription.objects.create(user=self.user, plan='premium', status='active')
+        self.assertEqual(get_entitlement(self.user).plan, 'premium')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_entitlement(self.user).plan, 'premium')
+
+        subscription.status = 'cancelled'
+        subscription.save()
+        self.assertEqual(get_entitlement(self.user).plan, 'free')
+
+
+class PasswordHashingTests(TestCase):
+
+    def test_iterations_never_drop_below_the_django_default(self):
+        self.addCleanup(importlib.reload, hashers)
+        with override_settings(PASSWORD_HASH_ITERATIONS=600000):
+            self.assertEqual(hasher_iterations(), PBKDF2PasswordHasher.iterations)
+        with override_settings(PASSWORD_HASH_ITERATIONS=None):
+            self.assertEqual(hasher_iterations(), PBKDF2PasswordHasher.iterations)
+        with override_settings(PASSWORD_HASH_ITERATIONS=PBKDF2PasswordHasher.iterations * 2):
+            self.assertEqual(hasher_iterations(), PBKDF2PasswordHasher.iterations * 2)
+
+    def test_saturated_hashing_answers_503(self):
+        request = RequestFactory().post('/admin/login/')
+        response = HashingBusyMiddleware(lambda request: None).process_exception(request, HashingBusy())
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+
+@override_settings(ROOT_URLCONF='accounts.tests')
+class SignupTests(TransactionTestCase):
+
+    def test_password_is_hashed_outside_a_transaction(self):
+        in_transaction = []
+
+        def hash_password(raw_password):
+            in_transaction.append(connection.in_atomic_block)
+            return make_password(raw_password)
+
+        with mock.patch.object(registration, 'make_password_pooled', hash_password):
+            response = self.client.post('/accounts/signup/', {
+                'username': 'newcomer', 'email': 'newcomer@example.com', 'password1': 'long enough',
+                'password2': 'long enough', 'first_name': 'New', 'last_name': 'Comer', 'agree_terms': 'on'
+            }, secure=True)
+
+        self.assertRedirects(response, '/accounts/profile-settings/', fetch_redirect_response=False)
+        self.assertEqual(in_transaction, [False])
+        self.assertTrue(User.objects.get(username='newcomer').check_password('long enough'))
+
+
+class BulkRegistrationTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('existing', email='Taken@school.edu', password='pw')
+
+    def test_skips_duplicates_across_batches_and_hashes_each_password_once(self):
+        rows = [
+            {'username': 'ama', 'email': 'ama@School.EDU'},
+            {'username': 'kofi', 'email': 'kofi@school.edu', 'password': 'own secret'},
+            {'username': 'yaw', 'email': 'Taken@SCHOOL.edu'},  # Email in the database once normalized
+            {'username': 'ama', 'email': 'other@school.edu'},  # Username earlier in the input
+            {'username': 'existing', 'email': 'new@school.edu'},  # Username in the database
+            {'username': 'esi', 'email': 'ama@school.edu'},  # Email earlier in the input
+            {'username': 'kwame', 'email': 'kwame@school.edu'},
+        ]
+        with mock.patch.object(registration, 'make_password', wraps=make_password) as hash_password, \
+                mock.patch.object(registration, '_register_batch', wraps=registration._register_batch) as register_batch:
+            created, skipped = registration.bulk_register(rows, default_password='shared secret', batch_size=2)
+
+        self.assertEqual((created, skipped), (3, 4))
+        self.assertEqual(register_batch.call_count, 4)
+        self.assertEqual(hash_password.call_count, 2)
+        self.assertEqual(
+            set(User.objects.exclude(username='existing').values_list('username', 'email')),
+            {('ama', 'ama@school.edu'), ('kofi', 'kofi@school.edu'), ('kwame', 'kwame@school.edu')}
+        )
+        ama, kofi, kwame = (User.objects.get(username=username) for username in ('ama', 'kofi', 'kwame'))
+        self.assertEqual(ama.password, kwame.password)
+        self.assertTrue(ama.check_password('shared secret'))
+        self.assertTrue(kofi.check_password('own secret'))
+        self.assertTrue(UserEducationProfile.objects.filter(user_profile__user=kwame).exists())
+
+    def test_import_students_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as roster:
+            roster.write('username,email,first_name,last_name,date_of_birth\n')
+            roster.write('abena,abena@school.edu,Abena,Mensah,2008-04-01\n')
+            roster.write('abena,abena2@school.edu,Abena,Owusu,\n')
+            roster.write('efua,efua@school.edu,Efua,Boateng,not a date\n')
+        self.addCleanup(os.remove, roster.name)
+
+        out = StringIO()
+        call_command('import_students', roster.name, '--batch-size', '1', stdout=out)
+        self.assertIn('Created 2 students, skipped 1', out.getvalue())
+        abena = User.objects.get(username='abena')
+        self.assertEqual((abena.last_name, abena.userprofile.date_of_birth), ('Mensah', date(2008, 4, 1)))
+        self.assertIsNone(User.objects.get(username='efua').userprofile.date_of_birth)
+        self.assertFalse(abena.has_usable_password())
+
+
+class ChangeTrackingTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('tracked', password='pw')
+        profile = UserProfile.objects.create(user=user, bio='Hello', location='Accra')
+        UserEducationProfile.objects.create(user_profile=profile)
+        self.profile = UserProfile.objects.get(pk=profile.pk)
+        self.education = UserEducationProfile.objects.get(user_profile=profile)
+        self.areas = [
+            KnowledgeArea.objects.create(name=name, education_level='shs', subject_category='science')
+            for name in ('Biology', 'Chemistry', 'Physics')
+        ]
+
+    def test_save_changes_writes_only_changed_columns(self):
+        self.profile.bio = 'Updated bio'
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.profile.save_changes(), ['bio', 'updated_at'])
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"bio"', updates[0])
+        self.assertNotIn('"location"', updates[0])
+        self.assertEqual(UserProfile.objects.get(pk=self.profile.pk).bio, 'Updated bio')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile.save_changes(), [])
+
+    def test_in_place_json_edits_are_detected(self):
+        self.education.preferred_content_types.append('video')
+        self.education.content_recommendation_weights['quiz'] = 2
+        self.assertEqual(
+            self.education.get_dirty_fields(), ['preferred_content_types', 'content_recommendation_weights']
+        )
+        self.education.save_changes()
+        self.assertEqual(UserEducationProfile.objects.get(pk=self.education.pk).preferred_content_types, ['video'])
+        self.assertEqual(self.education.get_dirty_fields(), [])
+
+    def test_sync_m2m_applies_only_the_difference(self):
+        biology, chemistry, physics = self.areas
+        favorites = self.education.favorite_subjects
+        favorites.add(biology, chemistry)
+
+        added, removed = sync_m2m(favorites, [str(chemistry.pk), physics.pk, 'junk', 999999])
+        self.assertEqual((added, removed), ({physics.pk}, {biology.pk}))
+        self.assertEqual(set(favorites.values_list('pk', flat=True)), {chemistry.pk, physics.pk})
+
+        with self.assertNumQueries(2):  # Validity check and current links; nothing to write
+            self.assertEqual(sync_m2m(favorites, [chemistry.pk, physics.pk]), (set(), set()))
+
+    def test_sync_m2m_can_keep_existing_links(self):
+        biology, chemistry, physics = self.areas
+        favorites = self.education.favorite_subjects
+        favorites.add(biology)
+        added, removed = sync_m2m(favorites, [physics.pk], remove_missing=False)
+        self.assertEqual((added, removed), ({physics.pk}, set()))
+        self.assertEqual(set(favorites.values_list('pk', flat=True)), {biology.pk, physics.pk})
+
+
+class UserSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('summarized', password='pw')
+        self.addCleanup(invalidate_entitlement, self.user.pk)
+        profile = UserProfile.objects.create(user=self.user, onboarding_completed=True)
+        self.education = UserEducationProfile.objects.create(user_profile=profile)
+        self.biology, self.physics = [
+            KnowledgeArea.objects.create(name=name, education_level='shs', subject_category='science')
+            for name in ('Biology', 'Physics')
+        ]
+
+    def summary(self):
+        return UserSummary.objects.get(pk=self.user.pk)
+
+    def test_counts_follow_progress_subscriptions_and_favorites(self):
+        self.assertEqual((self.summary().has_profile, self.summary().has_education_profile), (True, True))
+        started = UserLearningProgress.objects.create(
+            user=self.user, knowledge_area=self.biology, status='in_progress', progress_percentage=40
+        )
+        UserLearningProgress.objects.create(
+            user=self.user, knowledge_area=self.physics, status='completed', progress_percentage=100
+        )
+        summary = self.summary()
+        self.assertEqual((summary.progress_count, summary.in_progress_count, summary.completed_count), (2, 1, 1))
+        self.assertEqual(summary.top_subjects, ['Physics', 'Biology'])
+        self.assertIsNotNone(summary.last_activity)
+
+        started.delete()
+        summary = self.summary()
+        self.assertEqual((summary.progress_count, summary.in_progress_count, summary.completed_count), (1, 0, 1))
+
+        subscription = Subscription.objects.create(user=self.user, plan='premium', status='active')
+        self.assertTrue(self.summary().is_premium)
+        subscription.delete()
+        self.assertFalse(self.summary().is_premium)
+
+        self.education.favorite_subjects.add(self.biology, self.physics)
+        self.assertEqual(self.summary().favorite_subjects_count, 2)
+        self.education.favorite_subjects.remove(self.biology)
+        self.assertEqual(self.summary().favorite_subjects_count, 1)
+
+    def test_streak_counts_consecutive_days(self):
+        summary = UserSummary(user=self.user)
+        start = timezone.now() - timedelta(days=10)
+        for day, expected in [(0, 1), (0, 1), (1, 2), (2, 3), (5, 1), (6, 2)]:
+            summary.record_activity(start + timedelta(days=day), save=False)
+            self.assertEqual(summary.current_streak, expected, f'day {day}')
+        # Activity reported late for an earlier day changes nothing
+        summary.record_activity(start + timedelta(days=3), save=False)
+        self.assertEqual((summary.current_streak, summary.last_activity), (2, start + timedelta(days=6)))
+
+    def test_streak_lapses_after_a_missed_day(self):
+        summary = UserSummary(user=self.user)
+        summary.record_activity(timezone.now() - timedelta(days=1), save=False)
+        summary.record_activity(timezone.now(), save=False)
+        self.assertEqual(summary.get_active_streak(), 2)
+        with mock.patch('accounts.models.timezone.localdate', return_value=timezone.localdate() + timedelta(days=1)):
+            self.assertEqual(summary.get_active_streak(), 2)
+        with mock.patch('accounts.models.timezone.localdate', return_value=timezone.localdate() + timedelta(days=2)):
+            self.assertEqual(summary.get_active_streak(), 0)
@@ -0,0 +1,94 @@
+"""
+Change tracking helpers for SUA PA AI models.
+
+DirtyFieldsMixin remembers the field values a model instance was loaded with,
+so saves can be limited to the columns that actually changed. sync_m2m applies
+many-to-many changes as a set difference against the current relations.
+"""
+
+import copy
+
+
+class DirtyFieldsMixin:
+    """
+    Mixin for models.Model subclasses that tracks which concrete fields changed
+    since the instance was loaded or last saved.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_fields()
+        return instance
+
+    def _snapshot_fields(self):
+        self._original_values = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__:
+                value = self.__dict__[field.attname]
+                # Copy mutable values such as JSONField lists/dicts so in-place edits are noticed
+                if isinstance(value, (list, dict)):
+                    value = copy.deepcopy(value)
+                self._original_values[field.attname] = value
+
+    def get_dirty_fields(self):
+        """
+        Return the names of fields whose value differs from the loaded one.
+        """
+        original_values = getattr(self, '_original_values', None)
+        if original_values is None:
+            return [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        return [
+            field.name for field in self._meta.concrete_fields
+            if field.attname in original_values and self.__dict__.get(field.attname) != original_values[field.attname]
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot_fields()
+
+    def save_changes(self):
+        """
+        Save only the changed fields (plus auto_now timestamps). New instances
+        are saved in full. Returns the list of fields written.
+        """
+        if self._state.adding or getattr(self, '_original_values', None) is None:
+            self.save()
+            return [field.name for field in self._meta.concrete_fields]
+
+        dirty_fields = self.get_dirty_fields()
+        if not dirty_fields:
+            return []
+
+        auto_now_fields = [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+        update_fields = list(dict.fromkeys(dirty_fields + auto_now_fields))
+        self.save(update_fields=update_fields)
+        return update_fields
+
+
+def sync_m2m(manager, ids, remove_missing=True):
+    """
+    Make a many-to-many relation match `ids` by adding and removing only the difference.
+
+    Unknown ids are dropped with a single lookup against the related table, and the
+    additions and removals are each written in bulk. With remove_missing=False existing
+    relations not in `ids` are kept. Returns an (added, removed) tuple of id sets.
+    """
+    related_model = manager.model
+    wanted = set()
+    for value in ids:
+        try:
+            wanted.add(related_model._meta.pk.to_python(value))
+        except Exception:
+            continue  # Ignore malformed ids from form input
+
+    valid = set(related_model.objects.filter(pk__in=wanted).values_list('pk', flat=True)) if wanted else set()
+    current = set(manager.values_list('pk', flat=True))
+
+    to_add = valid - current
+    to_remove = current - valid if remove_missing else set()
+    if to_add:
+        manager.add(*to_add)
+    if to_remove:
+        manager.remove(*to_remove)
+    return to_add, to_remove
@@ -6,7 +6,10 @@ from django.contrib.auth.decorators import login_required
 from django.urls import reverse
 from django.db import transaction
 from datetime import datetime
-from .models import UserProfile, UserEducationProfile
+from .models import UserProfile, UserEducationProfile, UserSummary
+from .registration import register_user, RegistrationError
+from .hashing import HashingBusy
+from .tracking import sync_m2m
 from .utils import get_learning_style_recommendations
 from .content_recommendations import ContentRecommendationEngine
 from companion.models import KnowledgeArea, UserLearningProgress
@@ -17,83 +20,66 @@ def signup(request):
 
     if request.method == 'POST':
         try:
-            with transaction.atomic():
-                # Validate required fields
-                username = request.POST.get('username', '').strip()
-                email = request.POST.get('email', '').strip()
-                password1 = request.POST.get('password1', '').strip()
-                password2 = request.POST.get('password2', '').strip()
-                first_name = request.POST.get('first_name', '').strip()
-                last_name = request.POST.get('last_name', '').strip()
-                agree_terms = request.POST.get('agree_terms')
-
-                # Check required fields
-                if not all([username, email, password1, password2, first_name, last_name]):
-                    messages.error(request, 'Please fill in all required fields.')
-                    return render(request, 'signup.html', {'page_name': page_name})
-
-                # Check terms agreement
-                if not agree_terms:
-                    messages.error(request, 'You must agree to the Terms of Service and Privacy Policy.')
-                    return render(request, 'signup.html', {'page_name': page_name})
-
-                # Validate passwords
-                if password1 != password2:
-                    messages.error(request, 'Passwords do not match.')
-                    return render(request, 'signup.html', {'page_name': page_name})
-
-                if len(password1) < 8:
-                    messages.error(request, 'Password must be at least 8 characters long.')
-                    return render(request, 'signup.html', {'page_name': page_name})
-
-                # Check if username or email already exists
-                if User.objects.filter(username=username).exists():
-                    messages.error(request, 'Username already exists.')
-                    return render(request, 'signup.html', {'page_name': page_name})
-
-                if User.objects.filter(email=email).exists():
-                    messages.error(request, 'Email already exists.')
-                    return render(request, 'signup.html', {'page_name': page_name})
-
-                # Create user
-                user = User.objects.create_user(
+            # Validate required fields
+            username = request.POST.get('username', '').strip()
+            email = request.POST.get('email', '').strip()
+            password1 = request.POST.get('password1', '').strip()
+            password2 = request.POST.get('password2', '').strip()
+            first_name = request.POST.get('first_name', '').strip()
+            last_name = request.POST.get('last_name', '').strip()
+            agree_terms = request.POST.get('agree_terms')
+
+            # Check required fields
+            if not all([username, email, password1, password2, first_name, last_name]):
+                messages.error(request, 'Please fill in all required fields.')
+                return render(request, 'signup.html', {'page_name': page_name})
+
+            # Check terms agreement
+            if not agree_terms:
+                messages.error(request, 'You must agree to the Terms of Service and Privacy Policy.')
+                return render(request, 'signup.html', {'page_name': page_name})
+
+            # Validate passwords
+            if password1 != password2:
+                messages.error(request, 'Passwords do not match.')
+                return render(request, 'signup.html', {'page_name': page_name})
+
+            if len(password1) < 8:
+                messages.error(request, 'Password must be at least 8 characters long.')
+                return render(request, 'signup.html', {'page_name': page_name})
+
+            # Parse date of birth safely
+            date_of_birth = request.POST.get('date_of_birth', '').strip()
+            parsed_date = None
+            if date_of_birth:
+                try:
+                    parsed_date = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
+                except ValueError:
+                    pass  # Keep as None if invalid
+
+            # Create user with basic and education profiles in one go;
+            # username and email uniqueness are checked in a single query
+            try:
+                user = register_user(
                     username=username,
                     email=email,
                     password=password1,
                     first_name=first_name,
-                    last_name=last_name
-                )
-
-                # Parse date of birth safely
-                date_of_birth = request.POST.get('date_of_birth', '').strip()
-                parsed_date = None
-                if date_of_birth:
-                    try:
-                        parsed_date = datetime.strptime(date_of_birth, '%Y-%m-%d').date()
-                    except ValueError:
-                        pass  # Keep as None if invalid
-
-                # Create basic user profile without education/learning preferences
-                user_profile = UserProfile.objects.create(
-                    user=user,
+                    last_name=last_name,
                     phone_number=request.POST.get('phone_number', '').strip(),
-                    date_of_birth=parsed_date,
-                    profile_completed=False,  # Will be completed in profile settings
-                    onboarding_completed=False
+                    date_of_birth=parsed_date
                 )
-                user_profile.save()
+            except RegistrationError as e:
+                messages.error(request, str(e))
+                return render(request, 'signup.html', {'page_name': page_name})
 
-                # Auto-login the user
-                user = authenticate(username=username, password=password1)
-                if user:
-                    login(request, user)
-                    messages.success(request, f'Welcome to Sua Pa AI, {user.first_name}! Your account has been created successfully.')
+            # Auto-login the user; the password was just set, so there is
+            # no need to verify it again through authenticate()
+            login(request, user, backend='accounts.backends.PooledModelBackend')
+            messages.success(request, f'Welcome to Sua Pa AI, {user.first_name}! Your account has been created successfully.')
 
-                    # Redirect to profile settings for final setup
-                    return redirect('profile-settings')
-                else:
-                    messages.error(request, 'Account created but login failed. Please sign in manually.')
-                    return redirect('signin')
+            # Redirect to profile settings for final setup
+            return redirect('profile-settings')
 
         except Exception as e:
             import traceback
@@ -134,7 +120,11 @@ def signin(request):
             messages.error(request, 'Please enter both username and password.')
             return render(request, 'signin.html', {'page_name': page_name})
 
-        user = authenticate(request, username=username, password=password)
+        try:
+            user = authenticate(request, username=username, password=password)
+        except HashingBusy:
+            messages.error(request, 'We are experiencing a high volume of sign-ins. Please try again in a moment.')
+            return render(request, 'signin.html', {'page_name': page_name})
 
         if user is not None:
             if user.is_active:
@@ -246,7 +236,7 @@ def profile_settings(request):
                 user_profile.interests = request.POST.get('interests', '').strip() or user_profile.interests
                 user_profile.profile_completed = True
                 user_profile.onboarding_completed = True
-                user_profile.save()
+                user_profile.save_changes()
 
                 # Update or create education profile
                 motivation_type = request.POST.get('motivation_type', 'achievement')
@@ -260,16 +250,16 @@ def profile_settings(request):
 
                 education_profile.motivation_type = motivation_type
                 education_profile.preferred_content_types = preferred_content_types
-                education_profile.save()
+                education_profile.save_changes()
 
                 # Handle subject preferences if provided
                 favorite_subjects = request.POST.getlist('favorite_subjects')
                 strong_subjects = request.POST.getlist('strong_subjects')
 
                 if favorite_subjects:
-                    education_profile.favorite_subjects.set(favorite_subjects)
+                    sync_m2m(education_profile.favorite_subjects, favorite_subjects)
                 if strong_subjects:
-                    education_profile.strong_subjects.set(strong_subjects)
+                    sync_m2m(education_profile.strong_subjects, strong_subjects)
 
                 messages.success(request, 'Profile setup completed successfully! Let\'s explore personalized content for you.')
                 return redirect('content-recommendations')  # Redirect to content recommendations
@@ -391,13 +381,7 @@ def content_recommendations(request):
             # Handle subject selection
             selected_subjects = request.POST.getlist('selected_subjects')
             if selected_subjects:
-                for subject_id in selected_subjects:
-                    try:
-                        subject = KnowledgeArea.objects.get(id=subject_id)
-                        education_profile.favorite_subjects.add(subject)
-                    except KnowledgeArea.DoesNotExist:
-                        continue
-                education_profile.save()
+                sync_m2m(education_profile.favorite_subjects, selected_subjects, remove_missing=False)
                 messages.success(request, 'Your subject preferences have been updated!')
 
         elif action == 'start_learning':
@@ -417,8 +401,8 @@ def content_recommendations(request):
             if new_difficulty:
                 user_profile.difficulty_preference = new_difficulty
 
-            education_profile.save()
-            user_profile.save()
+            education_profile.save_changes()
+            user_profile.save_changes()
             messages.success(request, 'Your learning preferences have been updated!')
 
         # Redirect to prevent form resubmission
@@ -462,46 +446,39 @@ def dashboard(request):
     """Main dashboard after login"""
     page_name = "Dashboard"
 
-    try:
-        user_profile = request.user.userprofile
+    # Everything needed here is denormalized into a single summary row
+    summary = UserSummary.for_user(request.user)
 
-        # If profile is not completed, redirect to profile settings
-        if not user_profile.onboarding_completed:
-            messages.info(request, 'Please complete your profile setup to access the dashboard.')
-            return redirect('profile-settings')
-
-    except UserProfile.DoesNotExist:
+    if not summary.has_profile:
         # Create basic profile and redirect to settings
         UserProfile.objects.create(user=request.user)
         messages.info(request, 'Please complete your profile setup.')
         return redirect('profile-settings')
 
+    # If profile is not completed, redirect to profile settings
+    if not summary.onboarding_completed:
+        messages.info(request, 'Please complete your profile setup to access the dashboard.')
+        return redirect('profile-settings')
+
     # Redirect based on user type and preferences
     if request.user.is_staff:
         return redirect('admin:index')
 
     # For students, redirect to their preferred starting point
-    try:
-        education_profile = user_profile.education_profile
-
-        # Check if user has learning progress
-        from companion.models import UserLearningProgress
-        has_progress = UserLearningProgress.objects.filter(user=request.user).exists()
-
-        if has_progress:
-            # User has been using the platform, go to their companion
-            return redirect('companion:dashboard')
-        elif education_profile.favorite_subjects.exists():
-            # User has selected subjects, show recommendations
-            return redirect('content-recommendations')
-        else:
-            # New user, show chat interface
-            return redirect('chat:index')
-
-    except UserEducationProfile.DoesNotExist:
+    if not summary.has_education_profile:
         # No education profile, complete profile first
         return redirect('profile-settings')
 
+    if summary.progress_count:
+        # User has been using the platform, go to their companion
+        return redirect('companion:dashboard')
+    elif summary.favorite_subjects_count:
+        # User has selected subjects, show recommendations
+        return redirect('content-recommendations')
+    else:
+        # New user, show chat interface
+        return redirect('chat:index')
+
 @login_required
 def password_change(request):
     """Change password view"""
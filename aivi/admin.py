@@ -31,12 +31,16 @@ class AIRequestAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'ai_model', 'request_type', 'status', 'tokens_used', 'cost', 'created_at']
     list_filter = ['request_type', 'status', 'ai_model__name', 'created_at']
     search_fields = ['user__username', 'ai_model__name', 'prompt']
-    readonly_fields = ['created_at', 'completed_at']
+    readonly_fields = ['attempts', 'lease_owner', 'lease_expires', 'created_at', 'completed_at']
     date_hierarchy = 'created_at'
     fieldsets = (
         ('Request Information', {
             'fields': ('user', 'ai_model', 'request_type', 'status')
         }),
+        ('Queue', {
+            'fields': ('attempts', 'run_after', 'lease_owner', 'lease_expires'),
+            'classes': ('collapse',)
+        }),
         ('Content', {
             'fields': ('prompt', 'response', 'error_message')
         }),
@@ -0,0 +1,134 @@
+"""
+Response cache for deterministic prompts.
+
+Students send many near-identical requests: the same AITemplate filled in with
+the same variables, or the same FAQ-style question to a public Bot. Responses
+are cached under a hash of (model, system prompt, rendered prompt, temperature)
+after whitespace normalization, with LRU eviction once `max_entries` is reached
+and a TTL after which an entry is treated as missing.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+
+_WHITESPACE = re.compile(r'\s+')
+_PLACEHOLDER = re.compile(r'\{\{?\s*(\w+)\s*\}?\}')
+
+
+def normalize_text(text):
+    """
+    Collapse runs of whitespace and strip the ends, so prompts differing only
+    in spacing or line breaks share a cache entry.
+    """
+    return _WHITESPACE.sub(' ', text or '').strip()
+
+
+def render_prompt(template, variables=None):
+    """
+    Fill `{name}` or `{{ name }}` placeholders in a prompt template.
+    Placeholders without a matching variable are left untouched.
+    """
+    variables = variables or {}
+
+    def replace(match):
+        name = match.group(1)
+        return str(variables[name]) if name in variables else match.group(0)
+
+    return _PLACEHOLDER.sub(replace, template)
+
+
+def make_cache_key(model_id, system_prompt, prompt, temperature):
+    payload = json.dumps([
+        model_id,
+        normalize_text(system_prompt),
+        normalize_text(prompt),
+        round(float(temperature or 0), 3),
+    ])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Thread-safe in-process LRU cache with a TTL and hit/miss counters.
+    """
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Return the cached response for `key`, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            response, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def set(self, key, response):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    The process-wide cache, configured from settings.RESPONSE_CACHE.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(**getattr(settings, 'RESPONSE_CACHE', {}))
+    return _cache
@@ -0,0 +1,523 @@
+"""
+Model gateway: pooled provider clients with per-model limits.
+
+Every AIModel gets a channel holding one provider client (for HTTP providers
+an httpx.AsyncClient whose connection pool is capped at the model's
+concurrency), a concurrency limit and an optional token-rate limit. Requests
+over the concurrency limit wait in line; once `max_queue` are waiting, or
+after waiting `queue_timeout` seconds, further requests fail fast with
+GatewayOverloaded instead of piling up. The token bucket reserves each
+request's prompt tokens plus its max_tokens up front and refunds what the
+response did not use.
+
+Complete (non-streamed) responses from providers that accept several
+prompts per call are micro-batched: requests with the same arguments are
+collected for up to `max_batch_wait` seconds or `max_batch` requests and
+sent as one provider call, which takes one concurrency slot, and the
+responses are handed back to each caller.
+
+Channels live on one event loop on a background thread, so the limits hold
+for the whole process however callers run (sync views get a fresh event loop
+per async_to_sync call). Tokens are handed back to the caller's loop as they
+arrive.
+
+Providers are chosen by AIModel.provider from settings.MODEL_GATEWAY
+['PROVIDERS']; unlisted providers use DEFAULT_PROVIDER, MockProvider by
+default, which answers through the configured chat backend.
+"""
+
+import asyncio
+import atexit
+import json
+import threading
+import time
+from django.conf import settings
+from django.utils.module_loading import import_string
+from chat.backends import get_chat_backend
+from chat.context import count_tokens
+
+try:
+    import httpx
+except ImportError:  # HTTPProvider then refuses to start; MockProvider still works
+    httpx = None
+
+_DONE = object()
+
+
+def get_config():
+    config = {
+        'PROVIDERS': {},
+        'DEFAULT_PROVIDER': {'BACKEND': 'aivi.gateway.MockProvider', 'OPTIONS': {}},
+        'concurrency': 8,
+        'tokens_per_minute': None,
+        'max_queue': 100,
+        'queue_timeout': 30,
+        'max_batch': 16,
+        'max_batch_wait': 0.005,
+        'LIMITS': {},
+    }
+    config.update(getattr(settings, 'MODEL_GATEWAY', {}))
+    return config
+
+
+class GatewayError(Exception):
+    """
+    Raised when a provider request fails.
+    """
+    pass
+
+
+class GatewayOverloaded(GatewayError):
+    """
+    Raised when a model's queue is full or a request waited too long for a slot.
+    """
+    pass
+
+
+class Provider:
+    """
+    Base class for model providers. One instance serves one AIModel.
+    Providers that accept several prompts per call set `supports_batching`
+    and implement complete_batch().
+    """
+
+    supports_batching = False
+
+    def __init__(self, ai_model, max_connections=8, **options):
+        self.ai_model = ai_model
+        self.max_connections = max_connections
+        self.options = options
+
+    async def stream(self, messages, **kwargs):
+        """
+        Yield response tokens for `messages`, a list of {'role', 'content'} dicts.
+        """
+        raise NotImplementedError('Providers must implement stream()')
+        yield  # pragma: no cover
+
+    async def complete_batch(self, batch, **kwargs):
+        """
+        Return one response per message list in `batch`, or an exception in
+        place of a response that failed on its own.
+        """
+        raise NotImplementedError('Batching providers must implement complete_batch()')
+
+    async def aclose(self):
+        pass
+
+
+class MockProvider(Provider):
+    """
+    Local provider answering through the configured chat backend
+    (see chat.backends.FakeChatBackend), for development and tests.
+    """
+
+    def __init__(self, ai_model, max_connections=8, **options):
+        super().__init__(ai_model, max_connections, **options)
+        self.backend = get_chat_backend()
+
+    async def stream(self, messages, **kwargs):
+        async for token in self.backend.stream(messages, **kwargs):
+            yield token
+
+
+class FakeBatchProvider(Provider):
+    """
+    Local provider that accepts batches, costing `call_latency` seconds per
+    call plus `item_latency` per prompt in it, like a batched inference
+    server. For tests and benchmarks.
+    """
+
+    supports_batching = True
+
+    def _reply(self, messages):
+        last_user_message = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        return f'Here is some help with: {last_user_message}'
+
+    async def complete_batch(self, batch, **kwargs):
+        await asyncio.sleep(self.options.get('call_latency', 0.05) + self.options.get('item_latency', 0.002) * len(batch))
+        return [self._reply(messages) for messages in batch]
+
+    async def stream(self, messages, **kwargs):
+        reply = (await self.complete_batch([messages], **kwargs))[0].split(' ')
+        for index, word in enumerate(reply):
+            yield word if index == 0 else ' ' + word
+
+
+class HTTPProvider(Provider):
+    """
+    OpenAI-compatible chat completions endpoint at AIModel.api_endpoint,
+    streamed over server-sent events through a pooled httpx client.
+    Options: api_key, timeout (seconds).
+    """
+
+    def __init__(self, ai_model, max_connections=8, **options):
+        super().__init__(ai_model, max_connections, **options)
+        if httpx is None:
+            raise GatewayError('HTTP providers need the httpx package installed.')
+        if not ai_model.api_endpoint:
+            raise GatewayError(f'{ai_model} has no api_endpoint.')
+        headers = {}
+        if options.get('api_key'):
+            headers['Authorization'] = f"Bearer {options['api_key']}"
+        self.client = httpx.AsyncClient(
+            headers=headers,
+            timeout=options.get('timeout', 60),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def stream(self, messages, **kwargs):
+        payload = {'model': self.ai_model.model_id, 'messages': messages, 'stream': True}
+        payload.update({name: value for name, value in kwargs.items() if value is not None})
+        try:
+            async with self.client.stream('POST', self.ai_model.api_endpoint, json=payload) as response:
+                if response.status_code >= 400:
+                    body = await response.aread()
+                    raise GatewayError(f'{self.ai_model} returned {response.status_code}: {body[:200]!r}')
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        return
+                    choices = json.loads(data).get('choices') or [{}]
+                    content = (choices[0].get('delta') or {}).get('content')
+                    if content:
+                        yield content
+        except httpx.HTTPError as e:
+            raise GatewayError(f'{self.ai_model} request failed: {e}')
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class TokenBucket:
+    """
+    Token-rate limiter refilling `rate` tokens per minute up to `rate`.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        """
+        Wait until `tokens` (at most the bucket size) are available and take them.
+        Returns the number taken.
+        """
+        tokens = min(tokens, self.rate)
+        async with self._lock:  # First come, first served
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) * 60 / self.rate)
+                self._refill()
+            self.tokens -= tokens
+        return tokens
+
+    def refund(self, tokens):
+        self._refill()
+        self.tokens = min(self.rate, self.tokens + tokens)
+
+
+def _prompt_tokens(messages):
+    return sum(count_tokens(message['content']) for message in messages)
+
+
+class MicroBatcher:
+    """
+    Collects completions for one channel and sends them as batched provider
+    calls: a batch goes out when `max_batch` requests with the same arguments
+    are waiting or `max_wait` seconds after the first of them arrived.
+    Used on the gateway loop only.
+    """
+
+    def __init__(self, channel, max_batch=16, max_wait=0.005):
+        self.channel = channel
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = {}  # frozen kwargs -> [(messages, future)]
+        self._timers = {}
+        self.batches = 0
+        self.batched = 0
+
+    def submit(self, messages, kwargs):
+        """
+        Queue one completion and return a future for its response.
+        """
+        loop = asyncio.get_running_loop()
+        key = tuple(sorted(kwargs.items()))
+        items = self._pending.setdefault(key, [])
+        future = loop.create_future()
+        items.append((messages, future))
+        if len(items) >= self.max_batch:
+            self._dispatch(key)
+        elif len(items) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._dispatch, key)
+        return future
+
+    def _dispatch(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = [item for item in self._pending.pop(key, []) if not item[1].done()]
+        if items:
+            asyncio.get_running_loop().create_task(self._run(items, dict(key)))
+
+    async def _run(self, items, kwargs):
+        self.batches += 1
+        self.batched += len(items)
+        try:
+            results = await self.channel.complete_batch([messages for messages, _ in items], **kwargs)
+            if len(results) != len(items):
+                raise GatewayError(
+                    f'{self.channel.provider.ai_model} returned {len(results)} responses for {len(items)} prompts.'
+                )
+        except Exception as e:
+            results = [e] * len(items)
+        except BaseException:
+            # Cancelled (e.g. the gateway is shutting down): nobody may be left waiting
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(GatewayError('The gateway shut down before the batch completed.'))
+            raise
+        for (_, future), result in zip(items, results):
+            if future.done():  # The caller gave up
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class ModelChannel:
+    """
+    Provider client and limits of one AIModel. Used on the gateway loop only.
+    """
+
+    def __init__(self, provider, concurrency=8, tokens_per_minute=None, max_queue=100, queue_timeout=30,
+                 max_batch=16, max_batch_wait=0.005):
+        self.provider = provider
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.batcher = None
+        if provider.supports_batching and max_batch > 1:
+            self.batcher = MicroBatcher(self, max_batch, max_batch_wait)
+        self._slots = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def _acquire(self):
+        if not self._slots.locked():
+            # A free slot is taken without yielding, so it never counts as waiting
+            await self._slots.acquire()
+            self.active += 1
+            return
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise GatewayOverloaded(f'{self.provider.ai_model} has {self.waiting} requests waiting.')
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise GatewayOverloaded(f'No slot for {self.provider.ai_model} within {self.queue_timeout}s.')
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def _release(self, reserved, used):
+        if self.bucket and reserved > used:
+            self.bucket.refund(reserved - used)
+        self.active -= 1
+        self._slots.release()
+
+    async def stream(self, messages, **kwargs):
+        await self._acquire()
+        reserved = used = 0
+        try:
+            if self.bucket:
+                used = _prompt_tokens(messages)
+                reserved = await self.bucket.acquire(used + (kwargs.get('max_tokens') or 0))
+            async for token in self.provider.stream(messages, **kwargs):
+                used += 1
+                yield token
+            self.completed += 1
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._release(reserved, used)
+
+    async def complete_batch(self, batch, **kwargs):
+        """
+        Responses (or exceptions) for a list of message lists, from one
+        provider call holding one slot.
+        """
+        await self._acquire()
+        reserved = used = 0
+        try:
+            if self.bucket:
+                used = sum(_prompt_tokens(messages) for messages in batch)
+                reserved = await self.bucket.acquire(used + (kwargs.get('max_tokens') or 0) * len(batch))
+            results = await self.provider.complete_batch(batch, **kwargs)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                    used += count_tokens(result)
+            return results
+        except Exception:
+            self.failed += len(batch)
+            raise
+        finally:
+            self._release(reserved, used)
+
+    async def complete(self, messages, **kwargs):
+        if self.batcher is not None:
+            return await self.batcher.submit(messages, kwargs)
+        return ''.join([token async for token in self.stream(messages, **kwargs)])
+
+    def stats(self):
+        stats = {
+            'concurrency': self.concurrency,
+            'active': self.active,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'available_tokens': int(self.bucket.tokens) if self.bucket else None,
+        }
+        if self.batcher is not None:
+            stats['batches'] = self.batcher.batches
+            stats['mean_batch_size'] = round(self.batcher.batched / self.batcher.batches, 2) if self.batcher.batches else 0
+        return stats
+
+
+class ModelGateway:
+    """
+    Channels per AIModel, served from an event loop on a background thread.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._channels = {}  # AIModel pk -> ((provider, endpoint), ModelChannel)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='aivi-gateway', daemon=True)
+        self._thread.start()
+
+    def _channel(self, ai_model):
+        # Runs on the gateway loop
+        key = (ai_model.provider, ai_model.api_endpoint)
+        entry = self._channels.get(ai_model.pk)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        if entry is not None:
+            self._loop.create_task(self._retire(entry[1]))
+
+        provider_config = self.config['PROVIDERS'].get(ai_model.provider, self.config['DEFAULT_PROVIDER'])
+        limits = {
+            name: self.config[name] for name in (
+                'concurrency', 'tokens_per_minute', 'max_queue', 'queue_timeout', 'max_batch', 'max_batch_wait'
+            )
+        }
+        limits.update(self.config['LIMITS'].get(ai_model.model_id, {}))
+        provider = import_string(provider_config['BACKEND'])(
+            ai_model, max_connections=limits['concurrency'], **provider_config.get('OPTIONS', {})
+        )
+        channel = ModelChannel(provider, **limits)
+        self._channels[ai_model.pk] = (key, channel)
+        return channel
+
+    async def _retire(self, channel):
+        # The model's provider or endpoint changed; close the old client once its requests finish
+        while channel.active or channel.waiting:
+            await asyncio.sleep(1)
+        await channel.provider.aclose()
+
+    async def _pump(self, ai_model, messages, kwargs, loop, queue):
+        try:
+            async for token in self._channel(ai_model).stream(messages, **kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, token)
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    async def _complete(self, ai_model, messages, kwargs):
+        return await self._channel(ai_model).complete(messages, **kwargs)
+
+    async def complete(self, ai_model, messages, **kwargs):
+        """
+        The whole response from `ai_model` for `messages`, from any event loop.
+        Requests for a provider that supports batching are micro-batched.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._complete(ai_model, messages, kwargs), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def stream(self, ai_model, messages, **kwargs):
+        """
+        Yield response tokens from `ai_model` for `messages`, from any event loop.
+        Raises GatewayOverloaded when the model's queue is full.
+        """
+        queue = asyncio.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._pump(ai_model, messages, kwargs, asyncio.get_running_loop(), queue), self._loop
+        )
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            future.cancel()  # Frees the slot if the caller stopped reading early
+
+    def stats(self):
+        async def collect():
+            return {
+                str(channel.provider.ai_model): channel.stats() for _, channel in self._channels.values()
+            }
+        return asyncio.run_coroutine_threadsafe(collect(), self._loop).result()
+
+    def close(self):
+        async def shutdown():
+            for _, channel in self._channels.values():
+                await channel.provider.aclose()
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_model_gateway():
+    """
+    The process-wide gateway, configured from settings.MODEL_GATEWAY.
+    """
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = ModelGateway()
+                atexit.register(_gateway.close)
+    return _gateway
@@ -0,0 +1,205 @@
+"""
+Background processing of pending AIRequests.
+
+`enqueue` stores a request as pending; worker processes (the
+process_ai_requests command) claim pending requests in batches and run each
+batch concurrently through the model gateway, which applies the per-model
+limits and micro-batches requests for providers that accept batches.
+
+A claim is a lease: one conditional UPDATE moves up to `batch_size`
+claimable rows to processing under a fresh claim token with an expiry
+`lease_seconds` ahead, and the worker then loads the rows carrying its token.
+The UPDATE re-checks each row's status, so two workers can never claim the
+same row, on SQLite as on other databases. Workers renew their leases while
+a batch runs; the rows of a worker that dies become claimable again once its
+lease expires. Results are written only while the worker still holds the
+lease.
+
+A failed attempt goes back to pending with `run_after` pushed out
+exponentially (`retry_backoff` seconds doubling per attempt, at most
+`max_backoff`) until `max_attempts` is reached, and is failed then. A
+request whose user is over their token quota is failed without retrying.
+"""
+
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from chat.context import count_tokens
+from .gateway import get_model_gateway
+from .models import AIRequest
+from .quotas import QuotaExceeded, charge_quota, check_quota
+from .usage import COUNTED_STATUSES, record_usage
+
+
+def get_config():
+    config = {
+        'batch_size': 20,
+        'lease_seconds': 120,
+        'max_attempts': 3,
+        'retry_backoff': 5,
+        'max_backoff': 300,
+        'poll_interval': 1.0,
+    }
+    config.update(getattr(settings, 'AI_REQUEST_QUEUE', {}))
+    return config
+
+
+def enqueue(user, ai_model, prompt, request_type='completion'):
+    """
+    Store a pending AIRequest for a worker to process and return it.
+    """
+    return AIRequest.objects.create(user=user, ai_model=ai_model, request_type=request_type, prompt=prompt)
+
+
+def retry_delay(attempts, config):
+    """
+    Seconds before retrying a request that failed its `attempts`-th attempt, with jitter.
+    """
+    delay = min(config['retry_backoff'] * 2 ** (attempts - 1), config['max_backoff'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claimable(now):
+    return (
+        Q(status='pending') & (Q(run_after__isnull=True) | Q(run_after__lte=now))
+    ) | Q(status='processing', lease_expires__lt=now)
+
+
+class JobWorker:
+    """
+    Claims and processes batches of AIRequests.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+
+    def claim(self, batch_size=None):
+        """
+        Lease up to `batch_size` claimable requests, oldest first, and return
+        (claim token, requests).
+        """
+        batch_size = batch_size or self.config['batch_size']
+        token = f'{self.name}:{uuid.uuid4().hex[:12]}'[-64:]
+        now = timezone.now()
+        candidates = AIRequest.objects.filter(_claimable(now)).order_by('created_at')
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        # Where supported, workers skip each other's candidate rows instead of queueing on
+        # their locks; elsewhere (SQLite) the conditional UPDATE alone keeps claims exclusive
+        with transaction.atomic() if skip_locked else nullcontext():
+            if skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            ids = list(candidates.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return token, []
+            AIRequest.objects.filter(_claimable(now), pk__in=ids).update(
+                status='processing',
+                lease_owner=token,
+                lease_expires=now + timedelta(seconds=self.config['lease_seconds']),
+                attempts=F('attempts') + 1,
+            )
+        return token, list(AIRequest.objects.filter(lease_owner=token).select_related('ai_model', 'user'))
+
+    def renew(self, token):
+        AIRequest.objects.filter(lease_owner=token, status='processing').update(
+            lease_expires=timezone.now() + timedelta(seconds=self.config['lease_seconds'])
+        )
+
+    def _finish(self, request, token, response, tokens_used, processing_time, error=None, retry=True):
+        now = timezone.now()
+        fields = {
+            'response': response,
+            'tokens_used': tokens_used,
+            'cost': tokens_used * request.ai_model.cost_per_token,
+            'processing_time': processing_time,
+            'lease_owner': '',
+            'lease_expires': None,
+        }
+        if error is None:
+            fields.update(status='completed', error_message='', completed_at=now)
+        elif retry and request.attempts < self.config['max_attempts']:
+            fields.update(
+                status='pending', error_message=error,
+                run_after=now + timedelta(seconds=retry_delay(request.attempts, self.config))
+            )
+        else:
+            fields.update(status='failed', error_message=error)
+        # Written only while the lease is ours; otherwise another worker has taken the request over
+        updated = AIRequest.objects.filter(pk=request.pk, lease_owner=token).update(**fields)
+        if updated and fields['status'] in COUNTED_STATUSES:
+            record_usage(request.user_id, request.ai_model_id, request.created_at, tokens_used, fields['cost'])
+            charge_quota(request.user_id, tokens_used)
+        return updated
+
+    async def _run(self, request, token):
+        started = time.monotonic()
+        response = ''
+        error = None
+        retry = True
+        try:
+            await sync_to_async(check_quota)(request.user, count_tokens(request.prompt))
+            response = await get_model_gateway().complete(
+                request.ai_model, [{'role': 'user', 'content': request.prompt}], max_tokens=request.ai_model.max_tokens
+            )
+        except QuotaExceeded as e:
+            error = str(e)
+            retry = False
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        # A request turned away by its quota never reached the model
+        tokens_used = count_tokens(request.prompt) + count_tokens(response) if retry else 0
+        await sync_to_async(self._finish)(
+            request, token, response, tokens_used, time.monotonic() - started, error, retry
+        )
+        return error is None
+
+    async def _run_batch(self, token, requests):
+        async def renew_leases():
+            while True:
+                await asyncio.sleep(self.config['lease_seconds'] / 3)
+                await sync_to_async(self.renew)(token)
+
+        renewer = asyncio.create_task(renew_leases())
+        try:
+            return await asyncio.gather(*(self._run(request, token) for request in requests))
+        finally:
+            renewer.cancel()
+
+    def process_batch(self, batch_size=None):
+        """
+        Claim and process one batch. Returns (completed, failed attempts).
+        """
+        token, requests = self.claim(batch_size)
+        if not requests:
+            return 0, 0
+        results = async_to_sync(self._run_batch)(token, requests)
+        return results.count(True), results.count(False)
+
+    def run(self, once=False, stop=None, progress=None):
+        """
+        Process batches until the queue is empty (with `once`) or `stop()`
+        returns true, sleeping `poll_interval` seconds while it is empty.
+        `progress` is called with (completed, failed) after each batch.
+        """
+        while not (stop and stop()):
+            try:
+                completed, failed = self.process_batch()
+            finally:
+                close_old_connections()
+            if completed or failed:
+                if progress:
+                    progress(completed, failed)
+                continue
+            if once:
+                return
+            time.sleep(self.config['poll_interval'])
@@ -0,0 +1,65 @@
+import asyncio
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from aivi.gateway import ModelGateway, get_config
+from aivi.models import AIModel
+
+
+class Command(BaseCommand):
+    help = 'Measure gateway throughput and latency with and without micro-batching against a fake batching provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per configuration')
+        parser.add_argument('--clients', type=int, default=64, help='Concurrent clients, each sending one request at a time')
+        parser.add_argument('--concurrency', type=int, default=4, help='Provider calls allowed at once')
+        parser.add_argument('--max-batch', type=int, action='append', dest='max_batches',
+                            help='Batch size to benchmark (repeatable; 1 disables batching); defaults to 1, 4, 16 and 64')
+        parser.add_argument('--max-wait', type=float, default=5, help='Milliseconds a batch waits to fill')
+        parser.add_argument('--call-latency', type=float, default=50, help='Milliseconds per provider call')
+        parser.add_argument('--item-latency', type=float, default=2, help='Additional milliseconds per prompt in a call')
+
+    def handle(self, *args, **options):
+        ai_model = AIModel(pk=0, name='Benchmark', model_type='text', provider='benchmark', model_id='benchmark')
+        for max_batch in options['max_batches'] or [1, 4, 16, 64]:
+            config = get_config()
+            config.update({
+                'PROVIDERS': {'benchmark': {'BACKEND': 'aivi.gateway.FakeBatchProvider', 'OPTIONS': {
+                    'call_latency': options['call_latency'] / 1000,
+                    'item_latency': options['item_latency'] / 1000,
+                }}},
+                'concurrency': options['concurrency'],
+                'tokens_per_minute': None,
+                'max_queue': options['requests'],
+                'queue_timeout': 600,
+                'max_batch': max_batch,
+                'max_batch_wait': options['max_wait'] / 1000,
+                'LIMITS': {},
+            })
+            gateway = ModelGateway(config)
+            try:
+                elapsed, samples = asyncio.run(self._run(gateway, ai_model, options['requests'], options['clients']))
+                stats = gateway.stats()['Benchmark (benchmark)']
+            finally:
+                gateway.close()
+            samples.sort()
+            self.stdout.write(
+                f"max batch {max_batch}: {len(samples) / elapsed:.0f} requests/sec, "
+                f"p50 {statistics.median(samples) * 1000:.1f}ms, "
+                f"p99 {samples[int(len(samples) * 0.99) - 1] * 1000:.1f}ms, "
+                f"mean batch {stats.get('mean_batch_size', 1)}"
+            )
+
+    async def _run(self, gateway, ai_model, requests, clients):
+        samples = []
+        remaining = iter(range(requests))
+
+        async def client():
+            for number in remaining:
+                started = time.perf_counter()
+                await gateway.complete(ai_model, [{'role': 'user', 'content': f'Summarize note {number}'}])
+                samples.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        return time.perf_counter() - started, samples
@@ -0,0 +1,67 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from aivi.semantic import HashingEmbedder, SemanticCache
+
+OPENERS = ['What is', 'Explain', 'How does', 'Why does', 'Describe', 'Can you explain', 'Tell me about']
+
+
+class Command(BaseCommand):
+    help = 'Measure semantic cache lookup latency for paraphrased and unseen questions at a given cache size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=100000, help='Cached questions in the benchmark scope')
+        parser.add_argument('--queries', type=int, default=2000, help='Timed lookups per query kind')
+        parser.add_argument('--vocabulary', type=int, default=20000, help='Distinct words questions are drawn from')
+        parser.add_argument('--index', action='append', dest='indexes',
+                            help='Index class to benchmark (repeatable); defaults to InvertedIndex and BruteForceIndex')
+        parser.add_argument('--threshold', type=float, default=0.85)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = [f'term{i}' for i in range(options['vocabulary'])]
+        # Zipf-like word frequencies, so some words appear in many questions
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+
+        def question():
+            return f"{rng.choice(OPENERS)} {' '.join(rng.choices(words, weights, k=rng.randint(4, 9)))}?"
+
+        stored = [question() for _ in range(options['entries'])]
+        paraphrases = []
+        for text in rng.sample(stored, min(options['queries'], len(stored))):
+            body = text.split(' ', 2)[-1].rstrip('?')
+            paraphrases.append(f'{rng.choice(OPENERS)} {body} please')
+        unseen = [question() for _ in range(options['queries'])]
+
+        embedder = HashingEmbedder()
+        for path in options['indexes'] or ['aivi.semantic.InvertedIndex', 'aivi.semantic.BruteForceIndex']:
+            index_class = import_string(path)
+            cache = SemanticCache(index_class=index_class, embedder=embedder, threshold=options['threshold'],
+                                  max_entries_per_scope=options['entries'])
+            started = time.perf_counter()
+            for text in stored:
+                cache.set('benchmark', text, text)
+            built = time.perf_counter() - started
+            self.stdout.write(f'{index_class.__name__}: {len(stored)} entries indexed in {built:.1f}s')
+
+            queries = options['queries']
+            if index_class.__name__ == 'BruteForceIndex':
+                queries = min(queries, 50)  # A full scan per lookup; keep the run short
+            for label, texts in (('paraphrased', paraphrases[:queries]), ('unseen', unseen[:queries])):
+                samples = []
+                hits = 0
+                for text in texts:
+                    started = time.perf_counter()
+                    if cache.get('benchmark', text) is not None:
+                        hits += 1
+                    samples.append(time.perf_counter() - started)
+                samples.sort()
+                self.stdout.write(
+                    f'  {label}: p50 {statistics.median(samples) * 1000:.2f}ms, '
+                    f'p95 {samples[int(len(samples) * 0.95) - 1] * 1000:.2f}ms, '
+                    f'p99 {samples[int(len(samples) * 0.99) - 1] * 1000:.2f}ms, '
+                    f'hit rate {hits / len(texts):.0%}'
+                )
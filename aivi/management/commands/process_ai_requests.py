@@ -0,0 +1,36 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+from aivi.jobs import JobWorker, get_config
+
+class Command(BaseCommand):
+    help = 'Process pending AI requests; run several for more throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Requests claimed and run concurrently per batch')
+        parser.add_argument('--once', action='store_true', help='Exit when no request is ready instead of polling')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        if options['batch_size']:
+            config['batch_size'] = options['batch_size']
+        worker = JobWorker(config)
+        stopping = []
+        # Finish the current batch on SIGTERM/SIGINT rather than abandoning its leases
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stopping.append(True))
+
+        started = time.perf_counter()
+        totals = [0, 0]
+
+        def progress(completed, failed):
+            totals[0] += completed
+            totals[1] += failed
+            self.stdout.write(f'  {completed} completed, {failed} failed')
+
+        worker.run(once=options['once'], stop=lambda: bool(stopping), progress=progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {totals[0] + totals[1]} requests in {elapsed:.2f}s: '
+            f'{totals[0]} completed, {totals[1]} failed attempts'
+        ))
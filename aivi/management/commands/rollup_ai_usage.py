@@ -0,0 +1,28 @@
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from aivi.usage import rollup
+
+class Command(BaseCommand):
+    help = 'Rebuild daily AI usage logs from AI requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', action='append', dest='dates', help='Day to rebuild, YYYY-MM-DD (repeatable)')
+        parser.add_argument('--days', type=int, default=1,
+                            help='Without --date, rebuild this many days up to yesterday (today is still being counted)')
+
+    def handle(self, *args, **options):
+        try:
+            days = [date.fromisoformat(value) for value in options['dates'] or []]
+        except ValueError as e:
+            raise CommandError(f'Invalid --date: {e}')
+        if not days:
+            today = timezone.localdate()
+            days = [today - timedelta(days=offset) for offset in range(1, options['days'] + 1)]
+
+        started = time.perf_counter()
+        rows = rollup(days)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows} usage logs for {len(set(days))} days in {time.perf_counter() - started:.2f}s'
+        ))
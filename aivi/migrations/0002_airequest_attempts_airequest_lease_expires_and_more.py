@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aivi', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='airequest',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='lease_owner',
+            field=models.CharField(blank=True, help_text='Claim token of the worker processing the request', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='airequest',
+            name='run_after',
+            field=models.DateTimeField(blank=True, help_text='Earliest time a pending request may be retried', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='airequest',
+            index=models.Index(fields=['status', 'run_after'], name='aivi_airequ_status_78a9ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='airequest',
+            index=models.Index(fields=['status', 'lease_expires'], name='aivi_airequ_status_f18bf7_idx'),
+        ),
+    ]
@@ -57,6 +57,10 @@ class AIRequest(models.Model):
     processing_time = models.FloatField(null=True, blank=True)
     cost = models.DecimalField(max_digits=10, decimal_places=4, default=0.0)
     error_message = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(null=True, blank=True, help_text="Earliest time a pending request may be retried")
+    lease_owner = models.CharField(max_length=64, blank=True, help_text="Claim token of the worker processing the request")
+    lease_expires = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     completed_at = models.DateTimeField(null=True, blank=True)
 
@@ -67,6 +71,10 @@ class AIRequest(models.Model):
         verbose_name = "AI Request"
         verbose_name_plural = "AI Requests"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['status', 'lease_expires']),
+        ]
 
 class AITemplate(models.Model):
     TEMPLATE_CATEGORIES = [
@@ -0,0 +1,260 @@
+"""
+Per-user token quotas.
+
+Each plan has a daily and a monthly token limit in
+settings.TOKEN_QUOTAS['PLANS'] (None for unlimited); the counters reset at
+local midnight and on the first of the month, matching the days of
+AIUsageLog. Checking a request is O(1) against counters in memory, and never
+queries: a background thread seeds every user's counters from AIUsageLog
+with one grouped aggregate when the service starts, and every
+`resync_interval` seconds re-reads the counters of users active since the
+last sync, so usage in other processes is picked up once it is flushed.
+Until the first seeding finishes, checks wait for it up to `seed_timeout`
+seconds.
+
+A sync sets each counter to AIUsageLog plus this process's usage that is not
+flushed yet, so nothing is counted twice. Chat turns have no AIModel and are
+never in AIUsageLog; they count in the process that served them only, until
+it restarts.
+"""
+
+import atexit
+import threading
+from datetime import datetime, time as time_type, timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q, Sum
+from django.utils import timezone
+from accounts.entitlements import get_entitlement
+from .models import AIUsageLog
+from .usage import pending_tokens
+
+PERIOD_NAMES = {'day': 'daily', 'month': 'monthly'}
+
+
+def get_config():
+    config = {
+        'PLANS': {
+            'free': {'day': 20000, 'month': 200000},
+            'basic': {'day': 100000, 'month': 2000000},
+            'premium': {'day': 500000, 'month': 10000000},
+            'enterprise': {'day': None, 'month': None},
+        },
+        'resync_interval': 300,
+        'seed_timeout': 5,
+    }
+    config.update(getattr(settings, 'TOKEN_QUOTAS', {}))
+    return config
+
+
+def period_start(period, today):
+    return today if period == 'day' else today.replace(day=1)
+
+
+def seconds_until_reset(period, today):
+    if period == 'day':
+        reset = today + timedelta(days=1)
+    else:
+        reset = (today.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return (timezone.make_aware(datetime.combine(reset, time_type.min)) - timezone.now()).total_seconds()
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when a user has used up their tokens for the day or month.
+    """
+
+    def __init__(self, period, limit, retry_after):
+        self.period = period
+        self.limit = limit
+        self.retry_after = retry_after
+        super().__init__(f'Your {PERIOD_NAMES[period]} limit of {limit} tokens is used up.')
+
+
+class _Counter:
+    __slots__ = ('start', 'logged', 'unlogged')
+
+    def __init__(self, start, logged=0):
+        self.start = start
+        self.logged = logged  # Usage that reaches AIUsageLog; reset from it by each sync
+        self.unlogged = 0  # Chat usage, only ever counted here
+
+    @property
+    def used(self):
+        return self.logged + self.unlogged
+
+
+class QuotaService:
+    """
+    Day and month token counters per user id, kept in step with AIUsageLog
+    on a background thread.
+    """
+
+    def __init__(self, resync_interval=300, seed_timeout=5, plans=None):
+        self.plans = plans or {}
+        self.resync_interval = resync_interval
+        self.seed_timeout = seed_timeout
+        self._counters = {}  # user id -> {period: _Counter}
+        self._active = set()
+        self._lock = threading.Lock()
+        self._seeded = threading.Event()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='token-quotas', daemon=True)
+        self._thread.start()
+
+    def _current(self, user_id, today):
+        # Callers hold self._lock
+        counters = self._counters.get(user_id)
+        if counters is None:
+            counters = self._counters[user_id] = {
+                period: _Counter(period_start(period, today)) for period in PERIOD_NAMES
+            }
+        else:
+            for period, counter in counters.items():
+                start = period_start(period, today)
+                if counter.start != start:
+                    counters[period] = _Counter(start)
+        return counters
+
+    def check(self, user_id, plan, tokens=1):
+        """
+        Raise QuotaExceeded unless the user may spend `tokens` more on `plan`.
+        Returns the tokens left per period with a limit.
+        """
+        self._seeded.wait(self.seed_timeout)
+        limits = self.plans.get(plan) or {}
+        today = timezone.localdate()
+        remaining = {}
+        with self._lock:
+            counters = self._current(user_id, today)
+            self._active.add(user_id)
+            for period, limit in limits.items():
+                if limit is None:
+                    continue
+                used = counters[period].used
+                # A request larger than the whole limit is let through on an unused quota
+                if used + min(tokens, limit) > limit:
+                    raise QuotaExceeded(period, limit, seconds_until_reset(period, today))
+                remaining[period] = limit - used
+        return remaining
+
+    def charge(self, user_id, tokens, logged=True):
+        """
+        Count `tokens` spent by the user. `logged` usage also goes to
+        AIUsageLog, which later syncs replace it with.
+        """
+        today = timezone.localdate()
+        with self._lock:
+            for counter in self._current(user_id, today).values():
+                if logged:
+                    counter.logged += tokens
+                else:
+                    counter.unlogged += tokens
+            self._active.add(user_id)
+
+    def remaining(self, user_id, plan):
+        limits = self.plans.get(plan) or {}
+        with self._lock:
+            counters = self._current(user_id, timezone.localdate())
+            return {
+                period: {'limit': limit, 'remaining': max(limit - counters[period].used, 0)}
+                for period, limit in limits.items() if limit is not None
+            }
+
+    def sync(self, user_ids=None):
+        """
+        Reset the logged usage of `user_ids` (everyone if None) from
+        AIUsageLog and this process's unflushed usage.
+        """
+        today = timezone.localdate()
+        month_start = period_start('month', today)
+        logs = AIUsageLog.objects.filter(date__gte=month_start)
+        if user_ids is not None:
+            logs = logs.filter(user_id__in=user_ids)
+        rows = logs.values('user_id').annotate(
+            day=Sum('tokens_consumed', filter=Q(date=today)), month=Sum('tokens_consumed')
+        )
+        usage = {row['user_id']: {'day': row['day'] or 0, 'month': row['month'] or 0} for row in rows}
+
+        with self._lock:
+            pending = pending_tokens(month_start)
+            targets = set(usage) | set(pending) | set(self._counters) if user_ids is None else set(user_ids)
+            for user_id in targets:
+                counters = self._current(user_id, today)
+                logged = usage.get(user_id, {'day': 0, 'month': 0})
+                days = pending.get(user_id, {})
+                counters['day'].logged = logged['day'] + days.get(today, 0)
+                counters['month'].logged = logged['month'] + sum(days.values())
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while not self._seeded.is_set():
+            try:
+                self.sync()
+                self._seeded.set()
+            except Exception:
+                # Checks stop waiting after seed_timeout; retried until it works
+                with self._condition:
+                    if not self._closed:
+                        self._condition.wait(self.seed_timeout)
+                    if self._closed:
+                        return
+            finally:
+                close_old_connections()
+        while True:
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(self.resync_interval)
+                if self._closed:
+                    return
+            with self._lock:
+                active, self._active = self._active, set()
+            if not active:
+                continue
+            try:
+                self.sync(active)
+            except Exception:
+                with self._lock:
+                    self._active |= active
+            finally:
+                close_old_connections()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_quota_service():
+    """
+    The process-wide quota service, configured from settings.TOKEN_QUOTAS.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                config = get_config()
+                _service = QuotaService(config['resync_interval'], config['seed_timeout'], config['PLANS'])
+                atexit.register(_service.close)
+    return _service
+
+
+def check_quota(user, tokens=1):
+    """
+    Raise QuotaExceeded unless `user` may spend `tokens` now.
+    """
+    return get_quota_service().check(user.pk, get_entitlement(user).plan, tokens)
+
+
+def charge_quota(user_id, tokens, logged=True):
+    """
+    Count `tokens` spent by a user; `logged` is False for usage that never
+    reaches AIUsageLog.
+    """
+    if tokens:
+        get_quota_service().charge(user_id, tokens, logged)
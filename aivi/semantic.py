@@ -0,0 +1,322 @@
+"""
+Semantic response cache for paraphrased prompts.
+
+The exact-match response cache misses "what is photosynthesis?" versus
+"explain photosynthesis". Here prompts are embedded with a hashing vectorizer
+(stemmed words and word bigrams hashed into a sparse, L2-normalized vector) and
+looked up in a per-scope vector index, one scope per bot or template. A cached
+answer is returned when the cosine similarity clears the threshold.
+
+Prompts made of several parts, such as the variables of a template, can
+also be cached with those `parts`. A hit then needs the same part names, and
+every part must clear the threshold against its cached counterpart. Values
+swapped between two variables look alike as a whole but not part by part.
+
+The index class is pluggable through settings.SEMANTIC_CACHE['INDEX'].
+InvertedIndex is the default; BruteForceIndex scans every entry and exists as
+a reference for the benchmark.
+"""
+
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset("""
+a about an and are as at be but by can could define describe do does explain
+for from give how i in is it me mean my of on or please s so tell that the
+this to was what whats when where which who why will with you your
+""".split())
+
+
+def stem(word):
+    """
+    Strip common English inflections so "works", "worked" and "working" match.
+    """
+    for suffix in ('ing', 'ed', 'es', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith('ss'):
+            return word[:-len(suffix)]
+    return word
+
+
+class HashingEmbedder:
+    """
+    Stateless text embedder: hashed, signed counts of stemmed words plus
+    word bigrams at `bigram_weight`, sublinearly scaled and L2-normalized.
+    Vectors are {feature: weight} dicts.
+    """
+
+    def __init__(self, dimensions=2 ** 20, bigram_weight=0.5):
+        self.dimensions = dimensions
+        self.bigram_weight = bigram_weight
+
+    def tokens(self, text):
+        return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+
+    def embed(self, text):
+        words = self.tokens(text)
+        features = [(word, 1.0) for word in words]
+        if self.bigram_weight:
+            features.extend((f'{first} {second}', self.bigram_weight) for first, second in zip(words, words[1:]))
+
+        counts = {}
+        for feature, weight in features:
+            # crc32 is stable across processes, unlike hash()
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            index = hashed % self.dimensions
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            counts[index] = counts.get(index, 0.0) + sign * weight
+
+        vector = {
+            index: math.copysign(1.0 + math.log(abs(count)), count) if abs(count) >= 1 else count
+            for index, count in counts.items() if count
+        }
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if not norm:
+            return {}
+        return {index: weight / norm for index, weight in vector.items()}
+
+
+def cosine(first, second):
+    if len(first) > len(second):
+        first, second = second, first
+    return sum(weight * second.get(index, 0.0) for index, weight in first.items())
+
+
+class VectorIndex:
+    """
+    Base class for vector index backends holding unit-length sparse vectors.
+    """
+
+    def add(self, key, vector):
+        raise NotImplementedError('Vector indexes must implement add()')
+
+    def remove(self, key):
+        raise NotImplementedError('Vector indexes must implement remove()')
+
+    def nearest(self, vector, threshold):
+        """
+        Return (key, similarity) for the most similar entry with similarity of
+        at least `threshold`, or None.
+        """
+        raise NotImplementedError('Vector indexes must implement nearest()')
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class BruteForceIndex(VectorIndex):
+    """
+    Compares the query against every stored vector.
+    """
+
+    def __init__(self):
+        self.vectors = {}
+
+    def add(self, key, vector):
+        self.vectors[key] = vector
+
+    def remove(self, key):
+        self.vectors.pop(key, None)
+
+    def nearest(self, vector, threshold):
+        best = None
+        for key, stored in self.vectors.items():
+            similarity = cosine(vector, stored)
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+class InvertedIndex(VectorIndex):
+    """
+    Posting lists per feature with prefix filtering.
+
+    Query features are visited from the rarest to the most common. Once the
+    norm of the features not yet visited drops below the threshold, no entry
+    sharing only those features can reach it (Cauchy-Schwarz on unit vectors),
+    so the long posting lists of common words are never scanned. Candidates
+    are then scored exactly.
+    """
+
+    def __init__(self):
+        self.vectors = {}
+        self.postings = {}
+
+    def add(self, key, vector):
+        if key in self.vectors:
+            self.remove(key)
+        self.vectors[key] = vector
+        for index in vector:
+            self.postings.setdefault(index, set()).add(key)
+
+    def remove(self, key):
+        vector = self.vectors.pop(key, None)
+        if vector is None:
+            return
+        for index in vector:
+            posting = self.postings.get(index)
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self.postings[index]
+
+    def nearest(self, vector, threshold):
+        features = sorted(
+            (index for index in vector if index in self.postings),
+            key=lambda index: len(self.postings[index])
+        )
+        remaining = 1.0
+        candidates = set()
+        for index in features:
+            if math.sqrt(max(remaining, 0.0)) < threshold:
+                break
+            candidates.update(self.postings[index])
+            remaining -= vector[index] ** 2
+
+        best = None
+        for key in candidates:
+            similarity = cosine(vector, self.vectors[key])
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+class SemanticCache:
+    """
+    Per-scope vector indexes of cached prompts with LRU eviction and a TTL.
+    """
+
+    def __init__(self, index_class=InvertedIndex, embedder=None, threshold=0.9, max_entries_per_scope=5000, ttl=86400):
+        self.index_class = index_class
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries_per_scope = max_entries_per_scope
+        self.ttl = ttl
+        self._scopes = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _scope(self, scope):
+        if scope not in self._scopes:
+            # entries maps key -> (response, expires_at, part vectors) in least recently used order
+            self._scopes[scope] = (self.index_class(), OrderedDict())
+        return self._scopes[scope]
+
+    def _embed_parts(self, parts):
+        if parts is None:
+            return None
+        return {name: (str(text), self.embedder.embed(str(text))) for name, text in parts.items()}
+
+    def _parts_match(self, wanted, cached):
+        if wanted is None or cached is None:
+            return wanted is cached
+        if wanted.keys() != cached.keys():
+            return False
+        for name, (text, vector) in wanted.items():
+            cached_text, cached_vector = cached[name]
+            if text.strip().lower() != cached_text.strip().lower() and cosine(vector, cached_vector) < self.threshold:
+                return False
+        return True
+
+    def get(self, scope, prompt, parts=None):
+        """
+        Return the cached response for the most similar prompt in `scope`, or None.
+        With `parts` ({name: text}), only prompts cached with matching parts count.
+        """
+        vector = self.embedder.embed(prompt)
+        wanted = self._embed_parts(parts)
+        with self._lock:
+            if not vector or scope not in self._scopes:
+                self.misses += 1
+                return None
+            index, entries = self._scopes[scope]
+            now = time.monotonic()
+            while True:
+                match = index.nearest(vector, self.threshold)
+                if match is None:
+                    self.misses += 1
+                    return None
+                key = match[0]
+                response, expires_at, cached_parts = entries[key]
+                if expires_at > now:
+                    break
+                index.remove(key)
+                del entries[key]
+            if not self._parts_match(wanted, cached_parts):
+                self.misses += 1
+                return None
+            entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def set(self, scope, prompt, response, parts=None):
+        vector = self.embedder.embed(prompt)
+        if not vector:
+            return
+        cached_parts = self._embed_parts(parts)
+        with self._lock:
+            index, entries = self._scope(scope)
+            self._next_key += 1
+            key = self._next_key
+            index.add(key, vector)
+            entries[key] = (response, time.monotonic() + self.ttl, cached_parts)
+            while len(entries) > self.max_entries_per_scope:
+                evicted, _ = entries.popitem(last=False)
+                index.remove(evicted)
+                self.evictions += 1
+
+    def clear(self, scope=None):
+        with self._lock:
+            if scope is None:
+                self._scopes.clear()
+                self.hits = self.misses = self.evictions = 0
+            else:
+                self._scopes.pop(scope, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'scopes': len(self._scopes),
+                'entries': sum(len(entries) for _, entries in self._scopes.values()),
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """
+    The process-wide semantic cache, configured from settings.SEMANTIC_CACHE.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = dict(getattr(settings, 'SEMANTIC_CACHE', {}))
+                index_class = import_string(config.pop('INDEX', 'aivi.semantic.InvertedIndex'))
+                embedder = HashingEmbedder(dimensions=config.pop('dimensions', 2 ** 20))
+                _cache = SemanticCache(index_class=index_class, embedder=embedder, **config)
+    return _cache
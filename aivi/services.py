@@ -0,0 +1,146 @@
+"""
+Model invocation for AI Vi, AITemplate, ChatTemplate and Bot prompts.
+
+Every call goes through `agenerate`, which consults the exact and semantic
+response caches, checks the user's token quota and calls the model through
+the model gateway on a miss, and records the call as an AIRequest.
+"""
+
+import time
+from asgiref.sync import async_to_sync, sync_to_async
+from bot.knowledge import retrieve
+from django.db.models import F
+from django.utils import timezone
+from chat.context import count_tokens
+from .cache import get_response_cache, make_cache_key, render_prompt
+from .gateway import get_model_gateway
+from .models import AIModel, AIRequest, AITemplate
+from .quotas import charge_quota, check_quota
+from .semantic import get_semantic_cache
+from .usage import record_request
+
+
+def _record_request(user, ai_model, request_type, prompt, response, tokens_used, started, status='completed', error_message=''):
+    now = timezone.now()
+    ai_request = AIRequest.objects.create(
+        user=user,
+        ai_model=ai_model,
+        request_type=request_type,
+        prompt=prompt,
+        response=response,
+        status=status,
+        tokens_used=tokens_used,
+        cost=tokens_used * ai_model.cost_per_token,
+        processing_time=time.monotonic() - started,
+        error_message=error_message,
+        completed_at=now if status == 'completed' else None,
+    )
+    record_request(ai_request)
+    charge_quota(ai_request.user_id, tokens_used)
+    return ai_request
+
+
+async def agenerate(user, ai_model, prompt, system_prompt='', temperature=0.0, request_type='completion', use_cache=True, scope=None, semantic_text=None, semantic_parts=None):
+    """
+    Generate a response to `prompt` with `ai_model` and return the logged AIRequest.
+
+    Identical (model, system prompt, prompt, temperature) combinations are
+    answered from the response cache without calling the model. With a
+    `scope` (e.g. 'bot:12'), paraphrases of earlier prompts in that scope are
+    answered from the semantic cache, comparing `semantic_text` (the prompt
+    itself by default) and, when given, each of `semantic_parts`
+    ({name: text}) on its own. Cached answers are still logged, with zero
+    tokens and zero cost. Raises QuotaExceeded, without logging, when a cache
+    miss would take the user over their token quota.
+    """
+    started = time.monotonic()
+    cache = get_response_cache()
+    key = make_cache_key(ai_model.model_id, system_prompt, prompt, temperature)
+    if scope:
+        # Paraphrases only match under the same model, system prompt and temperature
+        scope = f"{scope}:{make_cache_key(ai_model.model_id, system_prompt, '', temperature)}"
+        semantic_text = semantic_text or prompt
+
+    if use_cache:
+        cached = cache.get(key)
+        if cached is None and scope:
+            cached = get_semantic_cache().get(scope, semantic_text, semantic_parts)
+        if cached is not None:
+            return await sync_to_async(_record_request)(user, ai_model, request_type, prompt, cached, 0, started)
+
+    await sync_to_async(check_quota)(user, count_tokens(system_prompt) + count_tokens(prompt))
+
+    messages = []
+    if system_prompt:
+        messages.append({'role': 'system', 'content': system_prompt})
+    messages.append({'role': 'user', 'content': prompt})
+
+    tokens = []
+    try:
+        async for token in get_model_gateway().stream(ai_model, messages, temperature=temperature, max_tokens=ai_model.max_tokens):
+            tokens.append(token)
+    except Exception as e:
+        return await sync_to_async(_record_request)(
+            user, ai_model, request_type, prompt, ''.join(tokens), len(tokens), started,
+            status='failed', error_message=str(e)
+        )
+
+    response = ''.join(tokens)
+    if use_cache:
+        cache.set(key, response)
+        if scope:
+            get_semantic_cache().set(scope, semantic_text, response, semantic_parts)
+    tokens_used = count_tokens(system_prompt) + count_tokens(prompt) + len(tokens)
+    return await sync_to_async(_record_request)(user, ai_model, request_type, prompt, response, tokens_used, started)
+
+
+generate = async_to_sync(agenerate)
+
+
+def generate_from_template(user, template, variables=None, ai_model=None, system_prompt='', temperature=0.0):
+    """
+    Render an AITemplate or ChatTemplate with `variables` and generate a response.
+    AITemplates use their own model; ChatTemplates need `ai_model`.
+    """
+    ai_model = ai_model or template.ai_model
+    prompt = render_prompt(template.prompt_template, variables)
+    # Renderings of one template differ only in their variables, so compare those;
+    # the shared template text would otherwise make every rendering look alike.
+    # Each variable must match on its own, or swapped values would look alike too
+    variables = variables or {}
+    variable_text = '\n'.join(f'{name}={value}' for name, value in sorted(variables.items()))
+    ai_request = generate(
+        user, ai_model, prompt, system_prompt=system_prompt, temperature=temperature,
+        request_type='generation', scope=f'{template._meta.label_lower}:{template.pk}' if variables else None,
+        semantic_text=variable_text, semantic_parts=variables
+    )
+    if isinstance(template, AITemplate):
+        AITemplate.objects.filter(pk=template.pk).update(usage_count=F('usage_count') + 1)
+    return ai_request
+
+
+def get_model_for_bot(bot):
+    """
+    The active AIModel matching the bot's model_name, or None.
+    """
+    return AIModel.objects.filter(model_id=bot.model_name, is_active=True).first()
+
+
+def generate_bot_reply(user, bot, message, knowledge_chunks=3):
+    """
+    Answer `message` with the bot's system prompt and temperature, grounded in
+    the best matching chunks of its knowledge base.
+    Returns None if no active AIModel matches the bot's model_name.
+    """
+    ai_model = get_model_for_bot(bot)
+    if ai_model is None:
+        return None
+    system_prompt = bot.system_prompt
+    chunks = retrieve(bot, message, k=knowledge_chunks) if knowledge_chunks else []
+    if chunks:
+        excerpts = '\n\n'.join(chunk.text for chunk in chunks)
+        system_prompt = f'{system_prompt}\n\nAnswer using these knowledge base excerpts where relevant:\n\n{excerpts}'.strip()
+    return generate(
+        user, ai_model, message, system_prompt=system_prompt, temperature=bot.temperature,
+        scope=f'bot:{bot.pk}'
+    )
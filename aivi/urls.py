@@ -1,6 +1,9 @@
 from django.urls import path
+from . import views
 
 
 urlpatterns = [
-    # path('', views.home, name='home'),
+    path('cache/stats/', views.response_cache_stats, name='aivi_response_cache_stats'),
+    path('gateway/stats/', views.model_gateway_stats, name='aivi_model_gateway_stats'),
+    path('templates/<int:template_id>/generate/', views.generate_template, name='aivi_generate_template'),
 ]
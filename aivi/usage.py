@@ -0,0 +1,336 @@
+"""
+Daily AIUsageLog counters.
+
+Updating a user's daily AIUsageLog row on every request is a read-modify-write
+that loses increments under concurrency and contends on one row. Instead the
+tokens and cost of finished AIRequests are summed in memory per (user, model,
+day) and written every `flush_interval` seconds, each key as one atomic
+UPDATE ... SET tokens_consumed = tokens_consumed + n, inserting the row when
+it does not exist yet.
+
+Records are appended to a per-process journal before they are counted, and
+the journal is cut back after each flush; the next process to start adopts
+the journal of a process that died into its own totals, so usage is not lost
+in a crash (it can be counted twice if the process dies between a flush and
+cutting the journal). A flush that fails other than on a locked or
+unavailable database is retried key by key, and keys that still fail (their
+user or model was deleted) are moved to the dead-letter file in the journal
+directory rather than blocking the rest. The rollup_ai_usage command rebuilds the logs of given days from
+AIRequest, the source of truth, with one grouped aggregate, after flushing
+the usage still pending so it is not counted again.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import date as date_type, datetime, time as time_type, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, close_old_connections, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import AIRequest, AIUsageLog
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; journals are then never replayed across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+COUNTED_STATUSES = ('completed', 'failed')
+DEAD_LETTER = 'dead-letter.jsonl'
+
+
+def get_config():
+    config = {
+        'flush_interval': 10,
+        'journal_dir': None,
+        'fsync': False,
+    }
+    config.update(getattr(settings, 'AI_USAGE_ACCUMULATOR', {}))
+    return config
+
+
+def _add(user_id, ai_model_id, day, tokens, cost):
+    """
+    Atomically add to one AIUsageLog row, creating it if needed.
+    """
+    updated = AIUsageLog.objects.filter(user_id=user_id, ai_model_id=ai_model_id, date=day).update(
+        tokens_consumed=F('tokens_consumed') + tokens, cost=F('cost') + cost
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            AIUsageLog.objects.create(user_id=user_id, ai_model_id=ai_model_id, date=day, tokens_consumed=tokens, cost=cost)
+    except IntegrityError:
+        # Another process inserted the row first
+        AIUsageLog.objects.filter(user_id=user_id, ai_model_id=ai_model_id, date=day).update(
+            tokens_consumed=F('tokens_consumed') + tokens, cost=F('cost') + cost
+        )
+
+
+class UsageAccumulator:
+    """
+    Sums usage per (user id, model id, date) and flushes it on a background thread.
+    """
+
+    def __init__(self, flush_interval=10, journal_dir=None, fsync=False):
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._pending = {}  # (user id, model id, date) -> [tokens, cost]
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._journal = None
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+            self._journal_dir = journal_dir
+            self._open_journal()
+            self._adopt_orphaned_journals()
+        self._thread = threading.Thread(target=self._run, name='ai-usage-accumulator', daemon=True)
+        self._thread.start()
+
+    def record(self, user_id, ai_model_id, day, tokens, cost):
+        if not tokens and not cost:
+            return
+        with self._condition:
+            self._write_journal(user_id, ai_model_id, day, tokens, cost)
+            self._merge(user_id, ai_model_id, day, tokens, Decimal(cost))
+
+    def pending(self, user_id=None):
+        """
+        Usage recorded but not flushed yet, as {(user id, model id, date): (tokens, cost)}.
+        """
+        with self._condition:
+            return {
+                key: tuple(value) for key, value in self._pending.items() if user_id is None or key[0] == user_id
+            }
+
+    def _merge(self, user_id, ai_model_id, day, tokens, cost):
+        # Callers hold self._condition
+        totals = self._pending.get((user_id, ai_model_id, day))
+        if totals is None:
+            self._pending[(user_id, ai_model_id, day)] = [tokens, cost]
+        else:
+            totals[0] += tokens
+            totals[1] += cost
+
+    def flush(self):
+        with self._condition:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            retry = self._write(pending)
+        except Exception:
+            self._restore(pending)
+            raise
+        if retry:
+            self._restore(retry)
+            raise OperationalError(f'{len(retry)} usage counters could not be written; they are still pending.')
+
+    def _restore(self, pending):
+        with self._condition:
+            for (user_id, ai_model_id, day), (tokens, cost) in pending.items():
+                self._merge(user_id, ai_model_id, day, tokens, cost)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+        if self._journal:
+            self._journal.close()
+            os.remove(self._journal.name)
+            self._journal = None
+
+    def _write(self, pending):
+        """
+        Write `pending` and return the counters to retry later. Raises if the
+        database is unavailable.
+        """
+        retry = {}
+        with self._write_lock:
+            try:
+                with transaction.atomic():
+                    for (user_id, ai_model_id, day), (tokens, cost) in sorted(pending.items()):
+                        _add(user_id, ai_model_id, day, tokens, cost)
+            except OperationalError:
+                raise
+            except Exception:
+                # Find the counters at fault, writing the others
+                for key, (tokens, cost) in sorted(pending.items()):
+                    try:
+                        with transaction.atomic():
+                            _add(*key, tokens, cost)
+                    except OperationalError:
+                        retry[key] = (tokens, cost)
+                    except Exception as e:
+                        self._write_dead_letter([key[0], key[1], key[2].isoformat(), tokens, str(cost)], e)
+            self._truncate_journal(keep=retry)
+        return retry
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_interval)  # Kept in memory and in the journal; retried on the next flush
+            finally:
+                close_old_connections()
+
+    # Journal
+
+    def _open_journal(self):
+        path = os.path.join(self._journal_dir, f'{os.getpid()}-{uuid.uuid4().hex}.jsonl')
+        self._journal = open(path, 'a+', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _write_journal(self, user_id, ai_model_id, day, tokens, cost):
+        if not self._journal:
+            return
+        self._journal.write(json.dumps([user_id, ai_model_id, day.isoformat(), tokens, str(cost)]) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _truncate_journal(self, keep=None):
+        if not self._journal:
+            return
+        with self._condition:
+            # Usage recorded while this flush ran is still pending, and `keep`
+            # is to be retried; rewrite them
+            self._journal.seek(0)
+            self._journal.truncate()
+            for pending in (keep or {}, self._pending):
+                for (user_id, ai_model_id, day), (tokens, cost) in pending.items():
+                    self._write_journal(user_id, ai_model_id, day, tokens, cost)
+
+    def _write_dead_letter(self, record, error):
+        logger.error('Dropped usage that could not be written: %r', error)
+        if not self._journal:
+            return
+        with open(os.path.join(self._journal_dir, DEAD_LETTER), 'a', encoding='utf-8') as dead_letter:
+            dead_letter.write(json.dumps({'error': repr(error), 'record': record}) + '\n')
+
+    def _adopt_orphaned_journals(self):
+        """
+        Count the usage in journals left by dead processes as this
+        accumulator's own; it is written with the next flush.
+        """
+        if not fcntl:
+            return
+        for name in os.listdir(self._journal_dir):
+            path = os.path.join(self._journal_dir, name)
+            if not name.endswith('.jsonl') or name == DEAD_LETTER or path == self._journal.name:
+                continue
+            with open(path, 'r', encoding='utf-8') as journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # Owned by a live process
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    try:
+                        user_id, ai_model_id, day, tokens, cost = json.loads(line)
+                        day, cost = date_type.fromisoformat(day), Decimal(cost)
+                    except Exception as e:
+                        self._write_dead_letter(line.rstrip('\n'), e)
+                        continue
+                    self.record(user_id, ai_model_id, day, tokens, cost)
+            os.remove(path)
+
+
+_accumulator = None
+_accumulator_lock = threading.Lock()
+
+
+def get_usage_accumulator():
+    """
+    The process-wide accumulator, configured from settings.AI_USAGE_ACCUMULATOR.
+    """
+    global _accumulator
+    if _accumulator is None:
+        with _accumulator_lock:
+            if _accumulator is None:
+                _accumulator = UsageAccumulator(**get_config())
+                atexit.register(_accumulator.close)
+    return _accumulator
+
+
+def record_usage(user_id, ai_model_id, created_at, tokens, cost):
+    """
+    Count the tokens and cost of a finished AIRequest made at `created_at`.
+    """
+    if tokens:
+        get_usage_accumulator().record(user_id, ai_model_id, timezone.localdate(created_at), tokens, cost)
+
+
+def pending_tokens(since):
+    """
+    Tokens recorded in this process on or after the date `since` but not
+    flushed yet, as {user id: {date: tokens}}.
+    """
+    if _accumulator is None:
+        return {}
+    tokens = {}
+    for (user_id, _, day), (count, _) in _accumulator.pending().items():
+        if day >= since:
+            days = tokens.setdefault(user_id, {})
+            days[day] = days.get(day, 0) + count
+    return tokens
+
+
+def record_request(ai_request):
+    if ai_request.status in COUNTED_STATUSES:
+        record_usage(ai_request.user_id, ai_request.ai_model_id, ai_request.created_at, ai_request.tokens_used, ai_request.cost)
+
+
+def rollup(days):
+    """
+    Rebuild the AIUsageLog rows of the given dates from their AIRequests.
+    Returns the number of rows written.
+
+    Usage this process has recorded but not written is flushed first, since
+    the rebuilt rows already include it. Accumulators of other processes are
+    not, so days still receiving requests are best rolled up once they are over.
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+    if _accumulator is not None:
+        _accumulator.flush()
+    start = timezone.make_aware(datetime.combine(days[0], time_type.min))
+    end = timezone.make_aware(datetime.combine(days[-1] + timedelta(days=1), time_type.min))
+    rows = (
+        AIRequest.objects.filter(status__in=COUNTED_STATUSES, tokens_used__gt=0, created_at__gte=start, created_at__lt=end)
+        .annotate(day=TruncDate('created_at'))
+        .filter(day__in=days)
+        .values('user_id', 'ai_model_id', 'day')
+        .annotate(tokens=Sum('tokens_used'), total_cost=Sum('cost'))
+    )
+    logs = [
+        AIUsageLog(
+            user_id=row['user_id'], ai_model_id=row['ai_model_id'], date=row['day'],
+            tokens_consumed=row['tokens'], cost=row['total_cost']
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        AIUsageLog.objects.filter(date__in=days).delete()
+        AIUsageLog.objects.bulk_create(logs, batch_size=1000)
+    return len(logs)
@@ -1,3 +1,62 @@
-from django.shortcuts import render
+import math
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from .cache import get_response_cache
+from .gateway import get_model_gateway
+from .models import AITemplate
+from .quotas import QuotaExceeded
+from .semantic import get_semantic_cache
+from .services import generate_from_template
 
-# Create your views here.
+
+@login_required
+@require_POST
+def generate_template(request, template_id):
+    """
+    Fill one of the user's own or a public AITemplate with the posted values
+    of its variables and generate a response. Renderings asked for before are
+    answered from the response caches. Responds 429 when the user is over
+    their token quota.
+    """
+    template = AITemplate.objects.filter(
+        Q(created_by=request.user) | Q(is_public=True), pk=template_id, ai_model__is_active=True
+    ).select_related('ai_model').first()
+    if template is None:
+        return JsonResponse({'error': 'Template not found.'}, status=404)
+    variables = {name: request.POST[name] for name in template.variables if name in request.POST}
+
+    try:
+        ai_request = generate_from_template(request.user, template, variables)
+    except QuotaExceeded as e:
+        response = JsonResponse({'error': str(e)}, status=429)
+        response['Retry-After'] = str(math.ceil(e.retry_after))
+        return response
+    if ai_request.status == 'failed':
+        return JsonResponse({'error': 'The model request failed.'}, status=502)
+    return JsonResponse({
+        'response': ai_request.response,
+        'request_id': ai_request.pk,
+        'tokens_used': ai_request.tokens_used,
+    })
+
+
+@staff_member_required
+def response_cache_stats(request):
+    """
+    Hit/miss counters and size of this process's exact and semantic response caches.
+    """
+    return JsonResponse({
+        'exact': get_response_cache().stats(),
+        'semantic': get_semantic_cache().stats(),
+    })
+
+
+@staff_member_required
+def model_gateway_stats(request):
+    """
+    Active, waiting, completed, failed and rejected requests per model in this process.
+    """
+    return JsonResponse(get_model_gateway().stats())
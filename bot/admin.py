@@ -1,10 +1,13 @@
 from django.contrib import admin
-from .models import Bot, BotConversation, BotMessage, BotKnowledgeBase
+from chat.search import FullTextSearchAdminMixin
+from .ingestion import get_ingestion_worker
+from .models import Bot, BotConversation, BotMessage, BotMessageArchive, BotKnowledgeBase
 
 class BotKnowledgeBaseInline(admin.TabularInline):
     model = BotKnowledgeBase
     extra = 0
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['index_status', 'index_progress', 'created_at', 'updated_at']
+    exclude = ['index_error', 'indexed_at']
 
 class BotMessageInline(admin.TabularInline):
     model = BotMessage
@@ -40,12 +43,13 @@ class BotConversationAdmin(admin.ModelAdmin):
     list_display = ['id', 'bot', 'user', 'title', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at', 'bot__name']
     search_fields = ['bot__name', 'user__username', 'title']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['summary', 'summary_through', 'created_at', 'updated_at']
     inlines = [BotMessageInline]
     date_hierarchy = 'created_at'
 
 @admin.register(BotMessage)
-class BotMessageAdmin(admin.ModelAdmin):
+class BotMessageAdmin(FullTextSearchAdminMixin, admin.ModelAdmin):
+    search_kind = 'bot'
     list_display = ['id', 'conversation', 'message_type', 'content_preview', 'tokens_used', 'response_time', 'timestamp']
     list_filter = ['message_type', 'timestamp']
     search_fields = ['conversation__bot__name', 'conversation__user__username', 'content']
@@ -57,7 +61,25 @@ class BotMessageAdmin(admin.ModelAdmin):
 
 @admin.register(BotKnowledgeBase)
 class BotKnowledgeBaseAdmin(admin.ModelAdmin):
-    list_display = ['title', 'bot', 'is_active', 'source_url', 'created_at']
-    list_filter = ['is_active', 'created_at', 'bot__name']
+    list_display = ['title', 'bot', 'is_active', 'index_status', 'index_progress', 'source_url', 'created_at']
+    list_filter = ['is_active', 'index_status', 'created_at', 'bot__name']
     search_fields = ['title', 'content', 'bot__name']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['index_status', 'index_progress', 'index_error', 'indexed_at', 'created_at', 'updated_at']
+    actions = ['reindex_entries']
+
+    def reindex_entries(self, request, queryset):
+        worker = get_ingestion_worker()
+        entry_ids = list(queryset.values_list('pk', flat=True))
+        queryset.update(index_status='pending', index_progress=0, index_error='')
+        for entry_id in entry_ids:
+            worker.submit(entry_id)
+        self.message_user(request, f'{len(entry_ids)} entries queued for indexing.')
+    reindex_entries.short_description = 'Re-index selected entries'
+
+@admin.register(BotMessageArchive)
+class BotMessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversation', 'message_count', 'first_timestamp', 'last_timestamp', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['conversation__id']
+    readonly_fields = ['conversation', 'first_message_id', 'last_message_id', 'message_count', 'first_timestamp', 'last_timestamp', 'created_at']
+    exclude = ['data']
@@ -0,0 +1,127 @@
+"""
+Streaming text extraction from knowledge base uploads.
+
+Uploads are read in fixed-size pieces and turned into normalized text segments
+as they arrive, so memory use does not grow with the size of the file. Text
+files are decoded incrementally and cut at whitespace so no word is split
+between segments; PDFs are extracted page by page when pypdf is installed.
+"""
+
+import codecs
+import os
+import re
+import unicodedata
+
+try:
+    import pypdf
+except ImportError:  # PDF uploads are then reported as unsupported
+    pypdf = None
+
+DEFAULT_READ_SIZE = 64 * 1024
+MAX_CARRY = 4096  # Longest unbroken run of characters held back between reads
+
+_CONTROL = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class ExtractionError(Exception):
+    """
+    Raised when an upload's text cannot be extracted.
+    """
+    pass
+
+
+def normalize_text(text):
+    """
+    NFKC-normalize (folding ligatures and full-width forms), drop control
+    characters and collapse whitespace.
+    """
+    text = unicodedata.normalize('NFKC', text)
+    return _WHITESPACE.sub(' ', _CONTROL.sub(' ', text)).strip()
+
+
+def _last_whitespace(text):
+    index = len(text) - 1
+    while index >= 0 and not text[index].isspace():
+        index -= 1
+    return index
+
+
+def stream_text_segments(file, read_size=DEFAULT_READ_SIZE, progress=None):
+    """
+    Yield normalized segments of a binary file object holding UTF-8 text,
+    reading `read_size` bytes at a time. `progress` is called with the number
+    of bytes consumed by each read.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    carry = ''
+    while True:
+        data = file.read(read_size)
+        final = not data
+        text = carry + decoder.decode(data, final=final)
+        if final:
+            segment, carry = text, ''
+        else:
+            # Hold a trailing partial word back for the next read; a run without
+            # any whitespace is cut rather than buffered indefinitely
+            cut = _last_whitespace(text) + 1
+            if len(text) - cut > MAX_CARRY:
+                cut = len(text)
+            segment, carry = text[:cut], text[cut:]
+
+        segment = normalize_text(segment)
+        if segment:
+            yield segment
+        if progress and data:
+            progress(len(data))
+        if final:
+            return
+
+
+def stream_pdf_segments(file, progress=None):
+    """
+    Yield the normalized text of each page of a PDF. `progress` is called
+    with the fraction of pages done.
+    """
+    if pypdf is None:
+        raise ExtractionError('PDF uploads need the pypdf package installed.')
+    try:
+        reader = pypdf.PdfReader(file)
+        pages = len(reader.pages)
+        for number, page in enumerate(reader.pages, start=1):
+            segment = normalize_text(page.extract_text() or '')
+            if segment:
+                yield segment
+            if progress:
+                progress(number / pages)
+    except pypdf.errors.PdfReadError as e:
+        raise ExtractionError(f'Could not read PDF: {e}')
+
+
+def is_pdf(field_file):
+    if os.path.splitext(field_file.name)[1].lower() == '.pdf':
+        return True
+    with field_file.open('rb') as f:
+        return f.read(5) == b'%PDF-'
+
+
+def upload_segments(field_file, read_size=DEFAULT_READ_SIZE, progress=None):
+    """
+    Yield normalized text segments of an uploaded FieldFile.
+    `progress` is called with the fraction of the file processed so far.
+    """
+    pdf = is_pdf(field_file)
+    with field_file.open('rb') as f:
+        if pdf:
+            yield from stream_pdf_segments(f, progress)
+            return
+
+        size = field_file.size or 1
+        consumed = 0
+
+        def count(read):
+            nonlocal consumed
+            consumed += read
+            progress(min(consumed / size, 1.0))
+
+        yield from stream_text_segments(f, read_size, count if progress else None)
@@ -0,0 +1,125 @@
+"""
+Background indexing of knowledge base entries.
+
+Saving a BotKnowledgeBase row only queues it. A worker thread streams the
+entry's text and upload into the bot's knowledge index and records progress
+on the row (index_status, index_progress), so admin saves return immediately
+however large the upload is.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from django.utils import timezone
+from .knowledge import KnowledgeIndex, entry_segments, get_config
+from .models import BotKnowledgeBase
+
+PROGRESS_INTERVAL = 1.0  # Seconds between progress writes
+
+
+def _set_status(entry_id, **fields):
+    # update() rather than save(), so no post_save signal queues the entry again
+    BotKnowledgeBase.objects.filter(pk=entry_id).update(**fields)
+
+
+def ingest_entry(entry_id, progress=None):
+    """
+    Index one entry now, recording its status and progress on the row.
+    `progress`, if given, is also called with each percentage written.
+    Returns the final index_status.
+    """
+    try:
+        entry = BotKnowledgeBase.objects.get(pk=entry_id)
+    except BotKnowledgeBase.DoesNotExist:
+        return None
+
+    index = KnowledgeIndex(entry.bot_id)
+    if not entry.is_active:
+        index.remove_entry(entry.pk)
+        _set_status(entry_id, index_status='removed', index_progress=0, index_error='')
+        return 'removed'
+
+    _set_status(entry_id, index_status='indexing', index_progress=0, index_error='')
+    last_written = [time.monotonic(), 0]
+
+    def report(fraction):
+        percent = int(fraction * 100)
+        now = time.monotonic()
+        if percent > last_written[1] and now - last_written[0] >= PROGRESS_INTERVAL:
+            _set_status(entry_id, index_progress=percent)
+            last_written[:] = [now, percent]
+            if progress:
+                progress(percent)
+
+    try:
+        index.index_entry(entry.pk, entry_segments(entry, report))
+    except Exception as e:
+        _set_status(entry_id, index_status='failed', index_error=str(e))
+        return 'failed'
+
+    _set_status(entry_id, index_status='indexed', index_progress=100, indexed_at=timezone.now())
+    if progress:
+        progress(100)
+    return 'indexed'
+
+
+class IngestionWorker:
+    """
+    Indexes queued entries on background threads.
+
+    An entry queued again before its run starts is indexed once; an entry
+    queued while it is being indexed runs again afterwards, so the index
+    always ends up reflecting the latest save.
+    """
+
+    def __init__(self, workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='knowledge-ingestion')
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._running = set()
+        self._rerun = set()
+
+    def submit(self, entry_id):
+        with self._lock:
+            if entry_id in self._running:
+                self._rerun.add(entry_id)
+                return
+            if entry_id in self._queued:
+                return
+            self._queued.add(entry_id)
+        self._executor.submit(self._run, entry_id)
+
+    def _run(self, entry_id):
+        with self._lock:
+            self._queued.discard(entry_id)
+            self._running.add(entry_id)
+        try:
+            ingest_entry(entry_id)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._running.discard(entry_id)
+                rerun = entry_id in self._rerun
+                self._rerun.discard(entry_id)
+            if rerun:
+                self.submit(entry_id)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_ingestion_worker():
+    """
+    The process-wide worker, sized by settings.KNOWLEDGE_INDEX['ingestion_workers'].
+    """
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = IngestionWorker(get_config()['ingestion_workers'])
+    return _worker
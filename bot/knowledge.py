@@ -0,0 +1,522 @@
+"""
+Retrieval index over a bot's knowledge base.
+
+Knowledge base entries are split into overlapping word chunks and ranked with
+BM25. Each bot has a directory of immutable segments; a segment holds the
+chunks of one or more entries as flat arrays that queries memory-map:
+
+    <segment>.json       term -> [postings offset, document frequency], chunk totals
+    <segment>.postings   uint32 (chunk number, term frequency) pairs, grouped by term
+    <segment>.lengths    uint32 token count per chunk
+    <segment>.entries    uint32 knowledge base entry id per chunk
+    <segment>.offsets    uint64 byte offset of each chunk in .text
+    <segment>.text       UTF-8 chunk texts
+
+manifest.json names the segment holding the live chunks of each entry.
+Re-indexing one entry writes a segment for that entry alone and repoints the
+manifest, which hides the entry's chunks in older segments; once a bot has
+more than `max_segments` segments the small ones are merged. As in Lucene,
+BM25 collection statistics count stale chunks until a merge drops them.
+"""
+
+import bisect
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+import uuid
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils import timezone
+from aivi.semantic import STOP_WORDS, stem
+from .extraction import DEFAULT_READ_SIZE, upload_segments
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; writers then rely on a single indexing process
+    fcntl = None
+
+_WORD = re.compile(r'\w+')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Postings buffered in memory while writing a segment before spilling to disk (8 bytes each)
+POSTINGS_BUFFER = 2 * 1024 * 1024
+
+RetrievedChunk = namedtuple('RetrievedChunk', ['entry_id', 'text', 'score'])
+
+
+def get_config():
+    config = {
+        'directory': os.path.join(settings.BASE_DIR, 'var', 'knowledge_index'),
+        'chunk_words': 200,
+        'chunk_overlap': 40,
+        'max_segments': 8,
+        'read_size': DEFAULT_READ_SIZE,
+        'ingestion_workers': 1,
+    }
+    config.update(getattr(settings, 'KNOWLEDGE_INDEX', {}))
+    return config
+
+
+def tokenize(text):
+    return [stem(word) for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+
+
+def chunk_text(segments, chunk_words=200, overlap=40):
+    """
+    Split an iterable of text segments into chunks of `chunk_words` words, each
+    repeating the last `overlap` words of the previous chunk. Segments are
+    consumed lazily, so a large document is never held in memory whole.
+    """
+    step = max(chunk_words - overlap, 1)
+    window = []
+    emitted = False
+    for segment in segments:
+        window.extend(segment.split())
+        while len(window) >= chunk_words:
+            yield ' '.join(window[:chunk_words])
+            emitted = True
+            window = window[step:]
+    # The last `overlap` words already ended the previous chunk
+    if window and (not emitted or len(window) > overlap):
+        yield ' '.join(window)
+
+
+def entry_segments(entry, progress=None):
+    """
+    Text segments of a knowledge base entry: its title, content and uploaded
+    file, the latter streamed. `progress` receives the fraction of the upload
+    processed so far.
+    """
+    yield entry.title
+    yield entry.content
+    if entry.file_upload:
+        yield from upload_segments(entry.file_upload, get_config()['read_size'], progress)
+
+
+class _PostingsWriter:
+    """
+    Collects (chunk number, term frequency) postings per term. Once
+    `buffer_limit` postings are buffered they are spilled to a run file, and
+    finish() concatenates each term's postings across runs, so memory stays
+    bounded however large the segment. Chunk numbers only grow, so the
+    concatenated postings of a term stay sorted.
+    """
+
+    def __init__(self, path, buffer_limit=None):
+        self.path = path
+        self.buffer_limit = buffer_limit or POSTINGS_BUFFER
+        self._term_ids = {}
+        self._buffer = {}
+        self._buffered = 0
+        # Per run: file path and, indexed by term id, offsets and lengths in uint32 units
+        self._runs = []
+
+    def add(self, number, counts):
+        for token, count in counts.items():
+            term_id = self._term_ids.setdefault(token, len(self._term_ids))
+            term_postings = self._buffer.get(term_id)
+            if term_postings is None:
+                term_postings = self._buffer[term_id] = array('I')
+            term_postings.append(number)
+            term_postings.append(count)
+        self._buffered += len(counts)
+        if self._buffered >= self.buffer_limit:
+            self._spill()
+
+    def _spill(self):
+        run_path = f'{self.path}.run{len(self._runs)}'
+        offsets = array('Q', bytes(8 * len(self._term_ids)))
+        lengths = array('I', bytes(4 * len(self._term_ids)))
+        position = 0
+        with open(run_path, 'wb') as f:
+            for term_id, term_postings in self._buffer.items():
+                term_postings.tofile(f)
+                offsets[term_id] = position
+                lengths[term_id] = len(term_postings)
+                position += len(term_postings)
+        self._runs.append((run_path, offsets, lengths))
+        self._buffer = {}
+        self._buffered = 0
+
+    def finish(self):
+        """
+        Write the .postings file and return the term dictionary.
+        """
+        terms = {}
+        position = 0
+        with open(self.path + '.postings', 'wb') as f:
+            if not self._runs:
+                for term, term_id in self._term_ids.items():
+                    term_postings = self._buffer[term_id]
+                    term_postings.tofile(f)
+                    terms[term] = [position // 2, len(term_postings) // 2]
+                    position += len(term_postings)
+                return terms
+
+            if self._buffer:
+                self._spill()
+            run_files = [open(run_path, 'rb') for run_path, _, _ in self._runs]
+            try:
+                for term, term_id in self._term_ids.items():
+                    start = position
+                    for run_file, (_, offsets, lengths) in zip(run_files, self._runs):
+                        if term_id < len(lengths) and lengths[term_id]:
+                            f.write(os.pread(run_file.fileno(), lengths[term_id] * 4, offsets[term_id] * 4))
+                            position += lengths[term_id]
+                    terms[term] = [start // 2, (position - start) // 2]
+            finally:
+                for run_file in run_files:
+                    run_file.close()
+        self.discard()
+        return terms
+
+    def discard(self):
+        for run_path, _, _ in self._runs:
+            os.remove(run_path)
+        self._runs = []
+
+
+def _write_segment(directory, chunks):
+    """
+    Write (entry_id, text) chunks as a new segment.
+    Returns the segment name, or None if there were no chunks.
+    """
+    name = uuid.uuid4().hex
+    path = os.path.join(directory, name)
+    postings = _PostingsWriter(path)
+    lengths = array('I')
+    entries = array('I')
+    offsets = array('Q', [0])
+
+    try:
+        with open(path + '.text', 'wb') as text_file:
+            for number, (entry_id, text) in enumerate(chunks):
+                tokens = tokenize(text)
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                postings.add(number, counts)
+                lengths.append(len(tokens))
+                entries.append(entry_id)
+                encoded = text.encode('utf-8')
+                text_file.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+    except BaseException:
+        postings.discard()
+        raise
+
+    if not lengths:
+        os.remove(path + '.text')
+        return None
+
+    terms = postings.finish()
+    for suffix, values in (('.lengths', lengths), ('.entries', entries), ('.offsets', offsets)):
+        with open(path + suffix, 'wb') as f:
+            values.tofile(f)
+    # Written last: a segment without its .json is incomplete and never referenced
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'chunks': len(lengths), 'total_length': sum(lengths), 'terms': terms}, f)
+    return name
+
+
+class Segment:
+    """
+    Read-only, memory-mapped view of one segment.
+    """
+
+    SUFFIXES = ('.json', '.postings', '.lengths', '.entries', '.offsets', '.text')
+
+    def __init__(self, directory, name):
+        self.name = name
+        path = os.path.join(directory, name)
+        with open(path + '.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.chunks = meta['chunks']
+        self.total_length = meta['total_length']
+        self.terms = meta['terms']
+        self._maps = []
+        self.postings = self._map(path + '.postings').cast('I')
+        self.lengths = self._map(path + '.lengths').cast('I')
+        self.entries = self._map(path + '.entries').cast('I')
+        self.offsets = self._map(path + '.offsets').cast('Q')
+        self.text = self._map(path + '.text')
+
+    def _map(self, filename):
+        with open(filename, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return memoryview(b'')
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped)
+
+    def chunk_text(self, number):
+        return bytes(self.text[self.offsets[number]:self.offsets[number + 1]]).decode('utf-8')
+
+    def live_mask(self, live_entries):
+        """
+        One byte per chunk: 1 if its entry still lives in this segment.
+        """
+        live_ids = {int(entry_id) for entry_id, name in live_entries.items() if name == self.name}
+        return bytes(entry_id in live_ids for entry_id in self.entries)
+
+    def live_chunks(self, live_entries):
+        """
+        Yield (entry_id, text) for chunks whose entry still lives in this segment.
+        """
+        for number in range(self.chunks):
+            entry_id = self.entries[number]
+            if live_entries.get(str(entry_id)) == self.name:
+                yield entry_id, self.chunk_text(number)
+
+
+# Open segments per index directory, kept while the manifest references them,
+# and per directory the last manifest read (keyed by its inode and mtime)
+# together with the live masks of its segments
+_segments = {}
+_manifests = {}
+_segments_lock = threading.Lock()
+
+
+def _open_segments(directory, names):
+    with _segments_lock:
+        cached = _segments.get(directory, {})
+        opened = {name: cached.get(name) or Segment(directory, name) for name in names}
+        _segments[directory] = opened
+        return [opened[name] for name in names]
+
+
+class KnowledgeIndex:
+    """
+    The BM25 index of one bot's knowledge base.
+    """
+
+    def __init__(self, bot_id, config=None):
+        self.config = config or get_config()
+        self.bot_id = bot_id
+        self.directory = os.path.join(self.config['directory'], f'bot_{bot_id}')
+        self._manifest_path = os.path.join(self.directory, 'manifest.json')
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segments': [], 'entries': {}}
+
+    def _load(self):
+        """
+        The open segments of the current manifest and their live masks,
+        recomputed only when the manifest changed.
+        """
+        for _ in range(3):
+            try:
+                stat = os.stat(self._manifest_path)
+            except FileNotFoundError:
+                return [], []
+            version = (stat.st_ino, stat.st_mtime_ns)
+            cached = _manifests.get(self.directory)
+            if cached and cached[0] == version:
+                manifest, masks = cached[1], cached[2]
+            else:
+                manifest, masks = self._read_manifest(), None
+            try:
+                segments = _open_segments(self.directory, manifest['segments'])
+            except FileNotFoundError:
+                continue  # Merged away by another process after we read the manifest
+            if masks is None:
+                masks = [segment.live_mask(manifest['entries']) for segment in segments]
+                _manifests[self.directory] = (version, manifest, masks)
+            return segments, masks
+        raise RuntimeError(f'Knowledge index for bot {self.bot_id} keeps changing while being read.')
+
+    @contextmanager
+    def _write_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'manifest.lock'), 'w') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _commit(self, manifest):
+        live = set(manifest['entries'].values())
+        manifest['segments'] = [name for name in manifest['segments'] if name in live]
+        temporary = self._manifest_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, self._manifest_path)
+
+        # Readers that already mapped an old segment keep it until they drop it
+        for filename in os.listdir(self.directory):
+            name, suffix = os.path.splitext(filename)
+            # Also removes run files left behind by an interrupted segment write
+            if (suffix in Segment.SUFFIXES or suffix.startswith('.run')) and name != 'manifest' and name not in live:
+                os.remove(os.path.join(self.directory, filename))
+
+    def _chunks(self, entry_id, segments):
+        for chunk in chunk_text(segments, self.config['chunk_words'], self.config['chunk_overlap']):
+            yield entry_id, chunk
+
+    def index_entry(self, entry_id, segments):
+        """
+        (Re-)index one entry from an iterable of its text segments.
+        """
+        with self._write_lock():
+            manifest = self._read_manifest()
+            name = _write_segment(self.directory, self._chunks(entry_id, segments))
+            if name:
+                manifest['segments'].append(name)
+                manifest['entries'][str(entry_id)] = name
+            else:
+                manifest['entries'].pop(str(entry_id), None)
+            if len(manifest['segments']) > self.config['max_segments']:
+                manifest = self._merge(manifest)
+            self._commit(manifest)
+
+    def remove_entry(self, entry_id):
+        with self._write_lock():
+            manifest = self._read_manifest()
+            if manifest['entries'].pop(str(entry_id), None):
+                self._commit(manifest)
+
+    def rebuild(self, entries):
+        """
+        Replace the whole index from an iterable of (entry_id, segments) pairs.
+        """
+        def chunks():
+            for entry_id, segments in entries:
+                indexed.add(entry_id)
+                yield from self._chunks(entry_id, segments)
+
+        indexed = set()
+        with self._write_lock():
+            name = _write_segment(self.directory, chunks())
+            manifest = {'segments': [name] if name else [], 'entries': {}}
+            if name:
+                manifest['entries'] = {str(entry_id): name for entry_id in indexed}
+            self._commit(manifest)
+
+    def _merge(self, manifest):
+        """
+        Merge the small segments into one. The largest segment is left alone
+        unless at least half of its chunks are stale, so a single-entry update
+        does not rewrite the whole bot.
+        """
+        live = manifest['entries']
+        segments = _open_segments(self.directory, manifest['segments'])
+        largest = max(segments, key=lambda segment: segment.chunks)
+        if sum(largest.live_mask(live)) * 2 > largest.chunks:
+            segments.remove(largest)
+
+        name = _write_segment(self.directory, (
+            chunk for segment in segments for chunk in segment.live_chunks(live)
+        ))
+        merged = {segment.name for segment in segments}
+        return {
+            'segments': [segment for segment in manifest['segments'] if segment not in merged] + ([name] if name else []),
+            'entries': {
+                entry_id: name if segment in merged else segment
+                for entry_id, segment in live.items() if name or segment not in merged
+            },
+        }
+
+    def delete(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with _segments_lock:
+            _segments.pop(self.directory, None)
+            _manifests.pop(self.directory, None)
+
+    def search(self, query, k=5):
+        """
+        Return the `k` best matching chunks as RetrievedChunk tuples, best first.
+
+        Terms are scored from the rarest to the most common (MaxScore): once the
+        best possible contribution of the remaining terms cannot lift an unseen
+        chunk into the top `k`, their posting lists are no longer scanned and
+        only the surviving candidates are looked up in them.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        segments, masks = self._load()
+        if not segments:
+            return []
+        total_chunks = sum(segment.chunks for segment in segments)
+        average_length = sum(segment.total_length for segment in segments) / total_chunks
+
+        query_terms = []
+        for term in terms:
+            found = [(index, segment.terms[term]) for index, segment in enumerate(segments) if term in segment.terms]
+            frequency = sum(count for _, (_, count) in found)
+            if frequency:
+                idf = math.log(1 + (total_chunks - frequency + 0.5) / (frequency + 0.5))
+                query_terms.append((idf, found))
+        query_terms.sort(key=lambda item: item[0], reverse=True)
+
+        # bounds[i] is the most terms i.. can add to any chunk's score
+        bounds = [0.0] * (len(query_terms) + 1)
+        for position in range(len(query_terms) - 1, -1, -1):
+            bounds[position] = bounds[position + 1] + query_terms[position][0] * (BM25_K1 + 1)
+
+        def length_norm(segment, number):
+            return BM25_K1 * (1 - BM25_B + BM25_B * segment.lengths[number] / average_length)
+
+        scores = {}
+        for position, (idf, found) in enumerate(query_terms):
+            if len(scores) >= k:
+                kth = heapq.nlargest(k, scores.values())[-1]
+                if bounds[position] < kth:
+                    candidates = [key for key, score in scores.items() if score + bounds[position] >= kth]
+                    scores = {key: scores[key] for key in candidates}
+                    for remaining_idf, remaining_found in query_terms[position:]:
+                        for index, (offset, count) in remaining_found:
+                            segment = segments[index]
+                            postings = segment.postings[offset * 2:(offset + count) * 2]
+                            numbers = postings[::2]
+                            for key in candidates:
+                                if key >> 32 != index:
+                                    continue
+                                number = key & 0xFFFFFFFF
+                                found_at = bisect.bisect_left(numbers, number)
+                                if found_at < count and numbers[found_at] == number:
+                                    term_frequency = postings[found_at * 2 + 1]
+                                    scores[key] += remaining_idf * term_frequency * (BM25_K1 + 1) / (
+                                        term_frequency + length_norm(segment, number))
+                    break
+
+            for index, (offset, count) in found:
+                segment = segments[index]
+                mask = masks[index]
+                base = index << 32
+                postings = segment.postings[offset * 2:(offset + count) * 2]
+                for number, term_frequency in zip(postings[::2], postings[1::2]):
+                    if mask[number]:
+                        key = base | number
+                        scores[key] = scores.get(key, 0.0) + idf * term_frequency * (BM25_K1 + 1) / (
+                            term_frequency + length_norm(segment, number))
+
+        results = []
+        for key, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+            segment = segments[key >> 32]
+            number = key & 0xFFFFFFFF
+            results.append(RetrievedChunk(segment.entries[number], segment.chunk_text(number), score))
+        return results
+
+
+def rebuild_bot_index(bot):
+    entries = bot.knowledge_base.filter(is_active=True).order_by('pk')
+    KnowledgeIndex(bot.pk).rebuild((entry.pk, entry_segments(entry)) for entry in entries.iterator())
+    entries.update(index_status='indexed', index_progress=100, index_error='', indexed_at=timezone.now())
+    bot.knowledge_base.filter(is_active=False).update(index_status='removed', index_progress=0, index_error='')
+
+
+def retrieve(bot, query, k=5):
+    return KnowledgeIndex(bot.pk).search(query, k)
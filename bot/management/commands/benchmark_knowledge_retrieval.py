@@ -0,0 +1,58 @@
+import random
+import statistics
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from bot.knowledge import KnowledgeIndex, get_config
+
+class Command(BaseCommand):
+    help = 'Measure knowledge base retrieval latency and single-entry re-indexing against a full rebuild'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=2000, help='Knowledge base entries in the benchmark bot')
+        parser.add_argument('--words', type=int, default=1000, help='Words per entry')
+        parser.add_argument('--vocabulary', type=int, default=30000, help='Distinct words entries are drawn from')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        words = [f'term{i}' for i in range(options['vocabulary'])]
+        weights = [1 / (rank + 1) for rank in range(len(words))]
+
+        def text():
+            return ' '.join(rng.choices(words, weights, k=options['words']))
+
+        entries = {entry_id: text() for entry_id in range(1, options['entries'] + 1)}
+        queries = [' '.join(rng.choices(words, weights, k=rng.randint(3, 8))) for _ in range(options['queries'])]
+
+        with tempfile.TemporaryDirectory() as directory:
+            config = dict(get_config(), directory=directory)
+            index = KnowledgeIndex(0, config)
+
+            started = time.perf_counter()
+            index.rebuild((entry_id, [content]) for entry_id, content in entries.items())
+            rebuilt = time.perf_counter() - started
+            self.stdout.write(f'Full rebuild of {len(entries)} entries: {rebuilt:.2f}s')
+
+            updates = []
+            for entry_id in rng.sample(sorted(entries), 20):
+                started = time.perf_counter()
+                index.index_entry(entry_id, [text()])
+                updates.append(time.perf_counter() - started)
+            self.stdout.write(
+                f'Single-entry re-index: median {statistics.median(updates) * 1000:.1f}ms, '
+                f'max {max(updates) * 1000:.1f}ms (includes merges every {config["max_segments"]} updates)'
+            )
+
+            samples = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query, options['k'])
+                samples.append(time.perf_counter() - started)
+            samples.sort()
+            self.stdout.write(self.style.SUCCESS(
+                f'Top-{options["k"]} retrieval: p50 {statistics.median(samples) * 1000:.2f}ms, '
+                f'p95 {samples[int(len(samples) * 0.95) - 1] * 1000:.2f}ms'
+            ))
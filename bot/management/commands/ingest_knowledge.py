@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from bot.ingestion import ingest_entry
+from bot.models import BotKnowledgeBase
+
+class Command(BaseCommand):
+    help = 'Index knowledge base entries left pending, e.g. after a restart interrupted the background worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help='Also retry entries whose indexing failed')
+        parser.add_argument('--all', action='store_true', help='Re-index every entry')
+
+    def handle(self, *args, **options):
+        entries = BotKnowledgeBase.objects.all()
+        if not options['all']:
+            statuses = ['pending', 'indexing'] + (['failed'] if options['failed'] else [])
+            entries = entries.filter(index_status__in=statuses)
+
+        counts = {}
+        for entry_id, title in entries.order_by('pk').values_list('pk', 'title'):
+            started = time.perf_counter()
+
+            def progress(percent):
+                self.stdout.write(f'  {title}: {percent}%')
+
+            status = ingest_entry(entry_id, progress)
+            counts[status] = counts.get(status, 0) + 1
+            self.stdout.write(f'{title}: {status} in {time.perf_counter() - started:.2f}s')
+
+        summary = ', '.join(f'{count} {status}' for status, count in counts.items()) or 'nothing to do'
+        self.stdout.write(self.style.SUCCESS(f'Knowledge ingestion finished: {summary}'))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from bot.knowledge import rebuild_bot_index
+from bot.models import Bot
+
+class Command(BaseCommand):
+    help = 'Rebuild the retrieval index over bot knowledge bases from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bot', type=int, action='append', dest='bots', help='Bot id to rebuild (repeatable); defaults to all bots')
+
+    def handle(self, *args, **options):
+        bots = Bot.objects.all()
+        if options['bots']:
+            bots = bots.filter(pk__in=options['bots'])
+            if not bots.exists():
+                raise CommandError('No bots match the given ids.')
+
+        for bot in bots.order_by('pk'):
+            started = time.perf_counter()
+            rebuild_bot_index(bot)
+            self.stdout.write(f'{bot.name}: indexed in {time.perf_counter() - started:.2f}s')
+        self.stdout.write(self.style.SUCCESS('Knowledge indexes rebuilt'))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_botconversation_summary_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='botknowledgebase',
+            name='index_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='botknowledgebase',
+            name='index_progress',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Percent of the upload indexed'),
+        ),
+        migrations.AddField(
+            model_name='botknowledgebase',
+            name='index_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('indexing', 'Indexing'), ('indexed', 'Indexed'), ('failed', 'Failed'), ('removed', 'Not Indexed (Inactive)')], default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='botknowledgebase',
+            name='indexed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -42,6 +42,8 @@ class BotConversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200, blank=True)
     is_active = models.BooleanField(default=True)
+    summary = models.TextField(blank=True, help_text="Rolling summary of archived messages")
+    summary_through = models.BigIntegerField(null=True, blank=True, help_text="Id of the last message covered by the summary")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -75,13 +77,50 @@ class BotMessage(models.Model):
         verbose_name_plural = "Bot Messages"
         ordering = ['timestamp']
 
+class BotMessageArchive(models.Model):
+    """
+    Compressed batch of bot messages moved out of the hot table by compaction.
+    """
+    conversation = models.ForeignKey(BotConversation, on_delete=models.CASCADE, related_name='archives')
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.IntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    data = models.BinaryField(help_text="zlib-compressed JSON list of the archived messages")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.message_count} archived messages in {self.conversation}"
+
+    def get_messages(self):
+        from chat.compaction import decompress_messages
+        return decompress_messages(self.data)
+
+    class Meta:
+        verbose_name = "Bot Message Archive"
+        verbose_name_plural = "Bot Message Archives"
+        ordering = ['first_message_id']
+
 class BotKnowledgeBase(models.Model):
+    INDEX_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('indexing', 'Indexing'),
+        ('indexed', 'Indexed'),
+        ('failed', 'Failed'),
+        ('removed', 'Not Indexed (Inactive)'),
+    ]
+
     bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name='knowledge_base')
     title = models.CharField(max_length=200)
     content = models.TextField()
     source_url = models.URLField(blank=True)
     file_upload = models.FileField(upload_to='bot_knowledge/', null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    index_status = models.CharField(max_length=20, choices=INDEX_STATUS_CHOICES, default='pending')
+    index_progress = models.PositiveSmallIntegerField(default=0, help_text="Percent of the upload indexed")
+    index_error = models.TextField(blank=True)
+    indexed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -0,0 +1,30 @@
+"""
+Signal handlers keeping each bot's knowledge index in step with its knowledge base.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .ingestion import get_ingestion_worker
+from .knowledge import KnowledgeIndex
+from .models import Bot, BotKnowledgeBase
+
+
+@receiver(post_save, sender=BotKnowledgeBase)
+def knowledge_entry_saved(sender, instance, **kwargs):
+    # Indexing large uploads takes a while; queue it so the save returns at once
+    BotKnowledgeBase.objects.filter(pk=instance.pk).update(index_status='pending', index_progress=0, index_error='')
+    entry_id = instance.pk
+    transaction.on_commit(lambda: get_ingestion_worker().submit(entry_id))
+
+
+@receiver(post_delete, sender=BotKnowledgeBase)
+def knowledge_entry_deleted(sender, instance, **kwargs):
+    bot_id, entry_id = instance.bot_id, instance.pk
+    transaction.on_commit(lambda: KnowledgeIndex(bot_id).remove_entry(entry_id))
+
+
+@receiver(post_delete, sender=Bot)
+def bot_deleted(sender, instance, **kwargs):
+    bot_id = instance.pk
+    transaction.on_commit(lambda: KnowledgeIndex(bot_id).delete())
@@ -1,3 +1,180 @@
-from django.test import TestCase
+import bisect
+import io
+import math
+import os
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import include, path
+from accounts.models import UserProfile
+from aivi.models import AIModel, AIRequest
+from .extraction import stream_text_segments
+from .knowledge import BM25_B, BM25_K1, KnowledgeIndex, chunk_text, get_config, tokenize
+from .models import Bot
 
-# Create your tests here.
+urlpatterns = [path('bot/', include('bot.urls'))]
+
+
+class StreamTextSegmentsTests(SimpleTestCase):
+
+    def test_words_are_not_split_across_reads(self):
+        text = 'photosynthesis converts light into chemical energy in chloroplasts'
+        segments = list(stream_text_segments(io.BytesIO(text.encode()), read_size=7))
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(' '.join(segments), text)
+        self.assertEqual(' '.join(segments).split(), text.split())
+
+    def test_characters_split_between_reads_decode(self):
+        text = 'café naïve 日本語 emoji 🙂 done'
+        encoded = text.encode()
+        # Every read size cuts some multi-byte character in the middle
+        for read_size in range(1, 8):
+            segments = list(stream_text_segments(io.BytesIO(encoded), read_size=read_size))
+            self.assertEqual(' '.join(segments), text)
+            self.assertNotIn('\ufffd', ''.join(segments))
+
+    def test_progress_reports_every_byte(self):
+        encoded = 'one two three four five'.encode()
+        progress = mock.Mock()
+        list(stream_text_segments(io.BytesIO(encoded), read_size=5, progress=progress))
+        self.assertEqual(progress.call_count, math.ceil(len(encoded) / 5))
+        self.assertEqual(sum(call.args[0] for call in progress.call_args_list), len(encoded))
+
+
+class KnowledgeIndexTests(SimpleTestCase):
+
+    def make_index(self, **config):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        index = KnowledgeIndex(1, {**get_config(), 'directory': directory, **config})
+        self.addCleanup(index.delete)
+        return index
+
+    def segment_files(self, index):
+        return {os.path.splitext(filename)[0] for filename in os.listdir(index.directory) if filename.endswith('.json') and filename != 'manifest.json'}
+
+    def test_chunks_overlap_and_keep_the_tail(self):
+        words = [str(number) for number in range(1, 11)]
+        # Segments may end anywhere between words
+        segments = [' '.join(words[:3]), ' '.join(words[3:8]), ' '.join(words[8:])]
+        self.assertEqual(list(chunk_text(segments, chunk_words=4, overlap=1)), ['1 2 3 4', '4 5 6 7', '7 8 9 10'])
+        self.assertEqual(list(chunk_text([' '.join(words[:7])], chunk_words=4, overlap=1)), ['1 2 3 4', '4 5 6 7'])
+        self.assertEqual(list(chunk_text(['1 2'], chunk_words=4, overlap=1)), ['1 2'])
+
+    def test_top_k_matches_an_exhaustive_scan(self):
+        index = self.make_index(max_segments=100)
+        generator = random.Random(7)
+        vocabulary = [f'word{number}' for number in range(60)]
+        # Zipf-like word frequencies, so common and rare terms both occur
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+        documents = {}
+        for entry_id in range(1, 121):
+            documents[entry_id] = ' '.join(generator.choices(vocabulary, weights, k=generator.randint(5, 40)))
+        # A few entries per segment, so the search spans many segments
+        for start in range(1, 121, 10):
+            for entry_id in range(start, start + 10):
+                index.index_entry(entry_id, [documents[entry_id]])
+
+        tokens = {entry_id: tokenize(text) for entry_id, text in documents.items()}
+        average_length = sum(map(len, tokens.values())) / len(tokens)
+
+        def exhaustive(query):
+            terms = set(tokenize(query))
+            scores = {}
+            for entry_id, words in tokens.items():
+                score = 0.0
+                for term in terms:
+                    frequency = sum(term in other for other in tokens.values())
+                    count = words.count(term)
+                    if count:
+                        idf = math.log(1 + (len(tokens) - frequency + 0.5) / (frequency + 0.5))
+                        score += idf * count * (BM25_K1 + 1) / (
+                            count + BM25_K1 * (1 - BM25_B + BM25_B * len(words) / average_length))
+                if score:
+                    scores[entry_id] = score
+            return scores
+
+        pruned = mock.Mock(wraps=bisect.bisect_left)
+        for query in ['word0 word1', 'word0 word45 word59', 'word3 word7 word20 word33', 'word58']:
+            expected = exhaustive(query)
+            with mock.patch('bot.knowledge.bisect.bisect_left', pruned):
+                results = index.search(query, k=5)
+            self.assertEqual(
+                [round(result.score, 9) for result in results],
+                [round(score, 9) for score in sorted(expected.values(), reverse=True)[:5]]
+            )
+            for result in results:
+                self.assertAlmostEqual(result.score, expected[result.entry_id])
+                self.assertEqual(result.text, documents[result.entry_id])
+        # Candidates were looked up in skipped posting lists rather than scanned
+        self.assertTrue(pruned.called)
+
+    def test_reindexed_and_removed_entries_drop_out(self):
+        index = self.make_index()
+        index.index_entry(1, ['Volcanoes erupt molten rock'])
+        index.index_entry(2, ['Glaciers carve valleys'])
+        index.index_entry(1, ['Rivers carry sediment'])
+        self.assertEqual(index.search('volcanoes molten'), [])
+        self.assertEqual([result.entry_id for result in index.search('rivers')], [1])
+
+        index.remove_entry(2)
+        self.assertEqual(index.search('glaciers valleys'), [])
+        # Segments without live entries are deleted
+        self.assertEqual(self.segment_files(index), set(index._read_manifest()['segments']))
+
+    def test_results_survive_a_segment_merge(self):
+        index = self.make_index(max_segments=2)
+        texts = {1: 'Volcanoes erupt molten rock', 2: 'Glaciers carve valleys', 3: 'Deserts get little rain'}
+        for entry_id, text in texts.items():
+            index.index_entry(entry_id, [text])
+        index.index_entry(2, ['Oceans cover most of the planet'])
+
+        manifest = index._read_manifest()
+        self.assertLessEqual(len(manifest['segments']), 2)
+        self.assertEqual(self.segment_files(index), set(manifest['segments']))
+        self.assertEqual([result.entry_id for result in index.search('molten rock')], [1])
+        self.assertEqual([result.entry_id for result in index.search('little rain')], [3])
+        self.assertEqual([result.text for result in index.search('oceans planet')], ['Oceans cover most of the planet'])
+        self.assertEqual(index.search('glaciers valleys'), [])
+
+
+@override_settings(ROOT_URLCONF='bot.tests')
+class BotReplyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('asker', password='pw')
+        UserProfile.objects.update_or_create(user=self.user, defaults={'onboarding_completed': True})
+        AIModel.objects.create(
+            name='Bot model', model_type='text', provider='local', model_id='bot-reply-test', cost_per_token=Decimal('0.001')
+        )
+        self.bot = Bot.objects.create(
+            name='Helper', bot_type='assistant', system_prompt='Be brief.', model_name='bot-reply-test',
+            temperature=0, created_by=self.user
+        )
+        self.client.force_login(self.user)
+        # Usage is journaled to disk by the accumulator; not needed here
+        patcher = mock.patch('aivi.services.record_request')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ask(self, bot_id, message):
+        return self.client.post(f'/bot/{bot_id}/reply/', {'message': message}, secure=True)
+
+    def test_repeated_question_is_answered_from_the_cache(self):
+        first = self.ask(self.bot.pk, 'How do plants make food?')
+        self.assertEqual(first.status_code, 200)
+        self.assertGreater(first.json()['tokens_used'], 0)
+
+        second = self.ask(self.bot.pk, 'How do plants make food?')
+        self.assertEqual(second.json()['reply'], first.json()['reply'])
+        self.assertEqual(second.json()['tokens_used'], 0)
+        self.assertEqual(AIRequest.objects.filter(user=self.user).count(), 2)
+
+    def test_private_bots_of_other_users_are_not_found(self):
+        stranger = User.objects.create_user('stranger', password='pw')
+        private = Bot.objects.create(name='Private', bot_type='custom', status='active', created_by=stranger)
+        self.assertEqual(self.ask(private.pk, 'Hello?').status_code, 404)
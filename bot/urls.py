@@ -3,4 +3,5 @@ from .views import *
 
 urlpatterns = [
     path('my-bot', my_bot, name='my-bot'),
+    path('<int:bot_id>/reply/', bot_reply, name='bot-reply'),
 ]
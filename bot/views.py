@@ -1,5 +1,12 @@
+import math
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from aivi.quotas import QuotaExceeded
+from aivi.services import generate_bot_reply
+from .models import Bot
 
 # Create your views here.
 @login_required
@@ -9,4 +16,36 @@ def my_bot(request):
     context = {
         'page_name':page_name
     }
-    return render(request, 'chat/bot.html', context)
\ No newline at end of file
+    return render(request, 'chat/bot.html', context)
+
+
+@login_required
+@require_POST
+def bot_reply(request, bot_id):
+    """
+    Answer `message` with one of the user's own bots or an active public one.
+    Repeated and paraphrased questions are answered from the response caches.
+    Responds 429 when the user is over their token quota.
+    """
+    message = request.POST.get('message', '').strip()
+    if not message:
+        return JsonResponse({'error': 'Message is required.'}, status=400)
+    bot = Bot.objects.filter(Q(created_by=request.user) | Q(is_public=True, status='active'), pk=bot_id).first()
+    if bot is None:
+        return JsonResponse({'error': 'Bot not found.'}, status=404)
+
+    try:
+        ai_request = generate_bot_reply(request.user, bot, message)
+    except QuotaExceeded as e:
+        response = JsonResponse({'error': str(e)}, status=429)
+        response['Retry-After'] = str(math.ceil(e.retry_after))
+        return response
+    if ai_request is None:
+        return JsonResponse({'error': f'No active model is available for {bot.model_name}.'}, status=503)
+    if ai_request.status == 'failed':
+        return JsonResponse({'error': 'The model request failed.'}, status=502)
+    return JsonResponse({
+        'reply': ai_request.response,
+        'request_id': ai_request.pk,
+        'tokens_used': ai_request.tokens_used,
+    })
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import ChatSession, Message, ChatTemplate
+from .search import FullTextSearchAdminMixin
+from .models import ChatSession, Message, MessageArchive, ChatTemplate
 
 class MessageInline(admin.TabularInline):
     model = Message
@@ -12,12 +13,13 @@ class ChatSessionAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'title', 'is_active', 'created_at', 'updated_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['user__username', 'title']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['summary', 'summary_through', 'created_at', 'updated_at']
     inlines = [MessageInline]
     date_hierarchy = 'created_at'
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(FullTextSearchAdminMixin, admin.ModelAdmin):
+    search_kind = 'chat'
     list_display = ['id', 'session', 'message_type', 'content_preview', 'tokens_used', 'timestamp']
     list_filter = ['message_type', 'timestamp']
     search_fields = ['session__user__username', 'content']
@@ -33,3 +35,11 @@ class ChatTemplateAdmin(admin.ModelAdmin):
     list_filter = ['is_public', 'created_at']
     search_fields = ['name', 'description', 'created_by__username']
     readonly_fields = ['created_at', 'updated_at']
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'session', 'message_count', 'first_timestamp', 'last_timestamp', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['session__id']
+    readonly_fields = ['session', 'first_message_id', 'last_message_id', 'message_count', 'first_timestamp', 'last_timestamp', 'created_at']
+    exclude = ['data']
@@ -0,0 +1,57 @@
+"""
+Pluggable model backends for chat responses.
+
+A backend turns a conversation history into a stream of response tokens. The
+backend in use is chosen with settings.CHAT_BACKEND; FakeChatBackend stands in
+for a real provider during development and benchmarks.
+"""
+
+import asyncio
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class ChatBackend:
+    """
+    Base class for chat model backends.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    async def stream(self, messages, **kwargs):
+        """
+        Yield response tokens for `messages`, a list of {'role', 'content'} dicts
+        in chronological order. Each yielded string counts as one token.
+        """
+        raise NotImplementedError('Chat backends must implement stream()')
+        yield  # pragma: no cover
+
+
+class FakeChatBackend(ChatBackend):
+    """
+    Local stand-in that streams a canned reply word by word, with an optional
+    delay before the first token and between tokens to mimic a real model.
+    """
+
+    async def stream(self, messages, **kwargs):
+        first_token_delay = self.options.get('first_token_delay', 0)
+        token_delay = self.options.get('token_delay', 0)
+        last_user_message = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        reply = f"Here is some help with: {last_user_message}".split(' ')
+
+        if first_token_delay:
+            await asyncio.sleep(first_token_delay)
+        for index, word in enumerate(reply):
+            if token_delay and index:
+                await asyncio.sleep(token_delay)
+            yield word if index == 0 else ' ' + word
+
+
+def get_chat_backend():
+    """
+    Instantiate the backend configured in settings.CHAT_BACKEND.
+    """
+    config = getattr(settings, 'CHAT_BACKEND', {})
+    backend_class = import_string(config.get('BACKEND', 'chat.backends.FakeChatBackend'))
+    return backend_class(**config.get('OPTIONS', {}))
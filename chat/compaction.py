@@ -0,0 +1,136 @@
+"""
+Compaction of long conversations.
+
+Older messages of chat sessions, bot conversations and companion conversations
+are folded into a rolling summary stored on the conversation, and the raw rows
+are moved into a compressed archive table. Prompt assembly then only needs the
+summary plus the recent messages, and the hot message tables stay small.
+"""
+
+import json
+import zlib
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count
+from django.utils.module_loading import import_string
+
+
+class Compactable:
+    """
+    Describes one kind of conversation whose messages can be compacted.
+    """
+
+    def __init__(self, label, conversation_model, message_model, archive_model, parent_field):
+        self.label = label
+        self.conversation_model = conversation_model
+        self.message_model = message_model
+        self.archive_model = archive_model
+        self.parent_field = parent_field
+
+    @property
+    def conversations(self):
+        return apps.get_model(self.conversation_model)
+
+    @property
+    def messages(self):
+        return apps.get_model(self.message_model)
+
+    @property
+    def archives(self):
+        return apps.get_model(self.archive_model)
+
+
+COMPACTABLES = [
+    Compactable('chat', 'chat.ChatSession', 'chat.Message', 'chat.MessageArchive', 'session'),
+    Compactable('bot', 'bot.BotConversation', 'bot.BotMessage', 'bot.BotMessageArchive', 'conversation'),
+    Compactable('companion', 'companion.CompanionConversation', 'companion.CompanionMessage',
+                'companion.CompanionMessageArchive', 'conversation'),
+]
+
+
+def compress_messages(rows):
+    return zlib.compress(json.dumps(rows, cls=DjangoJSONEncoder).encode('utf-8'))
+
+
+def decompress_messages(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+def extractive_summary(previous_summary, messages, max_length=2000):
+    """
+    Model-free stand-in summarizer: keeps the first sentence of each message,
+    appended to the previous summary and trimmed to the most recent `max_length` characters.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        content = ' '.join(message['content'].split())
+        if not content:
+            continue
+        sentence = content.split('. ')[0][:200]
+        lines.append(f"{message['message_type']}: {sentence}")
+    summary = '\n'.join(lines)
+    if len(summary) > max_length:
+        summary = summary[-max_length:].split('\n', 1)[-1]
+    return summary
+
+
+def get_summarizer():
+    return import_string(getattr(settings, 'CONVERSATION_SUMMARIZER', 'chat.compaction.extractive_summary'))
+
+
+def compact_conversation(compactable, conversation, keep_recent, summarizer=None, chunk_size=1000):
+    """
+    Archive all but the `keep_recent` newest messages of `conversation` and fold
+    them into its rolling summary. Returns the number of messages archived.
+    """
+    summarizer = summarizer or get_summarizer()
+    message_model = compactable.messages
+    parent_filter = {compactable.parent_field: conversation}
+
+    recent_ids = list(
+        message_model.objects.filter(**parent_filter).order_by('-id').values_list('id', flat=True)[:keep_recent]
+    )
+    if len(recent_ids) < keep_recent:
+        return 0
+    cutoff_id = recent_ids[-1]
+
+    field_names = [field.attname for field in message_model._meta.concrete_fields]
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                message_model.objects.filter(**parent_filter, id__lt=cutoff_id)
+                .order_by('id').values(*field_names)[:chunk_size]
+            )
+            if not rows:
+                break
+
+            compactable.archives.objects.create(
+                **parent_filter,
+                first_message_id=rows[0]['id'],
+                last_message_id=rows[-1]['id'],
+                message_count=len(rows),
+                first_timestamp=rows[0]['timestamp'],
+                last_timestamp=rows[-1]['timestamp'],
+                data=compress_messages(rows)
+            )
+            conversation.summary = summarizer(conversation.summary, rows)
+            conversation.summary_through = rows[-1]['id']
+            compactable.conversations.objects.filter(pk=conversation.pk).update(
+                summary=conversation.summary,
+                summary_through=conversation.summary_through
+            )
+            message_model.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            archived += len(rows)
+    return archived
+
+
+def find_compactable(compactable, threshold):
+    """
+    Conversations with more than `threshold` messages still in the hot table.
+    """
+    return compactable.conversations.objects.annotate(
+        message_total=Count('messages')
+    ).filter(message_total__gt=threshold).order_by().only('pk', 'summary', 'summary_through')
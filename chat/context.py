@@ -0,0 +1,126 @@
+"""
+Context-window builder for chat sessions.
+
+Each session keeps an in-process prefix of (message id, cumulative tokens) so
+the most recent messages that fit a token budget are found with a binary
+search and then loaded with a single range query. The prefix is caught up
+with one small query per turn, so messages written by other processes are
+picked up without rebuilding it, and a long session costs the same per turn
+as a short one.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from django.conf import settings
+from .models import Message
+
+_prefixes = OrderedDict()
+_lock = threading.Lock()
+_MAX_SESSIONS = 5000
+
+
+def count_tokens(text):
+    """
+    Cheap token estimate (about four characters per token for English text).
+    """
+    return max(1, len(text) // 4) if text else 0
+
+
+class SessionTokenPrefix:
+    """
+    Message ids of a session in order, with the running token total after each.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.cumulative = []
+        self.lock = threading.Lock()
+
+    @property
+    def total(self):
+        return self.cumulative[-1] if self.cumulative else 0
+
+    def catch_up(self, session_id):
+        """
+        Append messages stored since the last call. Only ids and token counts
+        are read, except for messages without a stored count, which are counted here.
+        """
+        last_id = self.ids[-1] if self.ids else 0
+        rows = list(
+            Message.objects.filter(session_id=session_id, id__gt=last_id)
+            .order_by('id').values_list('id', 'tokens_used')
+        )
+        if not rows:
+            return
+
+        uncounted = [message_id for message_id, tokens in rows if not tokens]
+        if uncounted:
+            contents = dict(Message.objects.filter(id__in=uncounted).values_list('id', 'content'))
+            rows = [(message_id, tokens or count_tokens(contents.get(message_id, ''))) for message_id, tokens in rows]
+
+        total = self.total
+        for message_id, tokens in rows:
+            total += tokens
+            self.ids.append(message_id)
+            self.cumulative.append(total)
+
+    def window_start(self, budget):
+        """
+        Index of the oldest message such that it and everything after it fit in
+        `budget` tokens. Returns None when not even the latest message fits.
+        """
+        if not self.ids:
+            return None
+        threshold = self.total - budget
+        if threshold <= 0:
+            return 0
+        index = bisect_left(self.cumulative, threshold) + 1
+        return index if index < len(self.ids) else None
+
+
+def _get_prefix(session_id):
+    with _lock:
+        prefix = _prefixes.get(session_id)
+        if prefix is None:
+            prefix = _prefixes[session_id] = SessionTokenPrefix()
+        _prefixes.move_to_end(session_id)
+        while len(_prefixes) > _MAX_SESSIONS:
+            _prefixes.popitem(last=False)
+    return prefix
+
+
+def invalidate_session(session_id):
+    """
+    Forget the cached prefix of a session, e.g. after one of its messages is deleted.
+    """
+    with _lock:
+        _prefixes.pop(session_id, None)
+
+
+def build_context(session_id, budget=None):
+    """
+    Return the most recent messages of a session that fit within `budget` tokens
+    (default settings.CHAT_CONTEXT_TOKENS), as {'role', 'content'} dicts oldest first,
+    along with their total token count.
+    """
+    if budget is None:
+        budget = getattr(settings, 'CHAT_CONTEXT_TOKENS', 3000)
+
+    prefix = _get_prefix(session_id)
+    with prefix.lock:
+        prefix.catch_up(session_id)
+        start = prefix.window_start(budget)
+        if start is None:
+            return [], 0
+        start_id = prefix.ids[start]
+        end_id = prefix.ids[-1]
+        tokens = prefix.total - (prefix.cumulative[start - 1] if start else 0)
+
+    messages = [
+        {'role': message_type, 'content': content}
+        for message_type, content in Message.objects.filter(
+            session_id=session_id, id__gte=start_id, id__lte=end_id
+        ).order_by('id').values_list('message_type', 'content')
+    ]
+    return messages, tokens
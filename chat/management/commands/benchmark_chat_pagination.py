@@ -0,0 +1,59 @@
+import statistics
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chat.models import ChatSession, Message
+from chat.pagination import encode_cursor, keyset_page
+
+class Command(BaseCommand):
+    help = 'Compare keyset and offset pagination of a large chat session at increasing page depths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=50000, help='Messages in the benchmark session')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed fetches per page depth')
+
+    def handle(self, *args, **options):
+        total = options['messages']
+        page_size = options['page_size']
+        user, _ = User.objects.get_or_create(username='benchmark_pagination_user', defaults={'email': 'benchmark@example.com'})
+        session = ChatSession.objects.create(user=user, title='Pagination benchmark')
+        try:
+            self.stdout.write(f'Creating {total} messages...')
+            started = timezone.now() - timedelta(seconds=total)
+            Message.objects.bulk_create(
+                (Message(session=session, message_type='user' if i % 2 else 'assistant',
+                         content=f'Benchmark message {i}', timestamp=started + timedelta(seconds=i))
+                 for i in range(total)),
+                batch_size=2000
+            )
+
+            messages = Message.objects.filter(session=session)
+            newest_first = messages.order_by('-timestamp', '-id')
+            last_page = max(total // page_size - 1, 0)
+            for page in sorted({0, last_page // 10, last_page // 2, last_page}):
+                offset = page * page_size
+                if offset:
+                    boundary = newest_first[offset - 1]
+                    cursor = encode_cursor(boundary.timestamp, boundary.pk)
+                else:
+                    cursor = None
+
+                keyset = self._time(lambda: keyset_page(messages, 'timestamp', cursor=cursor, limit=page_size), options['repeat'])
+                by_offset = self._time(lambda: list(newest_first[offset:offset + page_size]), options['repeat'])
+                self.stdout.write(
+                    f'Page {page + 1}: keyset {keyset * 1000:.2f}ms, offset {by_offset * 1000:.2f}ms (median)'
+                )
+        finally:
+            session.delete()
+            user.delete()
+
+    def _time(self, fetch, repeat):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fetch()
+            samples.append(time.perf_counter() - started)
+        return statistics.median(samples)
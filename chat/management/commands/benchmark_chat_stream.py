@@ -0,0 +1,66 @@
+import asyncio
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from accounts.models import UserProfile
+from chat.models import ChatSession
+
+class Command(BaseCommand):
+    help = 'Measure time-to-first-byte and total time of the streaming chat endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Number of chat turns to time')
+        parser.add_argument('--first-token-delay', type=float, default=0.0,
+                            help='Simulated model latency before the first token, in seconds')
+        parser.add_argument('--token-delay', type=float, default=0.0,
+                            help='Simulated delay between tokens, in seconds')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='benchmark_chat_user', defaults={'email': 'benchmark@example.com'})
+        # A completed profile keeps ProfileCompletionMiddleware from redirecting
+        UserProfile.objects.update_or_create(user=user, defaults={'profile_completed': True, 'onboarding_completed': True})
+        backend = {
+            'BACKEND': 'chat.backends.FakeChatBackend',
+            'OPTIONS': {
+                'first_token_delay': options['first_token_delay'],
+                'token_delay': options['token_delay'],
+            },
+        }
+        try:
+            with override_settings(CHAT_BACKEND=backend, ALLOWED_HOSTS=['*']):
+                first_byte, first_token, total = asyncio.run(self._run(user, options['requests']))
+        finally:
+            ChatSession.objects.filter(user=user).delete()
+            user.delete()
+
+        for label, samples in [('Time to first byte', first_byte), ('Time to first token', first_token), ('Total', total)]:
+            self.stdout.write(
+                f'{label}: median {statistics.median(samples) * 1000:.1f}ms, '
+                f'max {max(samples) * 1000:.1f}ms over {len(samples)} requests'
+            )
+
+    async def _run(self, user, requests):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        first_byte, first_token, total = [], [], []
+        session_id = ''
+        for index in range(requests):
+            started = time.perf_counter()
+            response = await client.post('/chat/stream/', {'content': f'Explain photosynthesis, part {index}', 'session_id': session_id})
+            token_at = None
+            byte_at = None
+            async for chunk in response.streaming_content:
+                now = time.perf_counter()
+                if byte_at is None:
+                    byte_at = now
+                if token_at is None and chunk.startswith(b'event: token'):
+                    token_at = now
+                if chunk.startswith(b'event: session'):
+                    session_id = chunk.split(b'"session_id": ')[1].split(b'}')[0].decode()
+            finished = time.perf_counter()
+            first_byte.append(byte_at - started)
+            first_token.append(token_at - started)
+            total.append(finished - started)
+        return first_byte, first_token, total
@@ -0,0 +1,63 @@
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections
+from django.utils import timezone
+from chat.models import ChatSession, Message
+from chat.writebuffer import WriteBehindBuffer
+
+class Command(BaseCommand):
+    help = 'Compare per-row message writes with the write-behind buffer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=2000, help='Conversation turns to write in each mode')
+        parser.add_argument('--concurrency', type=int, default=16, help='Threads writing turns concurrently')
+
+    def handle(self, *args, **options):
+        turns = options['turns']
+        user, _ = User.objects.get_or_create(username='benchmark_writes_user', defaults={'email': 'benchmark@example.com'})
+        sessions = [ChatSession.objects.create(user=user, title=f'Write benchmark {i}') for i in range(options['concurrency'])]
+        try:
+            direct, failed = self._run(sessions, turns, options['concurrency'], self._direct_turn)
+            self.stdout.write(
+                f'Direct writes: {turns / direct:.0f} turns/sec ({turns * 2 / direct:.0f} messages/sec), '
+                f'{failed} turns failed with "database is locked"'
+            )
+
+            with tempfile.TemporaryDirectory() as journal_dir:
+                buffer = WriteBehindBuffer(journal_dir=journal_dir)
+                buffered, _ = self._run(sessions, turns, options['concurrency'], lambda session, i: self._buffered_turn(buffer, session, i))
+                buffer.close()
+            self.stdout.write(f'Buffered writes: {turns / buffered:.0f} turns/sec ({turns * 2 / buffered:.0f} messages/sec)')
+            self.stdout.write(self.style.SUCCESS(f'Speedup: {direct / buffered:.1f}x'))
+        finally:
+            ChatSession.objects.filter(user=user).delete()
+            user.delete()
+
+    def _run(self, sessions, turns, concurrency, write_turn):
+        def worker(index):
+            try:
+                write_turn(sessions[index % len(sessions)], index)
+                return True
+            except OperationalError:
+                return False
+            finally:
+                close_old_connections()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, range(turns)))
+        return time.perf_counter() - started, results.count(False)
+
+    def _direct_turn(self, session, index):
+        Message.objects.create(session=session, message_type='user', content=f'Question {index}')
+        Message.objects.create(session=session, message_type='assistant', content=f'Answer {index}')
+        ChatSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+
+    def _buffered_turn(self, buffer, session, index):
+        buffer.add_turn(session, [
+            Message(session=session, message_type='user', content=f'Question {index}'),
+            Message(session=session, message_type='assistant', content=f'Answer {index}'),
+        ]).result(timeout=30)
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from chat.compaction import COMPACTABLES, compact_conversation, find_compactable, get_summarizer
+
+class Command(BaseCommand):
+    help = 'Summarize and archive older messages of long chat, bot and companion conversations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=int, default=200,
+                            help='Compact conversations with more than this many messages')
+        parser.add_argument('--keep-recent', type=int, default=50,
+                            help='Number of newest messages to keep in the hot table')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Messages archived per transaction')
+        parser.add_argument('--only', choices=[compactable.label for compactable in COMPACTABLES],
+                            help='Only compact one kind of conversation')
+
+    def handle(self, *args, **options):
+        summarizer = get_summarizer()
+        started = time.perf_counter()
+        for compactable in COMPACTABLES:
+            if options['only'] and compactable.label != options['only']:
+                continue
+            conversations = 0
+            archived = 0
+            for conversation in find_compactable(compactable, options['threshold']).iterator():
+                archived += compact_conversation(
+                    compactable,
+                    conversation,
+                    keep_recent=options['keep_recent'],
+                    summarizer=summarizer,
+                    chunk_size=options['chunk_size']
+                )
+                conversations += 1
+            self.stdout.write(f'{compactable.label}: archived {archived} messages from {conversations} conversations')
+
+        self.stdout.write(self.style.SUCCESS(f'Compaction finished in {time.perf_counter() - started:.2f}s'))
@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from chat import search
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over chat, bot and companion messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Messages indexed per transaction')
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError('The full-text index is only maintained on SQLite; other databases search directly.')
+
+        self.stdout.write('Rebuilding message search index...')
+        started = time.perf_counter()
+
+        def progress(kind, indexed):
+            self.stdout.write(f'  {kind}: {indexed} messages indexed so far')
+
+        total = search.rebuild_index(chunk_size=options['chunk_size'], progress=progress)
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} messages in {elapsed:.2f}s ({rate:.0f} messages/sec)'))
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary',
+            field=models.TextField(blank=True, help_text='Rolling summary of archived messages'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary_through',
+            field=models.BigIntegerField(blank=True, help_text='Id of the last message covered by the summary', null=True),
+        ),
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('message_count', models.IntegerField()),
+                ('first_timestamp', models.DateTimeField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('data', models.BinaryField(help_text='zlib-compressed JSON list of the archived messages')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archives', to='chat.chatsession')),
+            ],
+            options={
+                'verbose_name': 'Chat Message Archive',
+                'verbose_name_plural': 'Chat Message Archives',
+                'ordering': ['first_message_id'],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+    "content, kind UNINDEXED, message_id UNINDEXED, conversation_id UNINDEXED, user_id UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+# rowid = message id * 3 + source code, matching chat.search
+POPULATE_SQL = [
+    "INSERT INTO message_search (rowid, content, kind, message_id, conversation_id, user_id) "
+    "SELECT m.id * 3 + 0, m.content, 'chat', m.id, m.session_id, s.user_id "
+    "FROM chat_message m JOIN chat_chatsession s ON s.id = m.session_id",
+    "INSERT INTO message_search (rowid, content, kind, message_id, conversation_id, user_id) "
+    "SELECT m.id * 3 + 1, m.content, 'bot', m.id, m.conversation_id, c.user_id "
+    "FROM bot_botmessage m JOIN bot_botconversation c ON c.id = m.conversation_id",
+    "INSERT INTO message_search (rowid, content, kind, message_id, conversation_id, user_id) "
+    "SELECT m.id * 3 + 2, m.content, 'companion', m.id, m.conversation_id, p.user_id "
+    "FROM companion_companionmessage m "
+    "JOIN companion_companionconversation c ON c.id = m.conversation_id "
+    "JOIN companion_companion p ON p.id = c.companion_id",
+]
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    for sql in POPULATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS message_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatsession_chat_chatse_user_id_e48a2d_idx_and_more'),
+        ('bot', '0002_botconversation_summary_and_more'),
+        ('companion', '0003_companionconversation_summary_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
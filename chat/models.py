@@ -6,6 +6,8 @@ class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200, blank=True)
     is_active = models.BooleanField(default=True)
+    summary = models.TextField(blank=True, help_text="Rolling summary of archived messages")
+    summary_through = models.BigIntegerField(null=True, blank=True, help_text="Id of the last message covered by the summary")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -16,6 +18,9 @@ class ChatSession(models.Model):
         verbose_name = "Chat Session"
         verbose_name_plural = "Chat Sessions"
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', '-updated_at', '-id']),
+        ]
 
 class Message(models.Model):
     MESSAGE_TYPES = [
@@ -38,6 +43,34 @@ class Message(models.Model):
         verbose_name = "Message"
         verbose_name_plural = "Messages"
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['session', 'timestamp', 'id']),
+        ]
+
+class MessageArchive(models.Model):
+    """
+    Compressed batch of chat messages moved out of the hot table by compaction.
+    """
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='archives')
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.IntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    data = models.BinaryField(help_text="zlib-compressed JSON list of the archived messages")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.message_count} archived messages in {self.session}"
+
+    def get_messages(self):
+        from .compaction import decompress_messages
+        return decompress_messages(self.data)
+
+    class Meta:
+        verbose_name = "Chat Message Archive"
+        verbose_name_plural = "Chat Message Archives"
+        ordering = ['first_message_id']
 
 class ChatTemplate(models.Model):
     name = models.CharField(max_length=100)
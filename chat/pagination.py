@@ -0,0 +1,53 @@
+"""
+Keyset (cursor) pagination for chat history.
+
+Pages are addressed by the (timestamp, id) of the last row already seen rather
+than by an offset, so with a composite index on those columns every page is a
+bounded index range scan no matter how deep into the history it is.
+"""
+
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    raw = f"{timestamp.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor('Invalid cursor.') from e
+
+
+def keyset_page(queryset, timestamp_field, cursor=None, limit=50):
+    """
+    Return (rows, next_cursor) for one page of `queryset`, newest first by
+    (`timestamp_field`, id). `next_cursor` is None on the last page.
+    """
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        # Equivalent to (timestamp, id) < cursor; the leading range condition on
+        # the timestamp lets the database seek into the index instead of scanning
+        queryset = queryset.filter(
+            Q(**{f'{timestamp_field}__lt': timestamp}) | Q(id__lt=pk),
+            **{f'{timestamp_field}__lte': timestamp}
+        )
+
+    # Fetch one extra row to learn whether another page follows
+    rows = list(queryset.order_by(f'-{timestamp_field}', '-id')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_field), last.pk)
+    return rows, next_cursor
@@ -0,0 +1,234 @@
+"""
+Full-text search over chat, bot and companion messages.
+
+On SQLite the messages are mirrored into an FTS5 table, `message_search`,
+kept in sync by signals (see chat/signals.py) and queried with bm25 ranking.
+Each row's rowid encodes the source table and message id, so updates and
+deletes are primary-key operations. Other databases fall back to a plain
+case-insensitive scan.
+"""
+
+import re
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import escape
+
+SEARCH_TABLE = 'message_search'
+
+# Source tables: kind -> (model label, path from the message to its conversation, path to the owning user)
+SOURCES = {
+    'chat': ('chat.Message', 'session_id', 'session__user_id'),
+    'bot': ('bot.BotMessage', 'conversation_id', 'conversation__user_id'),
+    'companion': ('companion.CompanionMessage', 'conversation_id', 'conversation__companion__user_id'),
+}
+KIND_CODES = {'chat': 0, 'bot': 1, 'companion': 2}
+KINDS_BY_CODE = {code: kind for kind, code in KIND_CODES.items()}
+_KIND_COUNT = len(KIND_CODES)
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "content, kind UNINDEXED, message_id UNINDEXED, conversation_id UNINDEXED, user_id UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_TABLE_SQL = f"DROP TABLE IF EXISTS {SEARCH_TABLE}"
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def _rowid(kind, message_id):
+    return message_id * _KIND_COUNT + KIND_CODES[kind]
+
+
+def _source_model(kind):
+    return apps.get_model(SOURCES[kind][0])
+
+
+def _to_match_query(text):
+    """
+    Turn free text into an FTS5 query matching all words, so user input can
+    never be parsed as FTS5 syntax.
+    """
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def index_rows(kind, rows):
+    """
+    Add or replace index entries. `rows` are (message_id, content, conversation_id, user_id) tuples.
+    """
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, content, kind, message_id, conversation_id, user_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [(_rowid(kind, message_id), content, kind, message_id, conversation_id, user_id)
+             for message_id, content, conversation_id, user_id in rows]
+        )
+
+
+def index_message(kind, message):
+    """
+    Index a single saved message.
+    """
+    _, conversation_field, user_path = SOURCES[kind]
+    user_id = _cached_owner_id(message, user_path)
+    if user_id is None:
+        user_id = _source_model(kind).objects.filter(pk=message.pk).values_list(user_path, flat=True).first()
+    index_rows(kind, [(message.pk, message.content, getattr(message, conversation_field), user_id)])
+
+
+def kind_for_model(model):
+    """
+    The SOURCES kind for a message model class, or None if it is not indexed.
+    """
+    label = model._meta.label
+    return next((kind for kind, (source_label, _, _) in SOURCES.items() if source_label == label), None)
+
+
+def index_messages(kind, message_ids):
+    """
+    Index messages by id with one query, e.g. after a bulk_create that sent no signals.
+    """
+    if not is_supported() or not message_ids:
+        return
+    _, conversation_field, user_path = SOURCES[kind]
+    index_rows(kind, _source_model(kind).objects.filter(id__in=message_ids).values_list(
+        'id', 'content', conversation_field, user_path
+    ))
+
+
+def _cached_owner_id(message, user_path):
+    """
+    Follow `user_path` through relations already loaded on the message, if possible.
+    """
+    obj = message
+    *relations, attname = user_path.split('__')
+    for relation in relations:
+        if not obj._meta.get_field(relation).is_cached(obj):
+            return None
+        obj = getattr(obj, relation)
+    return getattr(obj, attname)
+
+
+def unindex_message(kind, message_id):
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [_rowid(kind, message_id)])
+
+
+def _highlight(snippet):
+    """
+    HTML-escape a snippet, then turn the match markers into <mark> tags.
+    """
+    return escape(snippet).replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+
+def search(text, user_id=None, kinds=None, limit=50):
+    """
+    Ranked search. Returns dicts with kind, message_id, conversation_id,
+    a highlighted snippet and the bm25 score (lower is better).
+    """
+    kinds = kinds or list(SOURCES)
+    if not text.strip():
+        return []
+
+    if not is_supported():
+        return _fallback_search(text, user_id, kinds, limit)
+
+    query = _to_match_query(text)
+    if not query:
+        return []
+
+    sql = (
+        f"SELECT kind, message_id, conversation_id, "
+        f"snippet({SEARCH_TABLE}, 0, char(2), char(3), '...', 16), bm25({SEARCH_TABLE}) "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+    )
+    params = [query]
+    if user_id is not None:
+        sql += " AND user_id = %s"
+        params.append(user_id)
+    if len(kinds) < len(SOURCES):
+        sql += f" AND kind IN ({', '.join(['%s'] * len(kinds))})"
+        params.extend(kinds)
+    sql += " ORDER BY rank LIMIT %s"
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [
+            {'kind': kind, 'message_id': message_id, 'conversation_id': conversation_id,
+             'snippet': _highlight(snippet), 'score': score}
+            for kind, message_id, conversation_id, snippet, score in cursor.fetchall()
+        ]
+
+
+def _fallback_search(text, user_id, kinds, limit):
+    results = []
+    for kind in kinds:
+        _, conversation_field, user_path = SOURCES[kind]
+        messages = _source_model(kind).objects.filter(content__icontains=text)
+        if user_id is not None:
+            messages = messages.filter(**{user_path: user_id})
+        for message_id, conversation_id, content in messages.order_by('-id').values_list('id', conversation_field, 'content')[:limit]:
+            results.append({'kind': kind, 'message_id': message_id, 'conversation_id': conversation_id,
+                            'snippet': escape(content[:200]), 'score': 0.0})
+    return results[:limit]
+
+
+def rebuild_index(chunk_size=2000, progress=None):
+    """
+    Re-create the index from the message tables, streaming each table in id
+    order one chunk per transaction. Calls progress(kind, indexed_so_far) after each chunk.
+    """
+    if not is_supported():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(DROP_TABLE_SQL)
+        cursor.execute(CREATE_TABLE_SQL)
+
+    total = 0
+    for kind, (_, conversation_field, user_path) in SOURCES.items():
+        model = _source_model(kind)
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'content', conversation_field, user_path)[:chunk_size]
+            )
+            if not rows:
+                break
+            with transaction.atomic():
+                index_rows(kind, rows)
+            last_id = rows[-1][0]
+            total += len(rows)
+            if progress:
+                progress(kind, total)
+    return total
+
+
+class FullTextSearchAdminMixin:
+    """
+    ModelAdmin mixin that answers content searches from the full-text index
+    instead of a LIKE scan. `search_kind` names the source in SOURCES; the
+    regular search_fields still apply to the other columns.
+    """
+    search_kind = None
+    search_result_limit = 1000
+
+    def get_search_results(self, request, queryset, search_term):
+        matched, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if not search_term.strip():
+            return matched, may_have_duplicates
+        hits = search(search_term, kinds=[self.search_kind], limit=self.search_result_limit)
+        message_ids = [hit['message_id'] for hit in hits]
+        return queryset.filter(Q(pk__in=message_ids) | Q(pk__in=matched.values('pk'))), may_have_duplicates
+
+    def get_search_fields(self, request):
+        # Content is searched through the index, not with LIKE
+        return [field for field in super().get_search_fields(request) if field != 'content']
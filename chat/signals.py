@@ -0,0 +1,43 @@
+"""
+Signal handlers keeping chat caches and the message search index consistent with the database.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from bot.models import BotMessage
+from companion.models import CompanionMessage
+from . import search
+from .context import invalidate_session
+from .models import Message
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    # Appends are picked up by the prefix itself; removals need a rebuild
+    invalidate_session(instance.session_id)
+    search.unindex_message('chat', instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, **kwargs):
+    search.index_message('chat', instance)
+
+
+@receiver(post_save, sender=BotMessage)
+def bot_message_saved(sender, instance, **kwargs):
+    search.index_message('bot', instance)
+
+
+@receiver(post_delete, sender=BotMessage)
+def bot_message_deleted(sender, instance, **kwargs):
+    search.unindex_message('bot', instance.pk)
+
+
+@receiver(post_save, sender=CompanionMessage)
+def companion_message_saved(sender, instance, **kwargs):
+    search.index_message('companion', instance)
+
+
+@receiver(post_delete, sender=CompanionMessage)
+def companion_message_deleted(sender, instance, **kwargs):
+    search.unindex_message('companion', instance.pk)
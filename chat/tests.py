@@ -1,3 +1,358 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import os
+import shutil
+import tempfile
+from django.contrib.auth.models import User
+from django.db import connection
+from concurrent.futures import Future
+from unittest import mock
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from accounts.models import UserProfile
+from . import search
+from .backends import FakeChatBackend
+from .compaction import COMPACTABLES, compact_conversation
+from .context import build_context, invalidate_session
+from .models import ChatSession, Message
+from .pagination import keyset_page
+from .writebuffer import DEAD_LETTER, WriteBehindBuffer
 
-# Create your tests here.
+# The project only routes to the apps with DEBUG on
+urlpatterns = [path('chat/', include('chat.urls'))]
+
+
+class WriteBehindBufferTests(TransactionTestCase):
+    # Transactional, because SQLite only checks foreign keys when the buffer's transaction commits
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.journal_dir)
+        self.user = User.objects.create_user('buffer', password='pw')
+        self.session = ChatSession.objects.create(user=self.user, title='kept')
+
+    def make_buffer(self, **options):
+        options = {'max_batch': 500, 'max_latency': 60, 'journal_dir': self.journal_dir, **options}
+        buffer = WriteBehindBuffer(**options)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def turn(self, session_id, content):
+        return [Message(session_id=session_id, sender=self.user, message_type='user', content=content)]
+
+    def deleted_session_id(self):
+        session = ChatSession.objects.create(user=self.user, title='deleted')
+        session_id = session.pk
+        session.delete()
+        return session_id
+
+    def dead_letters(self):
+        path = os.path.join(self.journal_dir, DEAD_LETTER)
+        if not os.path.exists(path):
+            return []
+        with open(path, encoding='utf-8') as dead_letter:
+            return [json.loads(line) for line in dead_letter]
+
+    def test_flush_writes_turns_and_resolves_futures(self):
+        buffer = self.make_buffer()
+        first = buffer.add_turn(self.session, self.turn(self.session.pk, 'one'))
+        second = buffer.add_turn(self.session, self.turn(self.session.pk, 'two'))
+        buffer.flush()
+        self.assertEqual([m.content for m in first.result(0) + second.result(0)], ['one', 'two'])
+        self.assertTrue(all(m.pk for m in first.result(0)))
+        self.assertEqual(Message.objects.filter(session=self.session).count(), 2)
+        self.assertEqual(os.path.getsize(buffer._journal.name), 0)
+
+    def test_failing_turn_is_dead_lettered_without_blocking_others(self):
+        buffer = self.make_buffer()
+        bad = buffer.add_turn(self.session, self.turn(self.deleted_session_id(), 'orphan'))
+        good = buffer.add_turn(self.session, self.turn(self.session.pk, 'kept'))
+        with self.assertLogs('chat.writebuffer', 'ERROR'):
+            buffer.flush()
+        self.assertEqual(good.result(0)[0].content, 'kept')
+        self.assertIsNotNone(bad.exception(0))
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['kept'])
+        [dead] = self.dead_letters()
+        self.assertEqual(dead['messages'][0]['fields']['content'], 'orphan')
+        self.assertEqual(os.path.getsize(buffer._journal.name), 0)
+
+    def test_background_flush_resolves_every_future(self):
+        buffer = self.make_buffer(max_latency=0.01)
+        with self.assertLogs('chat.writebuffer', 'ERROR'):
+            bad = buffer.add_turn(self.session, self.turn(self.deleted_session_id(), 'orphan'))
+            good = buffer.add_turn(self.session, self.turn(self.session.pk, 'kept'))
+            self.assertIsNotNone(bad.exception(5))
+        self.assertEqual(good.result(5)[0].content, 'kept')
+
+    def crash(self, buffer):
+        """
+        Stop `buffer` as if its process died: nothing flushed, journal left behind.
+        """
+        with buffer._condition:
+            buffer._closed = True
+            buffer._condition.notify()
+        buffer._thread.join()
+        buffer._journal.close()
+        return buffer._journal.name
+
+    def test_orphaned_journal_is_adopted_without_queries(self):
+        crashed = WriteBehindBuffer(max_latency=60, journal_dir=self.journal_dir)
+        crashed.add_turn(self.session, self.turn(self.session.pk, 'replayed'))
+        crashed.add_turn(self.session, self.turn(self.deleted_session_id(), 'orphan'))
+        path = self.crash(crashed)
+        with open(path, 'a', encoding='utf-8') as journal:
+            journal.write('{not json\n')
+
+        with self.assertLogs('chat.writebuffer', 'ERROR'):
+            with CaptureQueriesContext(connection) as queries:
+                buffer = self.make_buffer()
+            self.assertEqual(len(queries), 0)
+            self.assertFalse(os.path.exists(path))
+            buffer.flush()
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['replayed'])
+        dead = self.dead_letters()
+        self.assertEqual(len(dead), 2)
+        self.assertEqual(dead[0]['line'], '{not json')
+        self.assertEqual(dead[1]['messages'][0]['fields']['content'], 'orphan')
+        self.assertEqual(os.path.getsize(buffer._journal.name), 0)
+
+
+class FailingBackend(FakeChatBackend):
+
+    async def stream(self, messages, **kwargs):
+        yield 'Half'
+        yield ' an'
+        raise ConnectionError('Model server went away')
+
+
+@override_settings(ROOT_URLCONF='chat.tests', CHAT_SAVE_TIMEOUT=0.1, CHAT_BACKEND={'BACKEND': 'chat.backends.FakeChatBackend', 'OPTIONS': {'first_token_delay': 0, 'token_delay': 0}})
+class StreamMessageTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('streamer', password='pw')
+        UserProfile.objects.update_or_create(user=self.user, defaults={'onboarding_completed': True})
+
+    async def test_unsaved_turn_ends_the_stream_with_an_error(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        buffer = mock.Mock()
+        buffer.add_turn.return_value = Future()  # Never resolved
+        with mock.patch('chat.views.get_message_buffer', return_value=buffer):
+            response = await client.post('/chat/stream/', {'content': 'hello'}, secure=True)
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn('event: token', body)
+        self.assertTrue(body.rstrip().split('\n\n')[-1].startswith('event: error'))
+
+    async def test_backend_failure_ends_the_stream_with_an_error_and_keeps_the_turn(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        turns = []
+
+        def add_turn(session, messages):
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()  # Called from a worker thread, not the event loop
+            turns.append(messages)
+            saved = Future()
+            saved.set_result(messages)
+            return saved
+
+        buffer = mock.Mock()
+        buffer.add_turn.side_effect = add_turn
+        with mock.patch('chat.views.get_message_buffer', return_value=buffer), \
+                mock.patch('chat.views.get_chat_backend', return_value=FailingBackend()), \
+                self.assertLogs('chat.views', 'ERROR'):
+            response = await client.post('/chat/stream/', {'content': 'hello'}, secure=True)
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        events = body.rstrip().split('\n\n')
+        self.assertEqual([event.split('\n')[0] for event in events], [
+            'event: session', 'event: token', 'event: token', 'event: error'
+        ])
+        [turn] = turns
+        self.assertEqual([(message.message_type, message.content) for message in turn], [
+            ('user', 'hello'), ('assistant', 'Half an')
+        ])
+
+
+class MessageSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('searcher', password='pw')
+        self.other = User.objects.create_user('neighbour', password='pw')
+        self.session = ChatSession.objects.create(user=self.user)
+        self.other_session = ChatSession.objects.create(user=self.other)
+
+    def found(self, text, user=None):
+        return [hit['message_id'] for hit in search.search(text, user_id=(user or self.user).pk)]
+
+    def test_index_follows_creates_updates_and_deletes(self):
+        message = Message.objects.create(session=self.session, message_type='user', content='How does photosynthesis work?')
+        self.assertEqual(self.found('photosynthesis'), [message.pk])
+
+        message.content = 'Why do volcanoes erupt?'
+        message.save()
+        self.assertEqual(self.found('photosynthesis'), [])
+        self.assertEqual(self.found('volcanoes'), [message.pk])
+
+        message_id = message.pk
+        message.delete()
+        self.assertNotIn(message_id, self.found('volcanoes'))
+
+    def test_results_are_scoped_to_the_user(self):
+        mine = Message.objects.create(session=self.session, message_type='user', content='my glacier notes')
+        theirs = Message.objects.create(session=self.other_session, message_type='user', content='their glacier notes')
+        self.assertEqual(self.found('glacier'), [mine.pk])
+        self.assertEqual(self.found('glacier', self.other), [theirs.pk])
+
+    def test_fts_syntax_in_the_input_is_matched_literally(self):
+        self.assertEqual(search._to_match_query('foo" OR bar*'), '"foo" "OR" "bar"')
+        self.assertEqual(search._to_match_query('"*-^():'), '')
+        message = Message.objects.create(session=self.session, message_type='user', content='foo or bar')
+        for text in ['foo" OR bar*', 'NEAR(foo bar)', '-foo', 'content:foo', '"unbalanced', '*']:
+            self.assertIn(self.found(text), ([message.pk], []), text)
+        self.assertEqual(self.found('foo" OR bar*'), [message.pk])
+
+    def test_rebuild_restores_a_lost_index(self):
+        first = Message.objects.create(session=self.session, message_type='user', content='rivers carry sediment')
+        second = Message.objects.create(session=self.other_session, message_type='user', content='rivers flood')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.SEARCH_TABLE}')
+        self.assertEqual(self.found('rivers'), [])
+
+        progress = mock.Mock()
+        self.assertEqual(search.rebuild_index(chunk_size=1, progress=progress), 2)
+        self.assertEqual(self.found('rivers'), [first.pk])
+        self.assertEqual(self.found('rivers', self.other), [second.pk])
+        progress.assert_called_with('chat', 2)
+
+
+class BuildContextTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('context', password='pw')
+        self.session = ChatSession.objects.create(user=user)
+        # Ids can be reused once a test rolls back, so never keep a prefix across tests
+        self.addCleanup(invalidate_session, self.session.pk)
+        self.messages = [self.add(f'Message {number}') for number in range(4)]
+
+    def add(self, content, tokens=10):
+        return Message.objects.create(session=self.session, message_type='user', content=content, tokens_used=tokens)
+
+    def contents(self, budget):
+        messages, tokens = build_context(self.session.pk, budget=budget)
+        return [message['content'] for message in messages], tokens
+
+    def test_budget_on_and_off_a_message_boundary(self):
+        self.assertEqual(self.contents(40), (['Message 0', 'Message 1', 'Message 2', 'Message 3'], 40))
+        self.assertEqual(self.contents(30), (['Message 1', 'Message 2', 'Message 3'], 30))
+        self.assertEqual(self.contents(35), (['Message 1', 'Message 2', 'Message 3'], 30))
+        self.assertEqual(self.contents(29), (['Message 2', 'Message 3'], 20))
+        self.assertEqual(self.contents(10), (['Message 3'], 10))
+        self.assertEqual(self.contents(9), ([], 0))
+
+    def test_new_and_deleted_messages_are_reflected(self):
+        self.assertEqual(self.contents(100)[1], 40)
+        self.add('Message 4', tokens=5)
+        self.assertEqual(self.contents(100)[1], 45)
+
+        self.messages[1].delete()
+        self.assertEqual(self.contents(100), (['Message 0', 'Message 2', 'Message 3', 'Message 4'], 35))
+        Message.objects.filter(pk=self.messages[3].pk).delete()
+        self.assertEqual(self.contents(15), (['Message 2', 'Message 4'], 15))
+
+
+class CompactionTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('compacted', password='pw')
+        self.session = ChatSession.objects.create(user=user, summary='Earlier: greetings')
+        self.messages = [
+            Message.objects.create(
+                session=self.session, message_type='user' if number % 2 else 'assistant',
+                content=f'Point {number}. More detail.'
+            )
+            for number in range(7)
+        ]
+        self.chat = next(compactable for compactable in COMPACTABLES if compactable.label == 'chat')
+
+    def test_older_messages_move_to_the_archive_in_order(self):
+        archived = compact_conversation(self.chat, self.session, keep_recent=3, chunk_size=3)
+        self.assertEqual(archived, 4)
+
+        live = list(Message.objects.filter(session=self.session).order_by('id').values_list('id', flat=True))
+        self.assertEqual(live, [message.pk for message in self.messages[-3:]])
+
+        archives = list(self.session.archives.all())
+        self.assertEqual([archive.message_count for archive in archives], [3, 1])
+        restored = [row for archive in archives for row in archive.get_messages()]
+        self.assertEqual([row['id'] for row in restored], [message.pk for message in self.messages[:4]])
+        self.assertEqual(restored[0]['content'], 'Point 0. More detail.')
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary_through, self.messages[3].pk)
+        self.assertEqual(self.session.summary.splitlines(), [
+            'Earlier: greetings', 'assistant: Point 0', 'user: Point 1', 'assistant: Point 2', 'user: Point 3'
+        ])
+
+        # Nothing older than the kept messages is left
+        self.assertEqual(compact_conversation(self.chat, self.session, keep_recent=3), 0)
+
+    def test_short_conversations_are_left_alone(self):
+        self.assertEqual(compact_conversation(self.chat, self.session, keep_recent=10), 0)
+        self.assertEqual(Message.objects.filter(session=self.session).count(), 7)
+        self.assertFalse(self.session.archives.exists())
+
+
+@override_settings(ROOT_URLCONF='chat.tests')
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('pager', password='pw')
+        UserProfile.objects.update_or_create(user=self.user, defaults={'onboarding_completed': True})
+        self.session = ChatSession.objects.create(user=self.user)
+        moment = timezone.now()
+        # Same timestamp for all, so only the id orders them
+        self.messages = Message.objects.bulk_create([
+            Message(session=self.session, message_type='user', content=f'Message {number}', timestamp=moment)
+            for number in range(7)
+        ])
+
+    def test_identical_timestamps_across_pages(self):
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            rows, cursor = keyset_page(Message.objects.filter(session=self.session), 'timestamp', cursor, limit=3)
+            seen.extend(row.pk for row in rows)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted((message.pk for message in self.messages), reverse=True))
+
+    def test_last_page_has_no_next_cursor(self):
+        rows, cursor = keyset_page(Message.objects.filter(session=self.session), 'timestamp', limit=7)
+        self.assertEqual((len(rows), cursor), (7, None))
+
+    def test_views_walk_pages_and_reject_malformed_cursors(self):
+        self.client.force_login(self.user)
+        url = f'/chat/sessions/{self.session.pk}/messages/'
+        first = self.client.get(url, {'limit': 4}, secure=True).json()
+        second = self.client.get(url, {'limit': 4, 'cursor': first['next_cursor']}, secure=True).json()
+        self.assertEqual(len(first['results']) + len(second['results']), 7)
+        self.assertIsNone(second['next_cursor'])
+
+        malformed = [
+            'not a cursor', 'x', 'é',
+            base64.urlsafe_b64encode(b'no separator').decode(),
+            base64.urlsafe_b64encode(b'2026-01-01T00:00:00|abc').decode(),
+            base64.urlsafe_b64encode(b'yesterday|12').decode(),
+        ]
+        for cursor in malformed:
+            for path in (url, '/chat/sessions/'):
+                response = self.client.get(path, {'cursor': cursor}, secure=True)
+                self.assertEqual(response.status_code, 400, (path, cursor))
+                self.assertEqual(response.json(), {'error': 'Invalid cursor.'})
@@ -6,4 +6,8 @@ app_name = 'chat'
 urlpatterns = [
     path('', index, name='index'),
     path('my/', chat, name='my'),
+    path('stream/', stream_message, name='stream'),
+    path('sessions/', session_list, name='sessions'),
+    path('sessions/<int:session_id>/messages/', message_list, name='messages'),
+    path('search/', search_messages, name='search'),
 ]
@@ -1,5 +1,25 @@
+import asyncio
+import json
+import logging
+import math
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.http import StreamingHttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+from aivi.quotas import QuotaExceeded, charge_quota, check_quota
+from .backends import get_chat_backend
+from .context import build_context, count_tokens
+from .models import ChatSession, Message
+from .writebuffer import get_message_buffer
+from .pagination import keyset_page, InvalidCursor
+from . import search
+
+logger = logging.getLogger(__name__)
+
+# Largest page size the history endpoints will return
+MAX_PAGE_SIZE = 100
 
 # Create your views here.
 @login_required
@@ -19,4 +39,197 @@ def index(request):
     context = {
         'page_name': page_name
     }
-    return render(request, 'chat/index.html', context)
\ No newline at end of file
+    return render(request, 'chat/index.html', context)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@login_required
+@require_POST
+async def stream_message(request):
+    """
+    Post a user message and stream the assistant's reply as server-sent events.
+
+    Emits a `session` event first, then one `token` event per token, then a
+    `done` event once the assistant Message has been stored, or an `error`
+    event if the backend failed or the turn could not be stored within
+    settings.CHAT_SAVE_TIMEOUT seconds.
+    Responds 429 when the user is over their token quota.
+    """
+    user = await request.auser()
+    content = request.POST.get('content', '').strip()
+    if not content:
+        return JsonResponse({'error': 'Message content is required.'}, status=400)
+    try:
+        await sync_to_async(check_quota)(user, count_tokens(content))
+    except QuotaExceeded as e:
+        response = JsonResponse({'error': str(e)}, status=429)
+        response['Retry-After'] = str(math.ceil(e.retry_after))
+        return response
+
+    session_id = request.POST.get('session_id')
+    if session_id:
+        try:
+            session = await ChatSession.objects.aget(pk=session_id, user=user)
+        except (ChatSession.DoesNotExist, ValueError):
+            return JsonResponse({'error': 'Chat session not found.'}, status=404)
+    else:
+        session = await ChatSession.objects.acreate(user=user, title=content[:50])
+
+    user_message = Message(
+        session=session,
+        sender=user,
+        message_type='user',
+        content=content,
+        tokens_used=count_tokens(content)
+    )
+
+    # Recent history trimmed to the context token budget, plus the new message,
+    # which is only written together with the reply
+    history, history_tokens = await sync_to_async(build_context)(session.pk, budget=settings.CHAT_CONTEXT_TOKENS - user_message.tokens_used)
+    history.append({'role': 'user', 'content': content})
+    if session.summary:
+        # Older turns have been compacted into the session summary
+        history.insert(0, {'role': 'system', 'content': f'Summary of the earlier conversation:\n{session.summary}'})
+
+    backend = get_chat_backend()
+    # Built here rather than in the stream, which runs in the event loop
+    buffer = await sync_to_async(get_message_buffer)()
+
+    def save_turn(tokens):
+        # Both messages and the session's updated_at go out in one buffered
+        # write, rather than per token or per row
+        turn = [user_message]
+        if tokens:
+            turn.append(Message(
+                session=session,
+                message_type='assistant',
+                content=''.join(tokens),
+                tokens_used=len(tokens)
+            ))
+        saved = buffer.add_turn(session, turn)
+        charge_quota(user.pk, history_tokens + user_message.tokens_used + len(tokens), logged=False)
+        return saved
+
+    async def event_stream():
+        yield _sse('session', {'session_id': session.pk})
+
+        tokens = []
+        completed = False
+        failed = False
+        try:
+            async for token in backend.stream(history):
+                tokens.append(token)
+                yield _sse('token', {'token': token})
+            completed = True
+        except Exception:
+            logger.exception('Chat backend failed in session %s', session.pk)
+            failed = True
+        finally:
+            # A failed backend or a dropped connection still keeps the user
+            # message and any partial reply
+            saved = await sync_to_async(save_turn)(tokens)
+
+        if failed:
+            yield _sse('error', {'error': 'The reply could not be generated.'})
+            return
+        if completed:
+            try:
+                saved_messages = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(saved)), settings.CHAT_SAVE_TIMEOUT
+                )
+            except Exception:
+                yield _sse('error', {'error': 'The message could not be saved.'})
+                return
+            reply = saved_messages[-1] if tokens else None
+            yield _sse('done', {
+                'message_id': reply.pk if reply else None,
+                'tokens_used': reply.tokens_used if reply else 0,
+            })
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    return response
+
+
+def _page_size(request, default=50):
+    try:
+        return max(1, min(int(request.GET.get('limit', default)), MAX_PAGE_SIZE))
+    except ValueError:
+        return default
+
+@login_required
+def session_list(request):
+    """
+    JSON list of the user's chat sessions, most recently updated first,
+    paginated with ?cursor= from the previous page's next_cursor.
+    """
+    try:
+        sessions, next_cursor = keyset_page(
+            ChatSession.objects.filter(user=request.user).only('id', 'title', 'is_active', 'created_at', 'updated_at'),
+            'updated_at',
+            cursor=request.GET.get('cursor'),
+            limit=_page_size(request)
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'results': [
+            {
+                'id': session.pk,
+                'title': session.title,
+                'is_active': session.is_active,
+                'created_at': session.created_at,
+                'updated_at': session.updated_at,
+            }
+            for session in sessions
+        ],
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+def message_list(request, session_id):
+    """
+    JSON page of a session's messages, newest first, paginated with ?cursor=.
+    """
+    if not ChatSession.objects.filter(pk=session_id, user=request.user).exists():
+        return JsonResponse({'error': 'Chat session not found.'}, status=404)
+
+    try:
+        messages, next_cursor = keyset_page(
+            Message.objects.filter(session_id=session_id).only('id', 'message_type', 'content', 'tokens_used', 'timestamp'),
+            'timestamp',
+            cursor=request.GET.get('cursor'),
+            limit=_page_size(request)
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'results': [
+            {
+                'id': message.pk,
+                'message_type': message.message_type,
+                'content': message.content,
+                'tokens_used': message.tokens_used,
+                'timestamp': message.timestamp,
+            }
+            for message in messages
+        ],
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+def search_messages(request):
+    """
+    JSON full-text search over the user's own chat, bot and companion messages, best matches first.
+    """
+    query = request.GET.get('q', '').strip()
+    kinds = [kind for kind in request.GET.getlist('kind') if kind in search.SOURCES]
+    if not query:
+        return JsonResponse({'results': []})
+
+    results = search.search(query, user_id=request.user.pk, kinds=kinds, limit=_page_size(request, default=20))
+    return JsonResponse({'results': results})
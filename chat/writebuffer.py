@@ -0,0 +1,358 @@
+"""
+Write-behind buffer for conversation messages.
+
+Each chat, bot or companion turn produces a user message, a reply and an
+updated_at bump on the conversation; written directly that is three SQLite
+write transactions per turn. The buffer collects the rows of many turns and
+writes them with one bulk_create per message model plus one update per
+conversation model, in a single transaction per flush.
+
+A flush happens as soon as `max_batch` rows are waiting or the oldest row has
+waited `max_latency` seconds, whichever comes first. Rows are appended to a
+per-process journal file before they are acknowledged; if the process dies
+before they reach the database, the next process to start a buffer adopts
+the orphaned journal and writes its rows on the buffer's thread (delivery is
+at least once).
+
+A flush that fails on a locked or unavailable database is retried with
+backoff. Any other failure (e.g. a turn whose conversation was deleted) makes
+the flush retry each turn on its own; a turn that still fails is moved to the
+dead-letter file in the journal directory and its future gets the exception,
+so one bad turn never holds up the others.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, close_old_connections, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from . import search
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; journals are then never replayed across processes
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER = 'dead-letter.jsonl'
+
+# Sent after each flush with `model` and the `messages` of that model just written,
+# since bulk_create sends no post_save signals
+messages_written = Signal()
+
+
+class PendingTurn:
+    """
+    Messages of one conversation turn waiting to be written.
+    """
+
+    def __init__(self, parent_model, parent_id, messages, future):
+        self.parent_model = parent_model
+        self.parent_id = parent_id
+        self.messages = messages
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class WriteBehindBuffer:
+    """
+    Batches message inserts and conversation updated_at bumps on a background thread.
+    """
+
+    def __init__(self, max_batch=500, max_latency=0.05, journal_dir=None, fsync=False):
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.fsync = fsync
+        self._pending = []
+        self._pending_rows = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._journal = None
+        if journal_dir:
+            os.makedirs(journal_dir, exist_ok=True)
+            self._journal_dir = journal_dir
+            self._open_journal()
+            self._adopt_orphaned_journals()
+        self._thread = threading.Thread(target=self._run, name='message-write-buffer', daemon=True)
+        self._thread.start()
+
+    def add_turn(self, parent, messages):
+        """
+        Queue unsaved message instances belonging to `parent` (a ChatSession,
+        BotConversation or CompanionConversation) and bump its updated_at.
+
+        Returns a Future resolved with the saved messages, primary keys set,
+        once they are committed; wrap it with asyncio.wrap_future to await it.
+        """
+        future = Future()
+        turn = PendingTurn(type(parent), parent.pk, list(messages), future)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Message write buffer is closed.')
+            self._write_journal(turn)
+            self._pending.append(turn)
+            self._pending_rows += len(turn.messages)
+            self._condition.notify()
+        return future
+
+    def flush(self):
+        """
+        Write everything queued so far and wait for it.
+        """
+        with self._condition:
+            turns = self._take_pending()
+        if turns:
+            try:
+                retry = self._write(turns)
+            except Exception:
+                self._requeue(turns)
+                raise
+            if retry:
+                self._requeue(retry)
+                raise OperationalError(f'{len(retry)} turns could not be written; they are still queued.')
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+        if self._journal:
+            self._journal.close()
+            os.remove(self._journal.name)
+            self._journal = None
+
+    def _requeue(self, turns):
+        with self._condition:
+            self._pending = turns + self._pending
+            self._pending_rows += sum(len(turn.messages) for turn in turns)
+
+    def _take_pending(self):
+        turns = self._pending
+        self._pending = []
+        self._pending_rows = 0
+        return turns
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._pending:
+                        if self._pending_rows >= self.max_batch:
+                            break
+                        wait = self._pending[0].queued_at + self.max_latency - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+                turns = self._take_pending()
+
+            try:
+                retry = self._write(turns)
+            except Exception:
+                retry = turns
+            finally:
+                close_old_connections()
+            if retry:
+                # Keep the rows (they are still in the journal) and retry with backoff
+                failures += 1
+                self._requeue(retry)
+                time.sleep(min(0.05 * 2 ** failures, 2.0))
+            else:
+                failures = 0
+
+    def _write(self, turns):
+        """
+        Write `turns`, resolve the futures of those written or failed for good,
+        and return those to retry later. Raises if the database is unavailable.
+        """
+        with self._write_lock:
+            try:
+                self._insert(turns)
+                written, failed, retry = turns, [], []
+            except OperationalError:
+                raise
+            except Exception:
+                # Find the turns at fault, writing the others
+                written, failed, retry = [], [], []
+                for turn in turns:
+                    try:
+                        self._insert([turn])
+                        written.append(turn)
+                    except OperationalError:
+                        retry.append(turn)
+                    except Exception as e:
+                        failed.append((turn, e))
+                for turn, error in failed:
+                    self._dead_letter(turn, error)
+            self._truncate_journal(keep=retry)
+
+        by_model = {}
+        for turn in written:
+            for message in turn.messages:
+                by_model.setdefault(type(message), []).append(message)
+        for model, messages in by_model.items():
+            # The rows are committed; a failing receiver must not get them written again
+            messages_written.send_robust(sender=model, messages=messages)
+        # Futures cancelled by their callers are left alone
+        for turn in written:
+            if turn.future.set_running_or_notify_cancel():
+                turn.future.set_result(turn.messages)
+        for turn, error in failed:
+            if turn.future.set_running_or_notify_cancel():
+                turn.future.set_exception(error)
+        return retry
+
+    def _insert(self, turns):
+        by_model = {}
+        parents = {}
+        for turn in turns:
+            for message in turn.messages:
+                by_model.setdefault(type(message), []).append(message)
+            parents.setdefault(turn.parent_model, set()).add(turn.parent_id)
+
+        try:
+            with transaction.atomic():
+                for model, messages in by_model.items():
+                    model.objects.bulk_create(messages)
+                now = timezone.now()
+                for parent_model, parent_ids in parents.items():
+                    parent_model.objects.filter(pk__in=parent_ids).update(updated_at=now)
+                # bulk_create sends no post_save signals, so index the new rows here
+                for model, messages in by_model.items():
+                    kind = search.kind_for_model(model)
+                    if kind:
+                        search.index_messages(kind, [message.pk for message in messages])
+        except Exception:
+            for turn in turns:
+                for message in turn.messages:
+                    message.pk = None
+            raise
+
+    # Journal
+
+    def _open_journal(self):
+        path = os.path.join(self._journal_dir, f'{os.getpid()}-{uuid.uuid4().hex}.jsonl')
+        self._journal = open(path, 'a+', encoding='utf-8')
+        if fcntl:
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _journal_entry(self, turn):
+        return {
+            'parent': turn.parent_model._meta.label,
+            'parent_id': turn.parent_id,
+            'messages': [
+                {
+                    'model': message._meta.label,
+                    'fields': {
+                        field.attname: getattr(message, field.attname)
+                        for field in message._meta.concrete_fields if not field.primary_key
+                    },
+                }
+                for message in turn.messages
+            ],
+        }
+
+    def _write_journal(self, turn):
+        if not self._journal:
+            return
+        self._journal.write(json.dumps(self._journal_entry(turn), cls=DjangoJSONEncoder) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _truncate_journal(self, keep=()):
+        if not self._journal:
+            return
+        with self._condition:
+            # Rows queued while this flush ran are still pending, and `keep` is
+            # to be retried; rewrite them
+            self._journal.seek(0)
+            self._journal.truncate()
+            for turn in list(keep) + self._pending:
+                self._write_journal(turn)
+
+    def _dead_letter(self, turn, error):
+        self._write_dead_letter(self._journal_entry(turn), error)
+
+    def _write_dead_letter(self, entry, error):
+        logger.error('Dropped a message turn that could not be written: %r', error)
+        if not self._journal:
+            return
+        with open(os.path.join(self._journal_dir, DEAD_LETTER), 'a', encoding='utf-8') as dead_letter:
+            dead_letter.write(json.dumps({'error': repr(error), **entry}, cls=DjangoJSONEncoder) + '\n')
+
+    def _adopt_orphaned_journals(self):
+        """
+        Queue the turns of journals left by dead processes, moving them into
+        this buffer's journal. Only files are read here; the rows are written
+        by the buffer's thread like any other turn.
+        """
+        if not fcntl:
+            return
+        for name in os.listdir(self._journal_dir):
+            path = os.path.join(self._journal_dir, name)
+            if not name.endswith('.jsonl') or name == DEAD_LETTER or path == self._journal.name:
+                continue
+            with open(path, 'r', encoding='utf-8') as journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # Owned by a live process
+                turns = []
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    try:
+                        turns.append(self._turn_from_entry(json.loads(line)))
+                    except Exception as e:
+                        self._write_dead_letter({'line': line.rstrip('\n')}, e)
+                with self._condition:
+                    for turn in turns:
+                        self._write_journal(turn)
+                        self._pending.append(turn)
+                        self._pending_rows += len(turn.messages)
+            os.remove(path)
+
+    def _turn_from_entry(self, entry):
+        messages = []
+        for item in entry['messages']:
+            model = apps.get_model(item['model'])
+            fields = {
+                field.attname: field.to_python(item['fields'][field.attname])
+                for field in model._meta.concrete_fields if field.attname in item['fields']
+            }
+            messages.append(model(**fields))
+        return PendingTurn(apps.get_model(entry['parent']), entry['parent_id'], messages, Future())
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_message_buffer():
+    """
+    The process-wide buffer, configured from settings.MESSAGE_WRITE_BUFFER.
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(**getattr(settings, 'MESSAGE_WRITE_BUFFER', {}))
+                atexit.register(_buffer.close)
+    return _buffer
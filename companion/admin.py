@@ -1,6 +1,7 @@
 from django.contrib import admin
+from chat.search import FullTextSearchAdminMixin
 from .models import (
-    CompanionPersonality, Companion, CompanionConversation, CompanionMessage, CompanionMemory,
+    CompanionPersonality, Companion, CompanionConversation, CompanionMessage, CompanionMessageArchive, CompanionMemory,
     KnowledgeArea, SubjectContent, UserLearningProgress
 )
 
@@ -62,12 +63,13 @@ class CompanionConversationAdmin(admin.ModelAdmin):
     list_display = ['id', 'companion', 'title', 'topic', 'mood', 'is_active', 'created_at']
     list_filter = ['is_active', 'mood', 'created_at']
     search_fields = ['companion__name', 'companion__user__username', 'title', 'topic']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['mood_scores', 'summary', 'summary_through', 'created_at', 'updated_at']
     inlines = [CompanionMessageInline]
     date_hierarchy = 'created_at'
 
 @admin.register(CompanionMessage)
-class CompanionMessageAdmin(admin.ModelAdmin):
+class CompanionMessageAdmin(FullTextSearchAdminMixin, admin.ModelAdmin):
+    search_kind = 'companion'
     list_display = ['id', 'conversation', 'message_type', 'content_preview', 'emotion', 'timestamp']
     list_filter = ['message_type', 'emotion', 'timestamp']
     search_fields = ['conversation__companion__name', 'content']
@@ -171,3 +173,11 @@ class UserLearningProgressAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         })
     )
+
+@admin.register(CompanionMessageArchive)
+class CompanionMessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'conversation', 'message_count', 'first_timestamp', 'last_timestamp', 'created_at']
+    list_filter = ['created_at']
+    search_fields = ['conversation__id']
+    readonly_fields = ['conversation', 'first_message_id', 'last_message_id', 'message_count', 'first_timestamp', 'last_timestamp', 'created_at']
+    exclude = ['data']
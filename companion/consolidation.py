@@ -0,0 +1,184 @@
+"""
+Consolidation and decay of companion memories.
+
+Run periodically (e.g. nightly) over companions with memory enabled, in
+chunks of companions, each chunk in one transaction:
+
+1. Near-duplicate memories of the same type (cosine similarity of their
+   embeddings at least `duplicate_threshold`) are merged into the most
+   important one, which keeps the highest importance, the summed access
+   count and the latest access time.
+2. Memories not accessed for `stale_after_days` lose one point of importance
+   per run, down to zero.
+3. Companions over `max_memories_per_companion` lose their lowest retention
+   scores, the recency and importance terms of the retrieval score, so
+   unimportant, long unused memories go first.
+
+Changes are written relative to the stored values (access counts added,
+importance decremented), so access statistics flushed by the
+AccessStatsBuffer while a chunk is consolidated are kept.
+"""
+
+import math
+import time
+from collections import namedtuple
+from datetime import timedelta
+from django.db import OperationalError, transaction
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+from aivi.semantic import HashingEmbedder, InvertedIndex
+from .memory import get_config
+from .models import Companion, CompanionMemory
+
+ConsolidationResult = namedtuple('ConsolidationResult', ['companions', 'examined', 'merged', 'decayed', 'evicted'])
+
+WRITE_BATCH_SIZE = 500
+
+_embedder = HashingEmbedder()
+
+
+def _merge_duplicates(memories, threshold, merges):
+    """
+    Returns (survivors, merged_away) for one companion's memories, recording
+    in `merges` what each survivor absorbed, as {id: [access count, latest
+    access, earliest creation]}.
+    """
+    # Most important (then most recently used) first, so it survives its duplicates
+    memories = sorted(memories, key=lambda memory: (memory.importance, memory.last_accessed), reverse=True)
+    indexes = {}
+    survivors = {}
+    merged_away = []
+    for memory in memories:
+        vector = _embedder.embed(memory.content)
+        index = indexes.setdefault(memory.memory_type, InvertedIndex())
+        match = index.nearest(vector, threshold) if vector else None
+        if match is None:
+            if vector:
+                index.add(memory.pk, vector)
+            survivors[memory.pk] = memory
+            continue
+        keeper = survivors[match[0]]
+        keeper.last_accessed = max(keeper.last_accessed, memory.last_accessed)
+        absorbed = merges.setdefault(keeper.pk, [0, memory.last_accessed, memory.created_at])
+        absorbed[0] += memory.access_count
+        absorbed[1] = max(absorbed[1], memory.last_accessed)
+        absorbed[2] = min(absorbed[2], memory.created_at)
+        merged_away.append(memory.pk)
+    return list(survivors.values()), merged_away
+
+
+def _retention_score(memory, now, config):
+    weights = config['weights']
+    decay = math.log(2) / (config['recency_half_life_hours'] * 3600)
+    recency = math.exp(-decay * max((now - memory.last_accessed).total_seconds(), 0))
+    importance = min(max(memory.importance, 0), config['max_importance']) / config['max_importance']
+    return weights['recency'] * recency + weights['importance'] * importance
+
+
+def _apply_merges(merges):
+    items = list(merges.items())
+    for start in range(0, len(items), WRITE_BATCH_SIZE):
+        batch = items[start:start + WRITE_BATCH_SIZE]
+        CompanionMemory.objects.filter(pk__in=[memory_id for memory_id, _ in batch]).update(
+            access_count=F('access_count') + Case(
+                *[When(pk=memory_id, then=Value(count)) for memory_id, (count, _, _) in batch],
+                output_field=IntegerField()
+            ),
+            last_accessed=Greatest(F('last_accessed'), Case(
+                *[When(pk=memory_id, then=Value(accessed)) for memory_id, (_, accessed, _) in batch],
+                output_field=DateTimeField()
+            )),
+            created_at=Least(F('created_at'), Case(
+                *[When(pk=memory_id, then=Value(created)) for memory_id, (_, _, created) in batch],
+                output_field=DateTimeField()
+            )),
+        )
+
+
+def consolidate_companions(companion_ids, config=None):
+    """
+    Consolidate the memories of the given companions in one transaction.
+    Returns a ConsolidationResult.
+    """
+    config = config or get_config()
+    now = timezone.now()
+    stale_before = now - timedelta(days=config['stale_after_days'])
+    budget = config['max_memories_per_companion']
+
+    with transaction.atomic():
+        by_companion = {}
+        memories = CompanionMemory.objects.filter(companion_id__in=companion_ids).only(
+            'pk', 'companion_id', 'memory_type', 'content', 'importance', 'last_accessed', 'access_count', 'created_at'
+        )
+        examined = 0
+        for memory in memories.iterator(chunk_size=2000):
+            by_companion.setdefault(memory.companion_id, []).append(memory)
+            examined += 1
+
+        merges = {}
+        stale = []
+        deleted = []
+        merged = evicted = 0
+        for companion_memories in by_companion.values():
+            survivors, merged_away = _merge_duplicates(companion_memories, config['duplicate_threshold'], merges)
+            deleted.extend(merged_away)
+            merged += len(merged_away)
+
+            for memory in survivors:
+                if memory.last_accessed < stale_before and memory.importance > 0:
+                    memory.importance -= 1
+                    stale.append(memory.pk)
+
+            if len(survivors) > budget:
+                survivors.sort(key=lambda memory: _retention_score(memory, now, config), reverse=True)
+                evicted_memories = survivors[budget:]
+                survivors = survivors[:budget]
+                deleted.extend(memory.pk for memory in evicted_memories)
+                evicted += len(evicted_memories)
+
+        deleted_ids = set(deleted)
+        _apply_merges({memory_id: absorbed for memory_id, absorbed in merges.items() if memory_id not in deleted_ids})
+        stale = [memory_id for memory_id in stale if memory_id not in deleted_ids]
+        decayed = 0
+        for start in range(0, len(stale), WRITE_BATCH_SIZE):
+            decayed += CompanionMemory.objects.filter(
+                pk__in=stale[start:start + WRITE_BATCH_SIZE], importance__gt=0
+            ).update(importance=F('importance') - 1)
+        for start in range(0, len(deleted), WRITE_BATCH_SIZE):
+            CompanionMemory.objects.filter(pk__in=deleted[start:start + WRITE_BATCH_SIZE]).delete()
+
+    return ConsolidationResult(len(by_companion), examined, merged, decayed, evicted)
+
+
+def companion_chunks(chunk_size=200):
+    """
+    Yield lists of ids of companions with memory enabled, streamed by primary key.
+    """
+    last_id = 0
+    while True:
+        ids = list(
+            Companion.objects.filter(memory_enabled=True, pk__gt=last_id)
+            .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def timed_consolidation(companion_ids, attempts=5):
+    """
+    Worker entry point: consolidate one chunk and return (result, seconds).
+    A chunk whose transaction hits a locked database is retried with backoff.
+    """
+    started = time.perf_counter()
+    for attempt in range(attempts):
+        try:
+            result = consolidate_companions(companion_ids)
+            break
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+    return result, time.perf_counter() - started
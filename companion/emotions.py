@@ -0,0 +1,286 @@
+"""
+Emotion tagging of companion messages and conversation mood.
+
+Classifying inline would add latency to every reply, so new messages are
+queued and tagged on a background thread: up to `batch_size` messages, or
+whatever arrived within `max_latency` seconds, are classified in one call and
+their emotions written with one UPDATE per emotion. The same pass updates
+each conversation's mood incrementally: mood_scores holds decayed emotion
+weights, where each user message adds 1 to its emotion after the existing
+weights decay by half every `mood_half_life` messages, and mood is the
+emotion with the largest weight.
+
+The classifier is settings.COMPANION_EMOTIONS['CLASSIFIER'], a callable
+taking a list of texts and returning one emotion per text; the default is a
+small lexicon. A batch that fails for any reason but a locked database is
+tagged again message by message, and messages that still fail are tagged
+neutral, so one bad message cannot hold up the queue. Messages queued when a
+process exits are tagged by the tag_emotions command, which also backfills
+older messages.
+"""
+
+import atexit
+import logging
+import re
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.utils.module_loading import import_string
+from aivi.semantic import stem
+from .models import CompanionConversation, CompanionMessage
+
+logger = logging.getLogger(__name__)
+
+NEUTRAL = 'neutral'
+
+LEXICON = {
+    'joy': (
+        'happy glad great awesome amazing wonderful excited fun love enjoy yay nice '
+        'fantastic excellent delighted cheerful proud celebrate'
+    ),
+    'sadness': (
+        'sad unhappy depressed down lonely cry miss hurt heartbroken disappointed '
+        'upset tired hopeless lost sorry grief'
+    ),
+    'anger': 'angry mad furious annoyed hate irritated frustrated rage unfair stupid',
+    'fear': 'afraid scared worried anxious nervous panic fear terrified stress overwhelmed',
+    'surprise': 'wow surprised unexpected shocked unbelievable whoa suddenly',
+    'gratitude': 'thank thanks grateful appreciate',
+}
+NEGATIONS = {'not', 'no', 'never', "n't", 'nothing', 'hardly', 'without'}
+NEGATION_WINDOW = 3  # Words after a negation whose emotion is ignored
+
+_WORD = re.compile(r"[a-z']+|n't")
+_LEXICON_STEMS = {stem(word): emotion for emotion, words in LEXICON.items() for word in words.split()}
+
+
+def get_config():
+    config = {
+        'CLASSIFIER': 'companion.emotions.lexicon_classifier',
+        'batch_size': 200,
+        'max_latency': 2.0,
+        'mood_half_life': 10,
+    }
+    config.update(getattr(settings, 'COMPANION_EMOTIONS', {}))
+    return config
+
+
+def classify_text(text):
+    """
+    The emotion with the most lexicon hits in `text`, or 'neutral'.
+    """
+    counts = {}
+    negated = 0
+    for word in _WORD.findall(text.lower()):
+        if word in NEGATIONS or word.endswith("n't"):
+            negated = NEGATION_WINDOW
+            continue
+        emotion = _LEXICON_STEMS.get(stem(word))
+        if emotion and not negated:
+            counts[emotion] = counts.get(emotion, 0) + 1
+        negated = max(negated - 1, 0)
+    if text.count('!') >= 2 and not counts:
+        return 'surprise'
+    return max(counts, key=counts.get) if counts else NEUTRAL
+
+
+def lexicon_classifier(texts):
+    return [classify_text(text) for text in texts]
+
+
+def get_classifier():
+    return import_string(get_config()['CLASSIFIER'])
+
+
+def neutral_classifier(texts):
+    return [NEUTRAL] * len(texts)
+
+
+def update_mood(scores, emotions, half_life):
+    """
+    Fold `emotions` (oldest first) into the decayed weights `scores` and
+    return (mood, scores).
+    """
+    decay = 0.5 ** (1 / half_life)
+    scores = dict(scores)
+    for emotion in emotions:
+        for name in scores:
+            scores[name] *= decay
+        scores[emotion] = scores.get(emotion, 0.0) + 1.0
+    scores = {name: round(weight, 4) for name, weight in scores.items() if weight >= 0.001}
+    mood = max(scores, key=scores.get) if scores else ''
+    return mood, scores
+
+
+def tag_messages(messages, classifier=None, config=None):
+    """
+    Classify and store the emotions of `messages`, (id, conversation id,
+    message type, content) tuples in creation order, and fold the user
+    messages into their conversations' mood. Messages already tagged are
+    skipped. Returns the number tagged.
+    """
+    if not messages:
+        return 0
+    config = config or get_config()
+    classifier = classifier or get_classifier()
+    emotions = classifier([content for _, _, _, content in messages])
+    if len(emotions) != len(messages):
+        raise ValueError(f'The classifier returned {len(emotions)} emotions for {len(messages)} messages.')
+
+    with transaction.atomic():
+        # A message tagged meanwhile (e.g. by a backfill) must not count towards the mood twice
+        untagged = set(
+            CompanionMessage.objects.filter(pk__in=[message[0] for message in messages], emotion='')
+            .values_list('pk', flat=True)
+        )
+        by_emotion = {}
+        by_conversation = {}
+        for (message_id, conversation_id, message_type, _), emotion in zip(messages, emotions):
+            if message_id not in untagged:
+                continue
+            by_emotion.setdefault(emotion, []).append(message_id)
+            if message_type == 'user':
+                by_conversation.setdefault(conversation_id, []).append(emotion)
+
+        for emotion, message_ids in by_emotion.items():
+            CompanionMessage.objects.filter(pk__in=message_ids).update(emotion=emotion)
+        conversations = list(
+            CompanionConversation.objects.filter(pk__in=by_conversation).only('pk', 'mood', 'mood_scores')
+        )
+        for conversation in conversations:
+            conversation.mood, conversation.mood_scores = update_mood(
+                conversation.mood_scores or {}, by_conversation[conversation.pk], config['mood_half_life']
+            )
+        # bulk_update leaves updated_at alone, so tagging does not reorder conversations
+        CompanionConversation.objects.bulk_update(conversations, ['mood', 'mood_scores'], batch_size=500)
+    return len(untagged)
+
+
+class EmotionTagger:
+    """
+    Queue of messages to tag, drained in batches on a background thread.
+    """
+
+    def __init__(self, batch_size=200, max_latency=2.0):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='companion-emotions', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, messages):
+        """
+        Queue CompanionMessage instances (already saved) for tagging.
+        """
+        items = [
+            (message.pk, message.conversation_id, message.message_type, message.content)
+            for message in messages if message.pk and not message.emotion and message.message_type != 'system'
+        ]
+        if not items:
+            return
+        with self._condition:
+            self._pending.extend(items)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def drain(self):
+        """
+        Tag everything queued now, in batches.
+        """
+        while True:
+            with self._condition:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return
+            try:
+                tag_messages(batch)
+            except OperationalError:
+                # Database locked or gone: keep the batch for the next pass
+                with self._condition:
+                    self._pending.extendleft(reversed(batch))
+                raise
+            except Exception:
+                logger.warning('Tagging %d messages failed; tagging them one by one', len(batch), exc_info=True)
+                self._tag_each(batch)
+
+    def _tag_each(self, batch):
+        retry = []
+        error = None
+        for message in batch:
+            try:
+                try:
+                    tag_messages([message])
+                except OperationalError:
+                    raise
+                except Exception:
+                    logger.exception('Tagging message %s failed; tagged neutral', message[0])
+                    tag_messages([message], classifier=neutral_classifier)
+            except OperationalError as e:
+                retry.append(message)
+                error = e
+            except Exception:
+                logger.exception('Message %s could not be tagged; dropped', message[0])
+        if retry:
+            with self._condition:
+                self._pending.extendleft(reversed(retry))
+            raise error
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.drain()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._condition.wait(self.max_latency)
+                if self._closed:
+                    return
+            try:
+                self.drain()
+            except Exception:
+                time.sleep(self.max_latency)  # Still queued; retried on the next pass
+            finally:
+                close_old_connections()
+
+
+_tagger = None
+_tagger_lock = threading.Lock()
+
+
+def get_emotion_tagger():
+    """
+    The process-wide tagger, configured from settings.COMPANION_EMOTIONS.
+    """
+    global _tagger
+    if _tagger is None:
+        with _tagger_lock:
+            if _tagger is None:
+                config = get_config()
+                _tagger = EmotionTagger(config['batch_size'], config['max_latency'])
+                atexit.register(_tagger.close)
+    return _tagger
+
+
+def untagged_batches(batch_size=1000):
+    """
+    Yield batches of untagged non-system messages as tag_messages expects
+    them, in creation order.
+    """
+    last_id = 0
+    while True:
+        batch = list(
+            CompanionMessage.objects.filter(pk__gt=last_id, emotion='').exclude(message_type='system')
+            .order_by('pk').values_list('pk', 'conversation_id', 'message_type', 'content')[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1][0]
@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from django.db import connections
+from companion.consolidation import companion_chunks, timed_consolidation
+
+class Command(BaseCommand):
+    help = 'Merge near-duplicate companion memories, decay stale ones and cap each companion at its memory budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=200, help='Companions consolidated per transaction')
+        parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 4), help='Worker processes')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        totals = {'companions': 0, 'examined': 0, 'merged': 0, 'decayed': 0, 'evicted': 0}
+
+        def record(result, seconds):
+            for field in totals:
+                totals[field] += getattr(result, field)
+            self.stdout.write(
+                f'  {result.companions} companions: {result.examined} memories, {result.merged} merged, '
+                f'{result.decayed} decayed, {result.evicted} evicted ({seconds:.2f}s)'
+            )
+
+        workers = options['workers']
+        if workers <= 1:
+            for chunk in companion_chunks(options['chunk_size']):
+                record(*timed_consolidation(chunk))
+        else:
+            # Read every chunk before forking: forked workers must not share the parent's
+            # database connections, and reading chunks later would open a new one
+            chunks = list(companion_chunks(options['chunk_size']))
+            connections.close_all()
+            context = multiprocessing.get_context('fork') if hasattr(os, 'fork') else None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                pending = set()
+                for chunk in chunks:
+                    # Keep a bounded number of chunks in flight
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            record(*future.result())
+                    pending.add(pool.submit(timed_consolidation, chunk))
+                for future in pending:
+                    record(*future.result())
+
+        elapsed = time.perf_counter() - started
+        pruned = totals['merged'] + totals['evicted']
+        self.stdout.write(self.style.SUCCESS(
+            f"Consolidated {totals['examined']} memories of {totals['companions']} companions in {elapsed:.2f}s: "
+            f"{totals['merged']} merged, {totals['decayed']} decayed, {totals['evicted']} evicted "
+            f"({pruned / elapsed if elapsed else 0:.0f} rows pruned/sec)"
+        ))
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from companion.emotions import get_classifier, get_config, tag_messages, untagged_batches
+
+class Command(BaseCommand):
+    help = 'Tag the emotion of untagged companion messages and update conversation moods'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Messages classified per batch')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        classifier = get_classifier()
+        batch_size = options['batch_size'] or config['batch_size']
+        started = time.perf_counter()
+        tagged = 0
+        for batch in untagged_batches(batch_size):
+            tagged += tag_messages(batch, classifier, config)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Tagged {tagged} messages in {elapsed:.2f}s ({tagged / elapsed if elapsed else 0:.0f} messages/sec)'
+        ))
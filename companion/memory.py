@@ -0,0 +1,289 @@
+"""
+Companion memory retrieval.
+
+Each companion's memories are loaded once into an in-memory index holding
+their embeddings (see aivi.semantic.HashingEmbedder), and retrieval scores
+every memory against the current message:
+
+    score = w_recency * recency + w_importance * importance + w_similarity * similarity
+
+where recency decays exponentially with the time since the memory was last
+accessed, importance is scaled to 0..1 by `max_importance`, and similarity
+is the cosine similarity to the message. Retrieving a memory counts as an
+access; access counts and last_accessed times are accumulated in memory and
+written back with one bulk UPDATE per batch every `flush_interval` seconds
+instead of one write per memory per turn.
+"""
+
+import atexit
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+from django.utils import timezone
+from aivi.semantic import HashingEmbedder, cosine
+from .models import CompanionMemory
+
+ScoredMemory = namedtuple('ScoredMemory', ['memory_id', 'memory_type', 'content', 'importance', 'score'])
+
+FLUSH_BATCH_SIZE = 500
+
+_embedder = HashingEmbedder()
+
+
+def get_config():
+    config = {
+        'weights': {'recency': 1.0, 'importance': 1.0, 'similarity': 1.0},
+        'recency_half_life_hours': 72,
+        'max_importance': 10,
+        'flush_interval': 5,
+        'max_companions': 1000,
+        'ttl': 300,
+        'max_memories_per_companion': 500,
+        'duplicate_threshold': 0.9,
+        'stale_after_days': 30,
+    }
+    config.update(getattr(settings, 'COMPANION_MEMORY', {}))
+    return config
+
+
+class _Memory:
+    __slots__ = ('memory_id', 'memory_type', 'content', 'importance', 'last_accessed', 'vector')
+
+    def __init__(self, memory_id, memory_type, content, importance, last_accessed):
+        self.memory_id = memory_id
+        self.memory_type = memory_type
+        self.content = content
+        self.importance = importance
+        self.last_accessed = last_accessed.timestamp()
+        self.vector = _embedder.embed(content)
+
+
+class CompanionMemoryIndex:
+    """
+    The memories of one companion with their embeddings.
+    """
+
+    def __init__(self, companion_id, memories):
+        self.companion_id = companion_id
+        self.memories = {memory.memory_id: memory for memory in memories}
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, companion_id):
+        rows = CompanionMemory.objects.filter(companion_id=companion_id).values_list(
+            'pk', 'memory_type', 'content', 'importance', 'last_accessed'
+        )
+        return cls(companion_id, [_Memory(*row) for row in rows.iterator()])
+
+    def put(self, memory):
+        self.memories[memory.pk] = _Memory(memory.pk, memory.memory_type, memory.content, memory.importance, memory.last_accessed)
+
+    def discard(self, memory_id):
+        self.memories.pop(memory_id, None)
+
+    def score(self, message, k=5, config=None, now=None):
+        """
+        Return the `k` highest scoring memories for `message`, best first.
+        """
+        config = config or get_config()
+        weights = config['weights']
+        decay = math.log(2) / (config['recency_half_life_hours'] * 3600)
+        max_importance = config['max_importance']
+        now = now or time.time()
+        vector = _embedder.embed(message) if message else {}
+
+        scored = []
+        for memory in self.memories.values():
+            recency = math.exp(-decay * max(now - memory.last_accessed, 0))
+            importance = min(max(memory.importance, 0), max_importance) / max_importance
+            similarity = max(cosine(vector, memory.vector), 0.0) if vector else 0.0
+            total = (weights['recency'] * recency + weights['importance'] * importance
+                     + weights['similarity'] * similarity)
+            scored.append((total, memory))
+        return [
+            ScoredMemory(memory.memory_id, memory.memory_type, memory.content, memory.importance, total)
+            for total, memory in heapq.nlargest(k, scored, key=lambda item: item[0])
+        ]
+
+
+class AccessStatsBuffer:
+    """
+    Accumulates memory accesses and writes them back in bulk on a background thread.
+    """
+
+    def __init__(self, flush_interval=5):
+        self.flush_interval = flush_interval
+        self._pending = {}  # memory id -> [access count delta, last accessed]
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='companion-memory-stats', daemon=True)
+        self._thread.start()
+
+    def record(self, memory_ids, accessed_at):
+        with self._condition:
+            for memory_id in memory_ids:
+                stats = self._pending.get(memory_id)
+                if stats is None:
+                    self._pending[memory_id] = [1, accessed_at]
+                else:
+                    stats[0] += 1
+                    stats[1] = max(stats[1], accessed_at)
+
+    def flush(self):
+        with self._condition:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self._write(pending)
+        except Exception:
+            self._merge_back(pending)
+            raise
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _merge_back(self, pending):
+        with self._condition:
+            for memory_id, (count, accessed_at) in pending.items():
+                stats = self._pending.setdefault(memory_id, [0, accessed_at])
+                stats[0] += count
+                stats[1] = max(stats[1], accessed_at)
+
+    def _write(self, pending):
+        items = list(pending.items())
+        with self._write_lock:
+            for start in range(0, len(items), FLUSH_BATCH_SIZE):
+                batch = items[start:start + FLUSH_BATCH_SIZE]
+                CompanionMemory.objects.filter(pk__in=[memory_id for memory_id, _ in batch]).update(
+                    access_count=F('access_count') + Case(
+                        *[When(pk=memory_id, then=Value(count)) for memory_id, (count, _) in batch],
+                        output_field=IntegerField()
+                    ),
+                    last_accessed=Case(
+                        *[When(pk=memory_id, then=Value(accessed_at)) for memory_id, (_, accessed_at) in batch],
+                        default=F('last_accessed'),
+                        output_field=DateTimeField()
+                    ),
+                )
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_interval)  # Kept in memory; retried on the next flush
+            finally:
+                close_old_connections()
+
+
+class MemoryRetriever:
+    """
+    Caches a CompanionMemoryIndex per companion (least recently used first
+    out, reloaded after `ttl` seconds so changes made by other processes show
+    up) and records accesses through an AccessStatsBuffer.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.stats = AccessStatsBuffer(self.config['flush_interval'])
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_index(self, companion_id):
+        with self._lock:
+            index = self._indexes.get(companion_id)
+            if index is not None and time.monotonic() - index.loaded_at < self.config['ttl']:
+                self._indexes.move_to_end(companion_id)
+                return index
+        index = CompanionMemoryIndex.load(companion_id)
+        with self._lock:
+            self._indexes[companion_id] = index
+            self._indexes.move_to_end(companion_id)
+            while len(self._indexes) > self.config['max_companions']:
+                self._indexes.popitem(last=False)
+        return index
+
+    def retrieve(self, companion_id, message, k=5, record_access=True):
+        """
+        Return the `k` most relevant memories of a companion for `message`.
+        """
+        index = self.get_index(companion_id)
+        memories = index.score(message, k, self.config)
+        if record_access and memories:
+            now = timezone.now()
+            for memory in memories:
+                index.memories[memory.memory_id].last_accessed = now.timestamp()
+            self.stats.record([memory.memory_id for memory in memories], now)
+        return memories
+
+    def memory_saved(self, memory):
+        with self._lock:
+            index = self._indexes.get(memory.companion_id)
+        if index is not None:
+            index.put(memory)
+
+    def memory_deleted(self, memory):
+        with self._lock:
+            index = self._indexes.get(memory.companion_id)
+        if index is not None:
+            index.discard(memory.pk)
+
+    def invalidate(self, companion_id=None):
+        with self._lock:
+            if companion_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(companion_id, None)
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_memory_retriever():
+    """
+    The process-wide retriever, configured from settings.COMPANION_MEMORY.
+    """
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = MemoryRetriever()
+                atexit.register(_retriever.stats.close)
+    return _retriever
+
+
+def retrieve_memories(companion, message, k=5):
+    """
+    The `k` most relevant memories of `companion` for `message`; empty when
+    the companion has memory disabled.
+    """
+    if not companion.memory_enabled:
+        return []
+    return get_memory_retriever().retrieve(companion.pk, message, k)
+
+
+def memory_saved(memory):
+    # Nothing is cached until the process has retrieved memories
+    if _retriever is not None:
+        _retriever.memory_saved(memory)
+
+
+def memory_deleted(memory):
+    if _retriever is not None:
+        _retriever.memory_deleted(memory)
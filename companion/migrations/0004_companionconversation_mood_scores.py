@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companion', '0003_companionconversation_summary_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companionconversation',
+            name='mood_scores',
+            field=models.JSONField(blank=True, default=dict, help_text='Decayed emotion weights of user messages behind the mood'),
+        ),
+    ]
@@ -60,7 +60,10 @@ class CompanionConversation(models.Model):
     title = models.CharField(max_length=200, blank=True)
     topic = models.CharField(max_length=100, blank=True)
     mood = models.CharField(max_length=50, blank=True)
+    mood_scores = models.JSONField(default=dict, blank=True, help_text="Decayed emotion weights of user messages behind the mood")
     is_active = models.BooleanField(default=True)
+    summary = models.TextField(blank=True, help_text="Rolling summary of archived messages")
+    summary_through = models.BigIntegerField(null=True, blank=True, help_text="Id of the last message covered by the summary")
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -94,6 +97,31 @@ class CompanionMessage(models.Model):
         verbose_name_plural = "Companion Messages"
         ordering = ['timestamp']
 
+class CompanionMessageArchive(models.Model):
+    """
+    Compressed batch of companion messages moved out of the hot table by compaction.
+    """
+    conversation = models.ForeignKey(CompanionConversation, on_delete=models.CASCADE, related_name='archives')
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.IntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    data = models.BinaryField(help_text="zlib-compressed JSON list of the archived messages")
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.message_count} archived messages in {self.conversation}"
+
+    def get_messages(self):
+        from chat.compaction import decompress_messages
+        return decompress_messages(self.data)
+
+    class Meta:
+        verbose_name = "Companion Message Archive"
+        verbose_name_plural = "Companion Message Archives"
+        ordering = ['first_message_id']
+
 class CompanionMemory(models.Model):
     MEMORY_TYPES = [
         ('personal', 'Personal Information'),
@@ -0,0 +1,287 @@
+"""
+Live companion presence.
+
+Presence is kept in memory rather than read from and written to the
+Companion.status column on every page and state change. Clients send
+heartbeats with the companion's live status (available or busy); a companion
+whose heartbeats stop for `ttl` seconds goes offline. Only transitions reach
+the database: a background thread writes the latest status of companions
+whose status changed every `flush_interval` seconds, one UPDATE per status,
+so a companion flapping between states within an interval costs nothing and
+heartbeats never touch the row. Companions put in maintenance (in the admin)
+are left alone.
+
+With several processes, each one's registry only sees its own heartbeats
+unless a broker relays them: settings.COMPANION_PRESENCE['BROKER'] names a
+PresenceBroker class. LocalBroker fans messages out within one process and
+stands in for a shared broker (such as Redis pub/sub) implementing the same
+two methods.
+"""
+
+import atexit
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+from .models import Companion
+
+LIVE_STATUSES = ('available', 'busy')
+MANUAL_STATUSES = ('maintenance',)  # Set by staff; presence never overrides them
+
+
+def get_config():
+    config = {
+        'ttl': 90,
+        'flush_interval': 5,
+        'BROKER': None,
+        'OPTIONS': {},
+    }
+    config.update(getattr(settings, 'COMPANION_PRESENCE', {}))
+    return config
+
+
+class PresenceBroker:
+    """
+    Base class for relays of presence updates between processes.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+
+    def publish(self, message):
+        """
+        Deliver `message`, a JSON-serializable dict, to every subscriber.
+        """
+        raise NotImplementedError('Presence brokers must implement publish()')
+
+    def subscribe(self, callback):
+        """
+        Call `callback` with every message published from now on.
+        """
+        raise NotImplementedError('Presence brokers must implement subscribe()')
+
+
+class LocalBroker(PresenceBroker):
+    """
+    In-process stand-in for a shared broker.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(message)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+
+class PresenceRegistry:
+    """
+    Live status of companions by id, expiring after `ttl` seconds without a
+    heartbeat, with status transitions written back on a background thread.
+    """
+
+    def __init__(self, ttl=90, flush_interval=5, broker=None):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.broker = broker
+        self._origin = uuid.uuid4().hex
+        self._live = {}  # companion id -> [status, expires at (monotonic)]
+        self._persisted = {}  # companion id -> status last written or loaded
+        self._dirty = set()
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        if broker is not None:
+            broker.subscribe(self._receive)
+        self._thread = threading.Thread(target=self._run, name='companion-presence', daemon=True)
+        self._thread.start()
+
+    def _apply(self, companion_id, status, ttl):
+        # Callers hold self._condition
+        entry = self._live.get(companion_id)
+        if status == 'offline':
+            if entry is not None:
+                del self._live[companion_id]
+                self._dirty.add(companion_id)
+            return
+        if entry is None or entry[0] != status:
+            self._dirty.add(companion_id)
+        self._live[companion_id] = [status, time.monotonic() + ttl]
+
+    def heartbeat(self, companion_id, status='available'):
+        """
+        Record that a companion is live with `status` for the next `ttl` seconds.
+        """
+        if status not in LIVE_STATUSES:
+            raise ValueError(f"Presence status must be one of {', '.join(LIVE_STATUSES)}, not {status!r}")
+        with self._condition:
+            self._apply(companion_id, status, self.ttl)
+        self._publish(companion_id, status)
+
+    def disconnect(self, companion_id):
+        """
+        Take a companion offline now rather than when its heartbeats lapse.
+        """
+        with self._condition:
+            self._apply(companion_id, 'offline', 0)
+        self._publish(companion_id, 'offline')
+
+    def get_status(self, companion_id, default='offline'):
+        """
+        The live status of a companion, or `default` without a current heartbeat.
+        """
+        with self._condition:
+            entry = self._live.get(companion_id)
+        if entry is None or entry[1] <= time.monotonic():
+            return default
+        return entry[0]
+
+    def live(self):
+        """
+        Ids of companions with a current heartbeat, by status.
+        """
+        now = time.monotonic()
+        statuses = {status: [] for status in LIVE_STATUSES}
+        with self._condition:
+            for companion_id, (status, expires) in self._live.items():
+                if expires > now:
+                    statuses[status].append(companion_id)
+        return statuses
+
+    def persisted(self, companion_id, status):
+        """
+        Note the status stored in the database for a companion, e.g. after an admin save.
+        """
+        with self._condition:
+            self._persisted[companion_id] = status
+            if status in MANUAL_STATUSES:
+                self._live.pop(companion_id, None)
+                self._dirty.discard(companion_id)
+
+    def forget(self, companion_id):
+        with self._condition:
+            self._live.pop(companion_id, None)
+            self._persisted.pop(companion_id, None)
+            self._dirty.discard(companion_id)
+
+    def _publish(self, companion_id, status):
+        if self.broker is not None:
+            self.broker.publish({'origin': self._origin, 'companion_id': companion_id, 'status': status, 'ttl': self.ttl})
+
+    def _receive(self, message):
+        if message.get('origin') == self._origin:
+            return
+        with self._condition:
+            self._apply(message['companion_id'], message['status'], message.get('ttl', self.ttl))
+
+    def expire(self):
+        """
+        Take companions whose heartbeats lapsed offline.
+        """
+        now = time.monotonic()
+        with self._condition:
+            for companion_id in [companion_id for companion_id, (_, expires) in self._live.items() if expires <= now]:
+                self._apply(companion_id, 'offline', 0)
+
+    def flush(self):
+        """
+        Write the current status of companions that changed since the last flush.
+        """
+        with self._condition:
+            dirty, self._dirty = self._dirty, set()
+            by_status = {}
+            for companion_id in dirty:
+                entry = self._live.get(companion_id)
+                status = entry[0] if entry is not None else 'offline'
+                if self._persisted.get(companion_id) != status:
+                    by_status.setdefault(status, []).append(companion_id)
+        if not by_status:
+            return
+        try:
+            with self._write_lock:
+                for status, companion_ids in by_status.items():
+                    Companion.objects.filter(pk__in=companion_ids).exclude(
+                        status__in=(status, *MANUAL_STATUSES)
+                    ).update(status=status)
+        except Exception:
+            with self._condition:
+                for companion_ids in by_status.values():
+                    self._dirty.update(companion_ids)
+            raise
+        with self._condition:
+            for status, companion_ids in by_status.items():
+                for companion_id in companion_ids:
+                    self._persisted[companion_id] = status
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.expire()
+                self.flush()
+            except Exception:
+                time.sleep(self.flush_interval)  # Still dirty; retried on the next flush
+            finally:
+                close_old_connections()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_presence_registry():
+    """
+    The process-wide registry, configured from settings.COMPANION_PRESENCE.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                config = get_config()
+                broker = None
+                if config['BROKER']:
+                    broker = import_string(config['BROKER'])(**config['OPTIONS'])
+                _registry = PresenceRegistry(config['ttl'], config['flush_interval'], broker)
+                atexit.register(_registry.close)
+    return _registry
+
+
+def companion_status(companion):
+    """
+    The status to show for `companion`: maintenance as set by staff, otherwise
+    its live presence.
+    """
+    if companion.status in MANUAL_STATUSES:
+        return companion.status
+    return get_presence_registry().get_status(companion.pk)
+
+
+def companion_saved(companion):
+    # Nothing is tracked until the process has seen a heartbeat
+    if _registry is not None:
+        _registry.persisted(companion.pk, companion.status)
+
+
+def companion_deleted(companion):
+    if _registry is not None:
+        _registry.forget(companion.pk)
@@ -0,0 +1,158 @@
+"""
+Compiled companion system prompts.
+
+A companion's system prompt combines its personality's system_prompt and
+traits, its own custom_instructions and its most important memories. It is
+compiled once per companion and cached, so a turn (see views.send_message)
+reuses it instead of reading three tables and joining them again. Saving or
+deleting a personality, a companion or one of its memories drops the
+affected entries (see signals.py); entries also expire after `ttl` seconds,
+so changes made by other processes show up.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .models import Companion, CompanionMemory
+
+
+def get_config():
+    config = {
+        'memories': 5,
+        'max_companions': 1000,
+        'ttl': 300,
+    }
+    config.update(getattr(settings, 'COMPANION_PROMPT', {}))
+    return config
+
+
+def _format_traits(traits):
+    if isinstance(traits, dict):
+        return ', '.join(f'{name}: {value}' for name, value in traits.items())
+    if isinstance(traits, (list, tuple)):
+        return ', '.join(str(trait) for trait in traits)
+    return str(traits or '')
+
+
+def compile_prompt(companion, memories=()):
+    """
+    The system prompt of `companion` (with its personality loaded) remembering
+    the given memory contents.
+    """
+    personality = companion.personality
+    parts = [personality.system_prompt.strip()]
+    traits = _format_traits(personality.traits)
+    if traits:
+        parts.append(f'Your personality traits: {traits}.')
+    if companion.name:
+        parts.append(f'Your name is {companion.name}.')
+    if companion.custom_instructions.strip():
+        parts.append(f'Instructions from the user:\n{companion.custom_instructions.strip()}')
+    if memories:
+        parts.append('Things you remember about the user:\n' + '\n'.join(f'- {memory}' for memory in memories))
+    return '\n\n'.join(part for part in parts if part)
+
+
+class PromptCache:
+    """
+    Compiled system prompts by companion id, least recently used first out.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._prompts = OrderedDict()  # companion id -> (prompt, memory ids, personality id, compiled at)
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a prompt compiled while one ran is not cached
+        self._generation = 0
+
+    def _compile(self, companion_id):
+        companion = Companion.objects.select_related('personality').get(pk=companion_id)
+        memories = []
+        if companion.memory_enabled and self.config['memories']:
+            memories = list(
+                CompanionMemory.objects.filter(companion_id=companion_id)
+                .order_by('-importance', '-last_accessed')
+                .values_list('pk', 'content')[:self.config['memories']]
+            )
+        prompt = compile_prompt(companion, [content for _, content in memories])
+        return prompt, frozenset(memory_id for memory_id, _ in memories), companion.personality_id
+
+    def get(self, companion_id):
+        """
+        The compiled system prompt of a companion.
+        Raises Companion.DoesNotExist for unknown ids.
+        """
+        return self.get_with_memories(companion_id)[0]
+
+    def get_with_memories(self, companion_id):
+        """
+        The compiled system prompt of a companion and the ids of the memories it includes.
+        Raises Companion.DoesNotExist for unknown ids.
+        """
+        with self._lock:
+            entry = self._prompts.get(companion_id)
+            if entry is not None and time.monotonic() - entry[3] < self.config['ttl']:
+                self._prompts.move_to_end(companion_id)
+                return entry[0], entry[1]
+            generation = self._generation
+
+        prompt, memory_ids, personality_id = self._compile(companion_id)
+        with self._lock:
+            if generation == self._generation:
+                self._prompts[companion_id] = (prompt, memory_ids, personality_id, time.monotonic())
+                self._prompts.move_to_end(companion_id)
+                while len(self._prompts) > self.config['max_companions']:
+                    self._prompts.popitem(last=False)
+        return prompt, memory_ids
+
+    def invalidate(self, companion_id=None):
+        with self._lock:
+            self._generation += 1
+            if companion_id is None:
+                self._prompts.clear()
+            else:
+                self._prompts.pop(companion_id, None)
+
+    def invalidate_personality(self, personality_id):
+        with self._lock:
+            self._generation += 1
+            for companion_id in [
+                companion_id for companion_id, entry in self._prompts.items() if entry[2] == personality_id
+            ]:
+                del self._prompts[companion_id]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prompt_cache():
+    """
+    The process-wide prompt cache, configured from settings.COMPANION_PROMPT.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PromptCache()
+    return _cache
+
+
+def system_prompt(companion_id):
+    return get_prompt_cache().get(companion_id)
+
+
+def system_prompt_with_memories(companion_id):
+    return get_prompt_cache().get_with_memories(companion_id)
+
+
+def invalidate_companion(companion_id):
+    # Nothing is cached until the process has compiled a prompt
+    if _cache is not None:
+        _cache.invalidate(companion_id)
+
+
+def invalidate_personality(personality_id):
+    if _cache is not None:
+        _cache.invalidate_personality(personality_id)
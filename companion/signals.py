@@ -0,0 +1,52 @@
+"""
+Signal handlers keeping in-process companion caches consistent with the database.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from chat.writebuffer import messages_written
+from . import memory, presence, prompts
+from .emotions import get_emotion_tagger
+from .models import Companion, CompanionMemory, CompanionMessage, CompanionPersonality
+
+
+@receiver(post_save, sender=CompanionMemory)
+def memory_saved(sender, instance, **kwargs):
+    memory.memory_saved(instance)
+    prompts.invalidate_companion(instance.companion_id)
+
+
+@receiver(post_delete, sender=CompanionMemory)
+def memory_deleted(sender, instance, **kwargs):
+    memory.memory_deleted(instance)
+    prompts.invalidate_companion(instance.companion_id)
+
+
+@receiver(post_save, sender=Companion)
+def companion_saved(sender, instance, **kwargs):
+    prompts.invalidate_companion(instance.pk)
+    presence.companion_saved(instance)
+
+
+@receiver(post_delete, sender=Companion)
+def companion_deleted(sender, instance, **kwargs):
+    prompts.invalidate_companion(instance.pk)
+    presence.companion_deleted(instance)
+
+
+@receiver(post_save, sender=CompanionPersonality)
+@receiver(post_delete, sender=CompanionPersonality)
+def personality_changed(sender, instance, **kwargs):
+    prompts.invalidate_personality(instance.pk)
+
+
+@receiver(post_save, sender=CompanionMessage)
+def message_saved(sender, instance, created, **kwargs):
+    if created and not instance.emotion:
+        transaction.on_commit(lambda: get_emotion_tagger().enqueue([instance]))
+
+
+@receiver(messages_written, sender=CompanionMessage)
+def messages_buffered(sender, messages, **kwargs):
+    get_emotion_tagger().enqueue(messages)
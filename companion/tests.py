@@ -1,3 +1,249 @@
-from django.test import TestCase
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import include, path
+from django.utils import timezone
+from accounts.models import UserProfile
+from chat.backends import FakeChatBackend
+from . import consolidation, presence
+from .memory import get_memory_retriever
+from .prompts import get_prompt_cache, system_prompt
+from .emotions import EmotionTagger, lexicon_classifier
+from .models import Companion, CompanionConversation, CompanionMemory, CompanionMessage, CompanionPersonality
 
-# Create your tests here.
+urlpatterns = [path('companion/', include('companion.urls'))]
+
+
+def make_companion(username):
+    personality, _ = CompanionPersonality.objects.get_or_create(
+        name='Test', defaults={'description': '', 'personality_type': 'friendly', 'system_prompt': 'Be kind.'}
+    )
+    user = User.objects.create_user(username, password='pw')
+    return Companion.objects.create(user=user, name='Buddy', personality=personality)
+
+
+class RecordingBackend(FakeChatBackend):
+    sent = []
+
+    async def stream(self, messages, **kwargs):
+        RecordingBackend.sent = messages
+        async for token in super().stream(messages, **kwargs):
+            yield token
+
+
+def write_now(conversation, messages):
+    # Stands in for the write buffer, which journals to disk
+    saved = Future()
+    saved.set_result(CompanionMessage.objects.bulk_create(messages))
+    return saved
+
+
+def fragile_classifier(texts):
+    if any('glitch' in text for text in texts):
+        raise RuntimeError('Classifier crashed')
+    return lexicon_classifier(texts)
+
+
+@override_settings(COMPANION_EMOTIONS={'CLASSIFIER': 'companion.tests.fragile_classifier'})
+class EmotionTaggerTests(TestCase):
+
+    def test_failing_message_is_tagged_neutral_without_blocking_the_rest(self):
+        conversation = CompanionConversation.objects.create(companion=make_companion('tagged'))
+        messages = [
+            CompanionMessage.objects.create(conversation=conversation, message_type='user', content=content)
+            for content in ('I am so happy today', 'glitch', 'I feel sad and lonely')
+        ]
+        tagger = EmotionTagger(batch_size=10, max_latency=60)
+        self.addCleanup(tagger.close)
+
+        with self.assertLogs('companion.emotions', 'WARNING'):
+            tagger.enqueue(messages)
+            tagger.drain()
+
+        self.assertEqual(
+            list(CompanionMessage.objects.order_by('pk').values_list('emotion', flat=True)), ['joy', 'neutral', 'sadness']
+        )
+        self.assertEqual(len(tagger._pending), 0)
+        conversation.refresh_from_db()
+        self.assertEqual(set(conversation.mood_scores), {'joy', 'neutral', 'sadness'})
+
+
+@override_settings(ROOT_URLCONF='companion.tests', CHAT_BACKEND={'BACKEND': 'companion.tests.RecordingBackend'})
+class SendMessageTests(TestCase):
+
+    def setUp(self):
+        self.companion = make_companion('talker')
+        self.user = self.companion.user
+        UserProfile.objects.update_or_create(user=self.user, defaults={'onboarding_completed': True})
+        self.memory = CompanionMemory.objects.create(
+            companion=self.companion, memory_type='preference', content='Likes green tea in the morning', importance=5
+        )
+        self.client.force_login(self.user)
+        # Rolling back a test sends no signals, so clear the process-wide caches by hand
+        self.addCleanup(get_memory_retriever().invalidate)
+        self.addCleanup(get_prompt_cache().invalidate)
+        patcher = mock.patch('companion.views.get_message_buffer')
+        patcher.start().return_value.add_turn.side_effect = write_now
+        self.addCleanup(patcher.stop)
+
+    def test_reply_uses_the_cached_prompt_and_relevant_memories(self):
+        with mock.patch.object(get_memory_retriever().stats, 'record') as record_access:
+            response = self.client.post('/companion/message/', {'content': 'Which green tea should I buy?'}, secure=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['reply'], 'Here is some help with: Which green tea should I buy?')
+        self.assertEqual(response.json()['memories'], [self.memory.pk])
+        record_access.assert_called_once_with([self.memory.pk], mock.ANY)
+        system = RecordingBackend.sent[0]
+        self.assertEqual(system['role'], 'system')
+        self.assertTrue(system['content'].startswith('Be kind.'))
+        # Already among the memories compiled into the prompt, so not repeated
+        self.assertEqual(system['content'].count('Likes green tea in the morning'), 1)
+        self.assertNotIn('Relevant to this message', system['content'])
+
+        conversation = CompanionConversation.objects.get(pk=response.json()['conversation_id'])
+        self.assertEqual(
+            list(conversation.messages.values_list('message_type', 'content')),
+            [('user', 'Which green tea should I buy?'), ('companion', response.json()['reply'])]
+        )
+
+        # The next turn carries the earlier ones
+        self.client.post('/companion/message/', {'content': 'Thanks!', 'conversation_id': conversation.pk}, secure=True)
+        self.assertEqual(
+            [message['role'] for message in RecordingBackend.sent], ['system', 'user', 'assistant', 'user']
+        )
+
+    def test_relevant_memories_outside_the_prompt_are_added(self):
+        for number in range(5):
+            CompanionMemory.objects.create(
+                companion=self.companion, memory_type='fact', content=f'Plays football on day {number}', importance=9
+            )
+        self.client.post('/companion/message/', {'content': 'Which green tea should I buy?'}, secure=True)
+        system = RecordingBackend.sent[0]['content']
+        self.assertNotIn('Likes green tea', system.split('Relevant to this message:')[0])
+        self.assertIn('Relevant to this message:\n- Likes green tea in the morning', system)
+        self.assertEqual(system.count('Plays football on day 0'), 1)
+
+
+class PromptCacheTests(TestCase):
+
+    def test_compiled_once_until_the_companion_changes(self):
+        companion = make_companion('prompted')
+        self.assertEqual(system_prompt(companion.pk), 'Be kind.\n\nYour name is Buddy.')
+        with self.assertNumQueries(0):
+            system_prompt(companion.pk)
+
+        companion.custom_instructions = 'Answer in French.'
+        companion.save()
+        self.assertIn('Instructions from the user:\nAnswer in French.', system_prompt(companion.pk))
+
+
+class ConsolidationTests(TestCase):
+
+    def setUp(self):
+        self.companion = make_companion('consolidated')
+        now = timezone.now()
+        self.keeper = CompanionMemory.objects.create(
+            companion=self.companion, memory_type='preference', content='Likes green tea in the morning',
+            importance=5, access_count=3, last_accessed=now - timedelta(days=1)
+        )
+        self.duplicate = CompanionMemory.objects.create(
+            companion=self.companion, memory_type='preference', content='Likes green tea in the morning',
+            importance=2, access_count=4, last_accessed=now - timedelta(days=2), created_at=now - timedelta(days=9)
+        )
+        self.stale = CompanionMemory.objects.create(
+            companion=self.companion, memory_type='fact', content='Has a cat called Miso',
+            importance=3, last_accessed=now - timedelta(days=60)
+        )
+
+    def test_merges_and_decays_relative_to_stored_values(self):
+        real_merge = consolidation._merge_duplicates
+
+        def merge_during_access_flush(*args):
+            # Access statistics flushed after the memories were read
+            CompanionMemory.objects.filter(pk=self.keeper.pk).update(access_count=F('access_count') + 10)
+            CompanionMemory.objects.filter(pk=self.stale.pk).update(importance=F('importance') + 1)
+            return real_merge(*args)
+
+        with mock.patch.object(consolidation, '_merge_duplicates', merge_during_access_flush):
+            result = consolidation.consolidate_companions([self.companion.pk])
+
+        self.assertEqual((result.examined, result.merged, result.decayed, result.evicted), (3, 1, 1, 0))
+        self.assertFalse(CompanionMemory.objects.filter(pk=self.duplicate.pk).exists())
+        self.keeper.refresh_from_db()
+        self.assertEqual(self.keeper.access_count, 3 + 4 + 10)
+        self.assertEqual(self.keeper.importance, 5)
+        self.assertEqual(self.keeper.created_at, self.duplicate.created_at)
+        self.stale.refresh_from_db()
+        self.assertEqual(self.stale.importance, 3 + 1 - 1)
+
+    def test_evicts_down_to_the_budget(self):
+        config = {**consolidation.get_config(), 'max_memories_per_companion': 1}
+        result = consolidation.consolidate_companions([self.companion.pk], config)
+        self.assertEqual((result.merged, result.evicted), (1, 1))
+        self.assertEqual(list(CompanionMemory.objects.values_list('pk', flat=True)), [self.keeper.pk])
+
+
+@override_settings(ROOT_URLCONF='companion.tests')
+class PresenceTests(TestCase):
+
+    def setUp(self):
+        self.companion = make_companion('present')
+        self.now = 1000.0
+        clock = mock.patch.object(presence, 'time', mock.Mock(monotonic=lambda: self.now))
+        clock.start()
+        self.addCleanup(clock.stop)
+        # Flushed by hand; the background thread only wakes on close
+        self.registry = presence.PresenceRegistry(ttl=90, flush_interval=3600)
+        self.addCleanup(self.registry.close)
+        for target in ('companion.presence.get_presence_registry', 'companion.views.get_presence_registry'):
+            patcher = mock.patch(target, return_value=self.registry)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stored_status(self):
+        return Companion.objects.values_list('status', flat=True).get(pk=self.companion.pk)
+
+    def test_goes_offline_after_missed_heartbeats(self):
+        self.registry.heartbeat(self.companion.pk, 'busy')
+        self.now += 60
+        self.registry.heartbeat(self.companion.pk, 'busy')
+        self.now += 89
+        self.assertEqual(self.registry.get_status(self.companion.pk), 'busy')
+        self.registry.flush()
+        self.assertEqual(self.stored_status(), 'busy')
+
+        self.now += 1
+        self.assertEqual(self.registry.get_status(self.companion.pk), 'offline')
+        self.assertEqual(self.registry.live(), {'available': [], 'busy': []})
+        self.registry.expire()
+        self.registry.flush()
+        self.assertEqual(self.stored_status(), 'offline')
+
+    def test_disconnect_takes_effect_at_once(self):
+        self.registry.heartbeat(self.companion.pk)
+        self.registry.flush()
+        self.registry.disconnect(self.companion.pk)
+        self.assertEqual(self.registry.get_status(self.companion.pk), 'offline')
+        self.registry.flush()
+        self.assertEqual(self.stored_status(), 'offline')
+
+    def test_status_endpoint_follows_heartbeats_and_maintenance(self):
+        UserProfile.objects.update_or_create(user=self.companion.user, defaults={'onboarding_completed': True})
+        self.client.force_login(self.companion.user)
+
+        def shown():
+            return self.client.get('/companion/presence/', secure=True).json()['status']
+
+        self.assertEqual(shown(), 'offline')
+        self.client.post('/companion/presence/heartbeat/', {'status': 'busy'}, secure=True)
+        self.assertEqual(shown(), 'busy')
+        self.client.post('/companion/presence/disconnect/', secure=True)
+        self.assertEqual(shown(), 'offline')
+
+        self.client.post('/companion/presence/heartbeat/', secure=True)
+        Companion.objects.filter(pk=self.companion.pk).update(status='maintenance')
+        self.assertEqual(shown(), 'maintenance')
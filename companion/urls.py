@@ -6,4 +6,8 @@ app_name = 'companion'
 urlpatterns = [
     path('', dashboard, name='dashboard'),
     path('my-companion/', my_companion, name='my-companion'),
+    path('message/', send_message, name='message'),
+    path('presence/', presence_status, name='presence'),
+    path('presence/heartbeat/', presence_heartbeat, name='presence-heartbeat'),
+    path('presence/disconnect/', presence_disconnect, name='presence-disconnect'),
 ]
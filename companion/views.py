@@ -1,5 +1,21 @@
+import math
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from aivi.quotas import QuotaExceeded, charge_quota, check_quota
+from chat.backends import get_chat_backend
+from chat.context import count_tokens
+from chat.writebuffer import get_message_buffer
+from .memory import retrieve_memories
+from .models import Companion, CompanionConversation, CompanionMessage
+from .presence import LIVE_STATUSES, companion_status, get_presence_registry
+from .prompts import system_prompt_with_memories
+
+# Earlier messages of the conversation sent along with each new one
+HISTORY_MESSAGES = 20
 
 # Create your views here.
 @login_required
@@ -14,4 +30,128 @@ def dashboard(request):
     context = {
         'page_name': page_name
     }
-    return render(request, 'chat/companion.html', context)
\ No newline at end of file
+    return render(request, 'chat/companion.html', context)
+
+
+def _companion_id(request):
+    # Kept in the session so heartbeats do not query the companion table
+    companion_id = request.session.get('companion_id')
+    if companion_id is None:
+        companion_id = Companion.objects.filter(user=request.user).values_list('pk', flat=True).first()
+        if companion_id is not None:
+            request.session['companion_id'] = companion_id
+    return companion_id
+
+
+@login_required
+@require_POST
+def presence_heartbeat(request):
+    """Report the user's companion as live; `status` is available (default) or busy"""
+    companion_id = _companion_id(request)
+    if companion_id is None:
+        return JsonResponse({'error': 'Companion not found.'}, status=404)
+    status = request.POST.get('status', 'available')
+    if status not in LIVE_STATUSES:
+        return JsonResponse({'error': f"Status must be one of: {', '.join(LIVE_STATUSES)}."}, status=400)
+    registry = get_presence_registry()
+    registry.heartbeat(companion_id, status)
+    return JsonResponse({'status': status, 'ttl': registry.ttl})
+
+
+@login_required
+@require_POST
+def presence_disconnect(request):
+    """Take the user's companion offline, e.g. when the page is closed"""
+    companion_id = _companion_id(request)
+    if companion_id is None:
+        return JsonResponse({'error': 'Companion not found.'}, status=404)
+    get_presence_registry().disconnect(companion_id)
+    return JsonResponse({'status': 'offline'})
+
+
+@login_required
+def presence_status(request):
+    """The status to show for the user's companion: maintenance, or its live presence"""
+    companion = Companion.objects.filter(user=request.user).only('pk', 'status').first()
+    if companion is None:
+        return JsonResponse({'error': 'Companion not found.'}, status=404)
+    return JsonResponse({'status': companion_status(companion)})
+
+
+async def _collect_reply(messages):
+    return [token async for token in get_chat_backend().stream(messages)]
+
+
+@login_required
+@require_POST
+def send_message(request):
+    """
+    Post a message to the user's companion and return its reply.
+
+    The companion answers from its cached system prompt plus the memories
+    most relevant to the message that the prompt does not already include;
+    retrieving them counts as an access. Both
+    messages are stored through the message write buffer. Responds 429 when
+    the user is over their token quota.
+    """
+    content = request.POST.get('content', '').strip()
+    if not content:
+        return JsonResponse({'error': 'Message content is required.'}, status=400)
+    companion = Companion.objects.filter(user=request.user).only('pk', 'memory_enabled').first()
+    if companion is None:
+        return JsonResponse({'error': 'Companion not found.'}, status=404)
+    try:
+        check_quota(request.user, count_tokens(content))
+    except QuotaExceeded as e:
+        response = JsonResponse({'error': str(e)}, status=429)
+        response['Retry-After'] = str(math.ceil(e.retry_after))
+        return response
+
+    conversation_id = request.POST.get('conversation_id')
+    if conversation_id:
+        try:
+            conversation = CompanionConversation.objects.get(pk=conversation_id, companion=companion)
+        except (CompanionConversation.DoesNotExist, ValueError):
+            return JsonResponse({'error': 'Conversation not found.'}, status=404)
+    else:
+        conversation = CompanionConversation.objects.create(companion=companion, title=content[:50])
+
+    memories = retrieve_memories(companion, content)
+    system, remembered = system_prompt_with_memories(companion.pk)
+    # Memories the cached prompt already carries are not repeated
+    relevant = [memory for memory in memories if memory.memory_id not in remembered]
+    if relevant:
+        system += '\n\nRelevant to this message:\n' + '\n'.join(f'- {memory.content}' for memory in relevant)
+    history = [{'role': 'system', 'content': system}]
+    if conversation.summary:
+        history.append({'role': 'system', 'content': f'Summary of the earlier conversation:\n{conversation.summary}'})
+    recent = conversation.messages.exclude(message_type='system').order_by('-pk').values_list('message_type', 'content')
+    history += [
+        {'role': 'user' if message_type == 'user' else 'assistant', 'content': text}
+        for message_type, text in reversed(list(recent[:HISTORY_MESSAGES]))
+    ]
+    history.append({'role': 'user', 'content': content})
+
+    try:
+        tokens = async_to_sync(_collect_reply)(history)
+    except Exception:
+        return JsonResponse({'error': 'Your companion could not reply.'}, status=502)
+    reply = ''.join(tokens)
+    saved = get_message_buffer().add_turn(conversation, [
+        CompanionMessage(
+            conversation=conversation, message_type='user', content=content,
+            context={'memories': [memory.memory_id for memory in memories]}
+        ),
+        CompanionMessage(conversation=conversation, message_type='companion', content=reply),
+    ])
+    charge_quota(request.user.pk, sum(count_tokens(message['content']) for message in history) + len(tokens), logged=False)
+    try:
+        saved_messages = saved.result(settings.CHAT_SAVE_TIMEOUT)
+    except Exception:
+        return JsonResponse({'error': 'The message could not be saved.'}, status=503)
+    return JsonResponse({
+        'conversation_id': conversation.pk,
+        'message_id': saved_messages[-1].pk,
+        'reply': reply,
+        'memories': [memory.memory_id for memory in memories],
+    })
@@ -42,6 +42,7 @@ MIDDLEWARE = [
     'accounts.middleware.AuthenticationMiddleware',
     'accounts.middleware.ProfileCompletionMiddleware',
     'accounts.middleware.SecurityHeadersMiddleware',
+    'accounts.middleware.HashingBusyMiddleware',
 ]
 
 ROOT_URLCONF = 'sua_pa_ai.urls'
@@ -112,6 +113,174 @@ LOGIN_URL = '/accounts/signin/'
 LOGIN_REDIRECT_URL = '/accounts/dashboard/'
 LOGOUT_REDIRECT_URL = '/accounts/signin/'
 
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.PooledModelBackend',
+]
+
+# Password hashing settings
+# The first hasher is used for new hashes; the others only verify existing
+# hashes, which are upgraded in the background on the next successful login.
+PASSWORD_HASHERS = [
+    'accounts.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = None  # PBKDF2 work factor; None or anything lower uses Django's default
+PASSWORD_HASH_WORKERS = None  # Defaults to the number of CPU cores
+PASSWORD_HASH_QUEUE_SIZE = 64  # Verifications allowed to wait for a free worker
+PASSWORD_HASH_QUEUE_TIMEOUT = 5  # Seconds to wait for a queue slot before giving up
+
+# Seconds a user's effective plan may be cached before it is recomputed,
+# even if no subscription or premium expiry falls due sooner
+ENTITLEMENT_CACHE_TTL = 300
+
+# Model backend used to generate chat replies
+CHAT_BACKEND = {
+    'BACKEND': 'chat.backends.FakeChatBackend',
+    'OPTIONS': {
+        'first_token_delay': 0.2,
+        'token_delay': 0.02,
+    },
+}
+
+# Token budget for the message history sent with each chat turn
+CHAT_CONTEXT_TOKENS = 3000
+
+# Write-behind buffer for conversation messages: rows are flushed in one
+# transaction once max_batch rows are queued or the oldest waited max_latency seconds
+MESSAGE_WRITE_BUFFER = {
+    'max_batch': 500,
+    'max_latency': 0.05,
+    'journal_dir': os.path.join(BASE_DIR, 'var', 'message_journal'),
+    'fsync': False,
+}
+
+# Seconds a chat reply waits for its messages to be written before reporting an error
+CHAT_SAVE_TIMEOUT = 10
+
+# Callable that folds archived messages into a conversation's rolling summary
+CONVERSATION_SUMMARIZER = 'chat.compaction.extractive_summary'
+
+# Responses cached per (model, system prompt, prompt, temperature); ttl in seconds
+RESPONSE_CACHE = {
+    'max_entries': 10000,
+    'ttl': 3600,
+}
+
+# Model gateway: provider client per AIModel.provider (unlisted providers use the mock,
+# which answers through CHAT_BACKEND), and per-model limits: concurrent requests,
+# tokens per minute (None for no limit), requests allowed to wait and seconds they may
+# wait; complete responses from batching providers are collected into calls of up to
+# max_batch requests, waiting at most max_batch_wait seconds; LIMITS overrides all of
+# these per model_id. E.g. PROVIDERS = {'openai': {'BACKEND':
+# 'aivi.gateway.HTTPProvider', 'OPTIONS': {'api_key': os.environ.get('OPENAI_API_KEY')}}}
+MODEL_GATEWAY = {
+    'PROVIDERS': {},
+    'DEFAULT_PROVIDER': {'BACKEND': 'aivi.gateway.MockProvider', 'OPTIONS': {}},
+    'concurrency': 8,
+    'tokens_per_minute': None,
+    'max_queue': 100,
+    'queue_timeout': 30,
+    'max_batch': 16,
+    'max_batch_wait': 0.005,
+    'LIMITS': {},
+}
+
+# Pending AIRequest processing: requests claimed per batch, seconds a claim lasts unless
+# renewed, attempts before a request fails, and retry delay doubling from retry_backoff
+# up to max_backoff seconds
+AI_REQUEST_QUEUE = {
+    'batch_size': 20,
+    'lease_seconds': 120,
+    'max_attempts': 3,
+    'retry_backoff': 5,
+    'max_backoff': 300,
+    'poll_interval': 1.0,
+}
+
+# Daily AIUsageLog counters: seconds between flushes of the in-memory totals, and the
+# journal that keeps unflushed usage across crashes
+AI_USAGE_ACCUMULATOR = {
+    'flush_interval': 10,
+    'journal_dir': os.path.join(BASE_DIR, 'var', 'usage_journal'),
+    'fsync': False,
+}
+
+# Token quotas per plan per calendar day and month (None for unlimited), seconds between
+# syncs of the in-memory counters with AIUsageLog, and seconds the first checks of a
+# process wait for the counters to be seeded
+TOKEN_QUOTAS = {
+    'PLANS': {
+        'free': {'day': 20000, 'month': 200000},
+        'basic': {'day': 100000, 'month': 2000000},
+        'premium': {'day': 500000, 'month': 10000000},
+        'enterprise': {'day': None, 'month': None},
+    },
+    'resync_interval': 300,
+    'seed_timeout': 5,
+}
+
+# Paraphrase cache per bot or template: cosine similarity threshold, LRU cap per scope, ttl in seconds
+SEMANTIC_CACHE = {
+    'INDEX': 'aivi.semantic.InvertedIndex',
+    'threshold': 0.85,
+    'max_entries_per_scope': 5000,
+    'ttl': 86400,
+}
+
+# BM25 index over each bot's knowledge base, chunked into overlapping word windows
+KNOWLEDGE_INDEX = {
+    'directory': os.path.join(BASE_DIR, 'var', 'knowledge_index'),
+    'chunk_words': 200,
+    'chunk_overlap': 40,
+    'max_segments': 8,
+    'read_size': 64 * 1024,  # Bytes read from an upload at a time
+    'ingestion_workers': 1,  # Background threads indexing saved entries
+}
+
+# Companion memory retrieval: score weights, recency half-life, cached companions and
+# seconds between bulk writes of access counts; consolidation: per-companion budget,
+# similarity at which memories merge, and days unused before importance decays
+COMPANION_MEMORY = {
+    'weights': {'recency': 1.0, 'importance': 1.0, 'similarity': 1.0},
+    'recency_half_life_hours': 72,
+    'max_importance': 10,
+    'flush_interval': 5,
+    'max_companions': 1000,
+    'ttl': 300,
+    'max_memories_per_companion': 500,
+    'duplicate_threshold': 0.9,
+    'stale_after_days': 30,
+}
+
+# Compiled companion system prompts: memories included, cached companions and seconds
+# before a compiled prompt is rebuilt
+COMPANION_PROMPT = {
+    'memories': 5,
+    'max_companions': 1000,
+    'ttl': 300,
+}
+
+# Companion presence: seconds without a heartbeat before a companion goes offline,
+# seconds between writes of status changes, and the broker relaying heartbeats
+# between processes (e.g. 'companion.presence.LocalBroker'; None keeps them local)
+COMPANION_PRESENCE = {
+    'ttl': 90,
+    'flush_interval': 5,
+    'BROKER': None,
+}
+
+# Companion message emotion tagging: classifier (a callable from texts to emotions),
+# messages per batch, seconds a message may wait, and user messages per mood half-life
+COMPANION_EMOTIONS = {
+    'CLASSIFIER': 'companion.emotions.lexicon_classifier',
+    'batch_size': 200,
+    'max_latency': 2.0,
+    'mood_half_life': 10,
+}
+
 # Session settings
 SESSION_COOKIE_AGE = 86400  # 24 hours
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS